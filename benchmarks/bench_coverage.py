@@ -0,0 +1,41 @@
+"""hmm coverage : timing of the interval union against the former per-position set.
+
+Both give the same coverage, see tests/test_intervals.py. Run it from the repository root.
+
+    python benchmarks/bench_coverage.py --cases 20000 --length 400 --domains 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pyCALF.utils import intervals
+from tests.test_intervals import per_position_coverage, random_spans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=20000)
+    parser.add_argument('--length', type=int, default=400)
+    parser.add_argument('--domains', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.cases):
+        length = rng.randrange(1, args.length)
+        cases.append((length, random_spans(rng, length, rng.randrange(0, args.domains))))
+
+    print("implementation\tseconds")
+    for name, func in [("per_position", per_position_coverage), ("intervals", lambda l, s: intervals.coverage(s, l))]:
+        start = time.perf_counter()
+        for length, spans in cases:
+            func(length, spans)
+        print("%s\t%.3f" % (name, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
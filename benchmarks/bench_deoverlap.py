@@ -0,0 +1,40 @@
+"""glyzip deoverlap : timing of the sweep implementation against the former per-residue scan.
+
+Both give the same segments, see tests/test_deoverlap.py. Run it from the repository root.
+
+    python benchmarks/bench_deoverlap.py --cases 2000 --length 1500 --domains 30
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pyCALF.core import annotcter as cter
+from tests.test_deoverlap import per_residue_segments, random_hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--length', type=int, default=1500)
+    parser.add_argument('--domains', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.cases):
+        length = rng.randrange(1, args.length)
+        cases.append((range(0, length), random_hits(rng, length, rng.randrange(0, args.domains))))
+
+    for name, func in [("per-residue", per_residue_segments), ("sweep", cter.bestsegments)]:
+        t0 = time.perf_counter()
+        for region, hits in cases:
+            func(region, hits)
+        print("%s\t%.3f s" % (name, time.perf_counter() - t0))
+
+
+if __name__ == "__main__":
+    main()
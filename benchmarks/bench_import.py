@@ -0,0 +1,79 @@
+"""startup benchmark : import time of pycalf and of its commands.
+
+Each module is imported in a fresh interpreter under `python -X importtime`, the cumulative
+import time of the top-level modules is reported, as well as the wall time of `--help`.
+The run fails if one of these modules pulls in a heavy dependency (pandas, numpy, pyhmmer,
+biopython) or if the import of pyCALF.main takes longer than --budget-ms. Run it from the
+repository root (or with pyCALF installed).
+
+    python benchmarks/bench_import.py --repeat 5 --budget-ms 150
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = ["pyCALF.main", "pyCALF.core.client", "pyCALF.utils.writers"]
+HEAVY = ("pandas", "numpy", "pyhmmer", "Bio")
+
+
+def importtime(module):
+    """import time (ms) of a module in a fresh interpreter and the modules it imports"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        check=True, capture_output=True, text=True
+    ).stderr
+    total = 0
+    modules = []
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.append(name.strip())
+        # top-level imports of the statement are not indented (nested ones are)
+        if name.startswith(" pyCALF"):
+            total += int(cumulative) / 1000
+    return total, modules
+
+
+def helptime():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "pyCALF.main", "--help"], check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', dest='budget_ms', type=float, default=150,
+                        help="maximal median import time of pyCALF.main")
+    parser.add_argument('--output', default=None, help="json file of the results")
+    args = parser.parse_args()
+
+    results = {}
+    failed = []
+    for module in MODULES:
+        runs = [importtime(module) for _ in range(args.repeat)]
+        total = statistics.median(t for t, _ in runs)
+        heavy = sorted({name.split(".")[0] for name in runs[0][1] if name.split(".")[0] in HEAVY})
+        results[module] = {"import_ms" : total, "heavy" : heavy}
+        print("%s\t%.1f ms\t%s" % (module, total, ",".join(heavy) or "no heavy dependency"))
+        if heavy:
+            failed.append("%s imports %s" % (module, ",".join(heavy)))
+    results["help_ms"] = statistics.median(helptime() for _ in range(args.repeat))
+    print("pycalf --help\t%.1f ms" % results["help_ms"])
+    if results["pyCALF.main"]["import_ms"] > args.budget_ms:
+        failed.append("pyCALF.main import above %s ms" % args.budget_ms)
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=2)
+    if failed:
+        sys.exit("; ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
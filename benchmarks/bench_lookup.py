@@ -0,0 +1,59 @@
+"""filtersequences timing as the input grows, for a fixed number of GlyX3 hits.
+
+    python benchmarks/bench_lookup.py --sizes 10000 100000 1000000 --hits 2000
+"""
+import argparse
+import random
+import time
+
+import pyhmmer.easel
+
+from pyCALF.core import annotcter as cter
+from pyCALF.utils import utils as u
+
+
+def random_sequences(n, length=300, seed=42):
+    rng = random.Random(seed)
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    residues = "ACDEFGHIKLMNPQRSTVWY"
+    # one random residue string shared by all sequences, only names matter here
+    text = "".join(rng.choice(residues) for _ in range(length))
+    return [
+        pyhmmer.easel.TextSequence(name=b"seq_%i" % i, sequence=text).digitize(alphabet)
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument('--hits', type=int, default=2000)
+    parser.add_argument('--linear', action="store_true",
+                        help="also time the former linear getseqbyname scan")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print("sequences\thits\tindex_build_s\tfilter_s\tlinear_s")
+    for n in args.sizes:
+        sequences = random_sequences(n)
+        hits = [
+            u.Hit(seqid=b"seq_%i" % i, domid="GlyX3", coverage=1)
+            for i in rng.sample(range(n), min(args.hits, n))
+        ]
+        t0 = time.perf_counter()
+        index = u.SequenceIndex(sequences)
+        t1 = time.perf_counter()
+        cter.filtersequences(index, hits)
+        t2 = time.perf_counter()
+        linear = "-"
+        if args.linear:
+            for h in hits:
+                for s in sequences:
+                    if s.name == h.seqid:
+                        break
+            linear = "%.3f" % (time.perf_counter() - t2)
+        print("%i\t%i\t%.3f\t%.4f\t%s" % (n, len(hits), t1 - t0, t2 - t1, linear))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""N-ter search benchmark over reference sets of growing size.
+
+For each size, N-ter references are generated from nterdb.fasta variants (mutated at --divergence)
+and queries are calcyanin-like sequences whose N-ter is a mutated copy of a known reference.
+The k-mer index is built (and reloaded) once per size, then queries are searched with phmmer
+against the candidate references of the index, and against every reference for sizes up to
+--full-max. Only the best alignment of each query is kept during the search. The run fails if
+the indexed search finds the source reference of fewer than --min-recall of the queries.
+
+    python benchmarks/bench_nter.py --sizes 100 10000 100000 --queries 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import pyhmmer
+
+from pyCALF.core import annotnter as nter
+from pyCALF.utils import kmerindex
+from pyCALF.utils import synthetic
+
+
+def digitize(records):
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    return [
+        pyhmmer.easel.TextSequence(name=name.encode(), sequence=seq).digitize(alphabet)
+        for name, seq in records
+    ]
+
+
+def dataset(n, queries, divergence, seed):
+    """references and queries (name, sequence), with the source reference of each query"""
+    generator = synthetic.Generator(seed=seed)
+    rng = random.Random(seed)
+    refs = [
+        ("ref_%i" % i, synthetic.mutate(rng.choice(generator.nter), divergence, rng))
+        for i in range(n)
+    ]
+    sources = {}
+    records = []
+    for i in range(queries):
+        name, seq = rng.choice(refs)
+        query = "query_%i" % i
+        sources[query] = name
+        # close variant of the source reference, linker and GlyX3 region
+        records.append((query, "".join([
+            synthetic.mutate(seq, generator.mutation_rate, rng),
+            synthetic.randomseq(rng.randint(5, 30), rng),
+            synthetic.mutate(rng.choice(generator.glyx3), generator.mutation_rate, rng),
+        ])))
+    return refs, records, sources
+
+
+def search(queries, refs, args, index=None):
+    best = nter.BestHits(1, args.nter_evalue, args.nter_coverage)
+    start = time.perf_counter()
+    rows = nter.phmmer(
+        queries, refs, args.nter_evalue, cpus=args.threads,
+        index=index, candidates=args.candidates, best=best
+    ) or []
+    wall = time.perf_counter() - start
+    return {r["qacc"] : r["sacc"] for r in rows}, wall, best.seen
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--divergence', type=float, default=0.3,
+                        help="mutation rate of the references from the nterdb variants")
+    parser.add_argument('--candidates', type=int, default=32)
+    parser.add_argument('--full-max', dest='full_max', type=int, default=10000,
+                        help="largest reference set also searched without index")
+    parser.add_argument('--nter-evalue', dest='nter_evalue', type=float, default=1e-7)
+    parser.add_argument('--nter-coverage', dest='nter_coverage', type=float, default=80)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default="bench")
+    parser.add_argument('--min-recall', dest='min_recall', type=float, default=0.9)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    failed = False
+    print("references\tindex_build_s\tindex_load_s\tindexed_s\tindexed_alignments\trecall\tfull_s\tfull_alignments\tagreement")
+    for n in args.sizes:
+        refs, queries, sources = dataset(n, args.queries, args.divergence, args.seed)
+        refs, queries = digitize(refs), digitize(queries)
+        f = os.path.join(args.workdir, "nterrefs_%i.k%i.pcki" % (n, kmerindex.K))
+        start = time.perf_counter()
+        kmerindex.write(f, refs)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        index = kmerindex.KmerIndex(f)
+        load = time.perf_counter() - start
+
+        indexed, wall, seen = search(queries, refs, args, index)
+        recall = sum(1 for q, s in sources.items() if indexed.get(q) == s) / len(sources)
+        failed = failed or recall < args.min_recall
+        result = {
+            "references" : n, "queries" : len(queries),
+            "index_build" : build, "index_load" : load,
+            "indexed" : wall, "indexed_alignments" : seen, "recall" : recall,
+        }
+        if n <= args.full_max:
+            full, result["full"], result["full_alignments"] = search(queries, refs, args)
+            # queries with the same best reference with and without index
+            result["agreement"] = sum(1 for q in sources if indexed.get(q) == full.get(q)) / len(sources)
+        print("%i\t%.2f\t%.4f\t%.2f\t%i\t%.3f\t%s\t%s\t%s" % (
+            n, build, load, wall, seen, recall,
+            "%.2f" % result["full"] if "full" in result else "-",
+            result.get("full_alignments", "-"),
+            "%.3f" % result["agreement"] if "agreement" in result else "-",
+        ), flush=True)
+        results.append(result)
+
+    with open(os.path.join(args.workdir, "bench_nter.json"), "w") as stream:
+        json.dump(results, stream, indent=2)
+    if failed:
+        sys.exit("indexed N-ter search recall below %s" % args.min_recall)
+
+
+if __name__ == "__main__":
+    main()
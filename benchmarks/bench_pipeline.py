@@ -0,0 +1,94 @@
+"""end-to-end benchmark on synthetic proteomes.
+
+For each size, a proteome with planted calcyanin-like sequences is generated (once, kept in
+--workdir), pycalf is run in a separate process and its metrics.json is collected: wall/CPU time
+and peak RSS of each stage and hmmsearch throughput. The run fails if planted calcyanins are
+not recovered.
+
+    python benchmarks/bench_pipeline.py --sizes 10000 1000000 10000000 --block-size 100000
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+
+from pyCALF.utils import synthetic
+
+
+def proteome(workdir, n, planted, seed):
+    fasta = os.path.join(workdir, "synthetic_%i.faa.gz" % n)
+    names = fasta + ".planted"
+    if not (os.path.exists(fasta) and os.path.exists(names)):
+        print("generating %s ..." % fasta, flush=True)
+        planted = synthetic.writeproteome(fasta, n, planted=planted, nterdecoys=planted, seed=seed)
+        with open(names, "w") as stream:
+            stream.write("\n".join(planted) + "\n")
+    with open(names) as stream:
+        return fasta, [i.strip() for i in stream if i.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs="+", default=[10000])
+    parser.add_argument('--workdir', default="bench")
+    parser.add_argument('--planted', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--block-size', dest='block_size', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--nter-backend', dest='nter_backend', default="phmmer")
+    parser.add_argument('--min-recall', dest='min_recall', type=float, default=0.95)
+    parser.add_argument('extra', nargs="*", help="extra pycalf arguments (after --)")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    failed = False
+    for n in args.sizes:
+        fasta, planted = proteome(args.workdir, n, args.planted, args.seed)
+        res_dir = os.path.join(args.workdir, "run_%i" % n)
+        command = [
+            sys.executable, "-m", "pyCALF.main",
+            "-i", fasta, "-o", res_dir,
+            "--threads", str(args.threads),
+            "--nter-backend", args.nter_backend,
+        ] + (["--block-size", str(args.block_size)] if args.block_size else []) + args.extra
+        print(" ".join(command), flush=True)
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+        with open(os.path.join(res_dir, "metrics.json")) as stream:
+            metrics = json.load(stream)
+        with open(os.path.join(res_dir, "summary.csv")) as stream:
+            flags = {row["accession"] : row["flag"] for row in csv.DictReader(stream, delimiter=";")}
+        recovered = [i for i in planted if flags.get(i, "").startswith(("Calcyanin", "Atypical"))]
+        false_positives = [
+            i for i, flag in flags.items()
+            if not i.startswith("calcyanin_") and flag.startswith("Calcyanin")
+        ]
+        recall = len(recovered) / len(planted) if planted else 1
+        failed = failed or recall < args.min_recall
+
+        print("\n%i sequences : %.1fs, %.0f MB peak RSS, recall %.3f (%i/%i), %i false positives" % (
+            n, metrics["wall"], metrics["peak_rss_mb"], recall, len(recovered), len(planted), len(false_positives)))
+        print("stage\twall_s\tcpu_s\tsequences/s")
+        for stage, values in metrics["stages"].items():
+            print("%s\t%.2f\t%.2f\t%.3g" % (stage, values["wall"], values["cpu"], n / values["wall"] if values["wall"] else 0))
+        for search in metrics["searches"]:
+            print("hmmsearch %s\t%i sequences\t%.3g residues/s" % (
+                ",".join(search["queries"]), search["sequences"], search["residues_per_sec"] or 0))
+        results.append({
+            "sequences" : n,
+            "recall" : recall,
+            "false_positives" : len(false_positives),
+            "metrics" : metrics,
+        })
+
+    with open(os.path.join(args.workdir, "bench_pipeline.json"), "w") as stream:
+        json.dump(results, stream, indent=2)
+    if failed:
+        sys.exit("planted calcyanins recall below %s" % args.min_recall)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""load time and peak RSS of fasta parsing versus a pre-digitized sequence store.
+
+Each loader runs in a fresh process, so peak RSS is not shared between them. The store is
+written once next to the input (input + ".pcs").
+
+    python benchmarks/bench_seqstore.py -i proteins.faa.gz --block-size 100000
+    python benchmarks/bench_seqstore.py -n 1000000
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from pyCALF.utils import inputs
+from pyCALF.utils import metrics
+from pyCALF.utils import seqstore
+from pyCALF.utils import synthetic
+from pyCALF.utils import utils as u
+
+
+def load(kind, f, blocksize, results):
+    start = time.perf_counter()
+    n = residues = 0
+    if kind == "easelfasta":
+        blocks = [u.easelfasta(f)]
+    elif kind == "fasta":
+        blocks = inputs.readblocks(f, blocksize)
+    else:
+        blocks = seqstore.SequenceStore(f).blocks(blocksize)
+    for block in blocks:
+        n += len(block)
+        residues += sum(len(s) for s in block)
+    results.put((n, residues, time.perf_counter() - start, metrics.peak_rss()))
+
+
+def measure(kind, f, blocksize):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=load, args=(kind, f, blocksize, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='input', default=None, help="protein fasta file (default: synthetic proteome)")
+    parser.add_argument('-n', type=int, default=100000, help="synthetic proteome size")
+    parser.add_argument('--block-size', dest='block_size', type=int, default=None)
+    parser.add_argument('--workdir', default="bench")
+    args = parser.parse_args()
+
+    fasta = args.input
+    if fasta is None:
+        os.makedirs(args.workdir, exist_ok=True)
+        fasta = os.path.join(args.workdir, "synthetic_%i.faa.gz" % args.n)
+        if not os.path.exists(fasta):
+            synthetic.writeproteome(fasta, args.n)
+    store = fasta + ".pcs"
+    if not os.path.exists(store) or os.path.getmtime(store) < os.path.getmtime(fasta):
+        start = time.perf_counter()
+        seqstore.write(store, inputs.readblocks(fasta, 100000))
+        print("packed %s in %.2fs" % (store, time.perf_counter() - start))
+    print("fasta %.1f MB, store %.1f MB" % (os.path.getsize(fasta) / 1024**2, os.path.getsize(store) / 1024**2))
+
+    multiprocessing.set_start_method("spawn")
+    print("loader\tsequences\tresidues\tseconds\tsequences/s\tpeak_rss_mb")
+    for kind, f in [("easelfasta", fasta), ("fasta", fasta), ("store", store)]:
+        if kind == "easelfasta" and args.block_size:
+            continue
+        n, residues, seconds, rss = measure(kind, f, args.block_size)
+        print("%s\t%i\t%i\t%.2f\t%.3g\t%.0f" % (kind, n, residues, seconds, n / seconds if seconds else 0, rss))
+
+
+if __name__ == "__main__":
+    main()
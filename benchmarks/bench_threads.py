@@ -0,0 +1,44 @@
+"""GlyX3 search scaling from 1 to N workers.
+
+    python benchmarks/bench_threads.py -i proteins.faa --workers 1 2 4 8 16 --backend threads
+"""
+import argparse
+import os
+import time
+
+from pyCALF.core import annotcter as cter
+from pyCALF.utils import parallel
+from pyCALF.utils import utils as u
+
+DATASDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pyCALF', 'datas')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='input', required=True, help="protein fasta file")
+    parser.add_argument('--workers', type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--backend', choices=["threads", "processes"], default="threads")
+    parser.add_argument('--hmm', default=os.path.join(DATASDIR, "GlyX3.hmm"))
+    args = parser.parse_args()
+
+    sequences = u.easelfasta(args.input)
+    residues = sum(len(s) for s in sequences)
+    hmm = u.easelhmm(args.hmm)
+    print("%i sequences, %i residues" % (len(sequences), residues))
+    print("workers\tseconds\tspeedup\tresidues/s\thits")
+
+    reference = None
+    for workers in args.workers:
+        with parallel.ShardExecutor(workers, args.backend) as executor:
+            t0 = time.perf_counter()
+            hits = executor.run(cter.findglyx3, sequences, hmm, cpus=1, domZ=10000, Z=len(sequences))
+            elapsed = time.perf_counter() - t0
+        found = sorted((u.tostr(h.seqid), h.evalue) for h in hits)
+        if reference is None:
+            reference = (elapsed, found)
+        assert found == reference[1], "hits differ with %i workers" % workers
+        print("%i\t%.2f\t%.2f\t%.3g\t%i" % (workers, elapsed, reference[0] / elapsed, residues / elapsed, len(hits)))
+
+
+if __name__ == "__main__":
+    main()
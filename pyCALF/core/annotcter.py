@@ -1,5 +1,9 @@
-import pandas as pd
+import heapq
+
 from ..utils import utils
+from ..utils import metrics
+from ..utils import rawhits
+from ..utils import intervals
 
 
 # sequences = utils.easelfasta("/Users/maxime/Documents/SRC/modules/pyCALF/pyCALF/datas/GlyX3.msa.fa")
@@ -11,12 +15,13 @@ def findglyx3(sequences,hmm, glyx3evalue=1e-30 , glyx3ievalue = 1e-10 ,cpus=4,ti
     Parameter
     ---------
     sequences : list of pyhmmer.easel.DigitalSequence
-    hmm : pyhmmer.plan7.HMM
+    hmm : pyhmmer.plan7.HMM or utils.Model
     glyx3evalue: float
         i_evalue threshold 
     cpus : int
     title : str
-        extra information regarding set of sequences (e.g assembly accession)
+        extra information regarding set of sequences (e.g assembly accession),
+        None to use the source of each sequence (see inputs.easelgenomes)
     **kwargs
         will be pass to pyhmmer.hmmsearch pipeline, see documentation for details
                           
@@ -29,8 +34,18 @@ def findglyx3(sequences,hmm, glyx3evalue=1e-30 , glyx3ievalue = 1e-10 ,cpus=4,ti
     
     #hmmsearch
     glyx3hits = utils.pyhmmsearch(sequences,[hmm],cpus,**kwargs)
+    if rawhits.get() is not None:
+        rawhits.get().add_tophits("glyx3", glyx3hits, [hmm], sequences, title)
+    return parseglyx3(glyx3hits, hmm, sequences, glyx3evalue, glyx3ievalue, title)
+
+
+def parseglyx3(glyx3hits, hmm, sequences, glyx3evalue=1e-30 , glyx3ievalue = 1e-10 , title="-"):
+    """make glyx3 hits from hmmsearch tophits (see findglyx3)"""
     perseqhits = utils.targetview(glyx3hits)    
     list_hit = []
+    titles = None
+    if title is None:
+        titles = {s.name : s.source.decode() for s in sequences}
 
     for seqid, tophits in perseqhits.items():      
         # Only one hit in topHits because only one HMM (i.e GlyX3)        
@@ -48,7 +63,7 @@ def findglyx3(sequences,hmm, glyx3evalue=1e-30 , glyx3ievalue = 1e-10 ,cpus=4,ti
             "coverage" :  utils.hitcoverage( hmm.M , tophits[0] ),
             "desc": "cter",
             "src": hmm.name,
-
+            "title": title if titles is None else titles.get(seqid,"-"),
         }
         
         list_hit.append(
@@ -62,7 +77,7 @@ def filtersequences(sequences, datas , coverage_threshold=0.62):
     
     Parameter
     ---------
-    sequences : list
+    sequences : list or utils.SequenceIndex
         pyhmmer.easel.DigitalSequences    
     datas : list
         list of hit as tuple(seqid,hmmname,ndom,evalue,coverage,start,end,title )
@@ -74,11 +89,13 @@ def filtersequences(sequences, datas , coverage_threshold=0.62):
         filtered pyhmmer.easel.DigitalSequences            
     """    
     filtered = []
-    
+    index = None
     for i in datas:    
         if i.coverage > coverage_threshold:
+            if index is None:
+                index = sequences if isinstance(sequences, utils.SequenceIndex) else utils.SequenceIndex(sequences)
             filtered.append(
-                 utils.getseqbyname(i.seqid,sequences)
+                 index[i.seqid]
             )
     return filtered
 
@@ -136,44 +153,91 @@ def filterdomains(domains,threshold=0.65):
     return fdomains
 
 
-def deoverlap(seqid,region,hits):
-    """for the same target with multiple domains, for each residue, keep the best annotation with the lowest evalue
+def bestsegments(region,hits):
+    """split region in consecutive segments annotated with the lowest evalue hit 
+    
+    Same result as calling keep_lowest_evalue on each position of region but using a sweep 
+    over hits boundaries, i.e O(hits log hits) instead of O(len(region) x hits).
+    Consecutive segments annotated with the same hmm are merged.
+
     Parameter
     ---------
-    seqid : str        
-    region : list
+    region : range
         range from sequence start to sequence end 
     hits: list
         sorted list of hits as tuples (evalue , hmmname, ali_from, ali_to , hmm_len) for  the same target (i.e sequence)
     Return
     ------
-        list of non-overlaping domains with a coverage above threshold as tuple 
-
+    l_dom : list
+        hmmname of each segment (None for linkers)
+    dc : list
+        [start,end] of each segment
+    l_evalue : list
+        evalue of the hit annotating the first position of each segment
     """
-    hmm_len = {h[1]:h[4] for h in hits}
+    first = region[0]
+    last = region[-1] + 1
+    bounds = {first,last}
+    starts = {}
+    for i,h in enumerate(hits):
+        # positions covered by h are range(h[2],h[3])
+        b = max(h[2],first)
+        e = min(h[3],last)
+        if b < e:
+            bounds.add(b)
+            bounds.add(e)
+            starts.setdefault(b,[]).append(i)
+    bounds = sorted(bounds)
+
     l_dom = []
     l_evalue = []
     dc = []
-    for p in region:
-        dom,evalue = keep_lowest_evalue(p,hits)       
+    active = [] # heap of hits indexes, the lowest index is the best hit (hits are sorted)
+    for b in bounds[:-1]:
+        for i in starts.get(b,[]):
+            heapq.heappush(active,i)
+        while active and hits[active[0]][3] <= b: # best hit ended before b
+            heapq.heappop(active)
+        if active:
+            dom = hits[active[0]][1]
+            evalue = hits[active[0]][0]
+        else:
+            dom = None
+            evalue = None
         if not l_dom :              # first domain
             l_dom.append(dom)
             l_evalue.append(evalue)
-            start=p
+            dc.append([b,None])
         elif dom != l_dom[-1]:      #new domain
-            end = p-1               #end of previous domain
-            dc.append([start,end])  #append previous born
+            dc[-1][1] = b-1         #end of previous domain
             l_dom.append(dom)  
             l_evalue.append(evalue)               
-            start = p
-        else:                       #still the same domain            
-            pass    
-    end = p
-    dc.append([start,end])
+            dc.append([b,None])
+    dc[-1][1] = last-1
+    return l_dom, dc, l_evalue
+
+
+def deoverlap(seqid,region,hits):
+    """for the same target with multiple domains, for each residue, keep the best annotation with the lowest evalue
+    Parameter
+    ---------
+    seqid : str        
+    region : list
+        range from sequence start to sequence end 
+    hits: list
+        sorted list of hits as tuples (evalue , hmmname, ali_from, ali_to , hmm_len) for  the same target (i.e sequence)
+    Return
+    ------
+        list of non-overlaping domains with a coverage above threshold as tuple 
+
+    """
+    hmm_len = {h[1]:h[4] for h in hits}
+    l_dom, dc, l_evalue = bestsegments(region,hits)
     coverage=[]
     for i,j in zip(l_dom,dc):        
         if i:
-            coverage.append((j[1]-j[0]) / hmm_len.get(i))
+            # 1-based inclusive segment, counted as end - start (see intervals)
+            coverage.append(intervals.spancoverage(j[0], j[1], hmm_len.get(i)))
         else:
             coverage.append(None)
     
@@ -200,26 +264,42 @@ def findglyzips(sequences,hmms,glyzipevalue = 3.6e-4 ,cpus=4,**kwargs):
     """
     Parameter
     ---------
-    seqid : str        
-    region : list
-        range from sequence start to sequence end 
-    hits: list
-        sorted list of hits as tuples (evalue , hmmname, ali_from, ali_to , hmm_len) for  the same target (i.e sequence)
+    sequences : list or utils.SequenceIndex
+        pyhmmer.easel.DigitalSequences    
+    hmms : list
+        glyzip pyhmmer.plan7.HMM or utils.Model
+    glyzipevalue : float
+        domain i_evalue threshold
+    cpus : int
+    **kwargs
+        will be pass to pyhmmer.hmmsearch pipeline
     Return
     ------
         list of non-overlaping domains with a coverage above threshold as tuple 
 
     """    
-    hmm_length_dict = {i.name:i.M for i in hmms }
+    index = sequences if isinstance(sequences, utils.SequenceIndex) else utils.SequenceIndex(sequences)
     #hmmsearch
-    hits = utils.pyhmmsearch(sequences,hmms,cpus,**kwargs)
-    
-    # del hmm 
+    hits = utils.pyhmmsearch(index.sequences,hmms,cpus,**kwargs)
+    if rawhits.get() is not None:
+        rawhits.get().add_tophits("glyzip", hits, hmms, index)
+    return parseglyzips(hits, hmms, index, glyzipevalue)
+
+
+def parseglyzips(hits, hmms, sequences, glyzipevalue = 3.6e-4):
+    """make deoverlapped glyzip hits from hmmsearch tophits (see findglyzips)
+
+    Only targets found in sequences are annotated.
+    """
+    index = sequences if isinstance(sequences, utils.SequenceIndex) else utils.SequenceIndex(sequences)
+    hmm_length_dict = {i.name:i.M for i in hmms }
     perseqhits = utils.targetview(hits)    
 
     datas = []
     for seqid, tophits in perseqhits.items():
-        seq = utils.getseqbyname(seqid,sequences)        
+        if seqid not in index:
+            continue
+        seq = index[seqid]
         pos = range( 0 , len(seq) )
         i_evalue = []
         hmmname = []
@@ -236,5 +316,121 @@ def findglyzips(sequences,hmms,glyzipevalue = 3.6e-4 ,cpus=4,**kwargs):
                     ali_to.append(dom.alignment.target_to)
                     query_len.append(hmm_length_dict[dom.alignment.hmm_name])
         h = sorted(list(zip(i_evalue , hmmname, ali_from, ali_to, query_len)))                
-        datas += deoverlap(seqid,pos,h)
-    return datas
\ No newline at end of file
+        with metrics.get().stage("deoverlap"):
+            datas += deoverlap(seqid,pos,h)
+    return datas
+
+
+def glyzipdomains(hits, sequences):
+    """glyzip domains of sequences, before i_evalue threshold and deoverlap (see resolveglyzips)
+
+    Domain i_evalues are p-values times the number of searched targets, so the p-value 
+    of each domain is kept (as evalue) and i_evalues are computed by resolveglyzips.
+
+    Parameter
+    ---------
+    hits : list
+        glyzip hmmsearch tophits
+    sequences : list or utils.SequenceIndex
+        only domains of these sequences are kept
+    Return
+    ------
+    list of utils.Hit (desc glyzipdomain, evalue is the domain p-value)
+    """
+    names = {seq.name for seq in sequences}
+    domains = []
+    for seqid, tophits in utils.targetview(hits).items():
+        if seqid not in names:
+            continue
+        for hit in tophits:
+            for dom in hit.domains:
+                domains.append(utils.Hit(
+                    seqid = seqid,
+                    domid = dom.alignment.hmm_name,
+                    start = dom.alignment.target_from,
+                    end = dom.alignment.target_to,
+                    evalue = dom.pvalue,
+                    desc = "glyzipdomain",
+                    src = dom.alignment.hmm_name,
+                ))
+    return domains
+
+
+def resolveglyzips(domains, hmms, sequences, glyzipevalue = 3.6e-4, Z=None):
+    """make deoverlapped glyzip hits from glyzip domains (see glyzipdomains)
+
+    Parameter
+    ---------
+    domains : list
+        utils.Hit with desc glyzipdomain
+    hmms : list
+        glyzip pyhmmer.plan7.HMM or utils.Model
+    sequences : list or utils.SequenceIndex
+        glyx3+ sequences
+    glyzipevalue : float
+        domain i_evalue threshold
+    Z : int
+        number of targets i_evalues are computed against, number of sequences by default
+        (i.e the Z of a glyzip search of sequences, see findglyzips)
+    Return
+    ------
+        list of non-overlaping domains with a coverage above threshold
+    """
+    index = sequences if isinstance(sequences, utils.SequenceIndex) else utils.SequenceIndex(sequences)
+    Z = len(index) if Z is None else Z
+    hmmnames = {utils.tostr(i.name) : i.name for i in hmms}
+    hmm_length_dict = {i.name : i.M for i in hmms}
+    perseq = {}
+    for d in domains:
+        i_evalue = d.evalue * Z
+        if i_evalue < glyzipevalue:
+            name = hmmnames[utils.tostr(d.domid)]
+            perseq.setdefault(utils.tostr(d.seqid), []).append(
+                (i_evalue, name, d.start, d.end, hmm_length_dict[name])
+            )
+    datas = []
+    for seq in index:
+        h = perseq.get(utils.tostr(seq.name))
+        if h is None:
+            continue
+        with metrics.get().stage("deoverlap"):
+            datas += deoverlap(seq.name, range(0, len(seq)), sorted(h))
+    return datas
+
+
+def findall(sequences, hmm, hmms, glyx3evalue=1e-30, glyx3ievalue=1e-10, coverage_threshold=0.62, 
+            cpus=4, title="-", **kwargs):
+    """search glyX3 and glyzip hmm profiles in a single hmmsearch pass
+
+    All profiles are searched against all sequences at once, glyzip domains are then kept 
+    only for glyx3+ sequences (coverage above coverage_threshold). 
+    Glyzip i_evalues of this pass are computed against all sequences whereas the glyzip 
+    search of two passes (findglyzips) computes them against glyx3+ sequences only.
+    Glyzip domains are thus returned with their p-values, to be thresholded and deoverlapped 
+    by resolveglyzips once the glyx3+ sequences of the whole input are known 
+    (the input may be searched by blocks or shards).
+
+    Parameter
+    ---------
+    sequences : list of pyhmmer.easel.DigitalSequence
+    hmm : pyhmmer.plan7.HMM or utils.Model
+        glyX3 profile
+    hmms : list
+        glyzip profiles
+    glyx3evalue, glyx3ievalue, title : see findglyx3
+    coverage_threshold : see filtersequences
+    cpus : int
+    **kwargs
+        will be pass to pyhmmer.hmmsearch pipeline
+    Return
+    ------
+    list of glyx3 (desc cter) hits and glyzip domains (desc glyzipdomain) of glyx3+ sequences
+    """
+    hits = utils.pyhmmsearch(sequences, [hmm] + list(hmms), cpus, **kwargs)
+    if rawhits.get() is not None:
+        rawhits.get().add_tophits("glyx3", hits[:1], [hmm], sequences, title)
+        rawhits.get().add_tophits("glyzip", hits[1:], hmms, sequences, title)
+    # hmmsearch yields one TopHits per query, in queries order
+    glyx3hits = parseglyx3(hits[:1], hmm, sequences, glyx3evalue, glyx3ievalue, title)
+    glyx3seqs = filtersequences(sequences, glyx3hits, coverage_threshold)
+    return glyx3hits + glyzipdomains(hits[1:], glyx3seqs)
@@ -1,10 +1,17 @@
+import concurrent.futures
+import heapq
 import os
 import logging
 import subprocess
-import pandas as pd
 import shutil
 import sys
+import tempfile
+import threading
+
+import pyhmmer
+
 from ..utils import utils as u
+from ..utils import intervals
 
 def run(cmd):
     """Run the given command line string via subprocess."""
@@ -39,13 +46,21 @@ def run(cmd):
         sys.exit(error_msg)
 
 
-def blastp(query,subject,evalue = 1e-4 , blastpexec = None):
-    import sys
-    if sys.version_info[0] < 3: 
-        from StringIO import StringIO
-    else:
-        from io import StringIO
+def blastp(query,subject,evalue = 1e-4 , blastpexec = None, threads = 1, best = None):
+    """blastp of query against subject
 
+    Parameter
+    ---------
+    best : BestHits
+        keep only the best alignments of each query while blastp output is read, 
+        None to keep every alignment
+    Return
+    ------
+    rows : list
+        one dict per alignment with the columns of blastp output (outfmt 10 std slen) 
+        and coverage, None if nothing was found.
+        OSError is raised if blastp fails (non-zero return code).
+    """
     from shutil import which
     if blastpexec is None:
         blastpexec = which('blastp')
@@ -59,6 +74,7 @@ def blastp(query,subject,evalue = 1e-4 , blastpexec = None):
                 "-query" , query,
                 "-subject", subject,
                 "-evalue" , str(evalue),
+                "-num_threads" , str(threads),
                 "-outfmt" , '"10 std slen"'
                 # '"10 delim=; qacc sacc qlen slen evalue bitscore score pident nident mismatch qstart qend sstart send length qseq sseq qcovs qcovhsp"'
             ]
@@ -69,27 +85,231 @@ def blastp(query,subject,evalue = 1e-4 , blastpexec = None):
         logging.info(" ".join(command))
         
         # using shell=true is not a problem here
-        o = subprocess.run(" ".join(command) , capture_output=True , shell=True) 
-        logging.info(o)
-
-        res = o.stdout.decode('ascii').strip()
-        if res:
-            df = pd.read_table( StringIO(res)  , sep=","  , header=None )          
-            # df.columns = "qacc sacc qlen slen evalue bitscore score pident nident mismatch qstart qend sstart send length qseq sseq qcovs qcovhsp".split(" ")
-            df.columns = "qacc sacc pident length mismatch gapopen qstart qend sstart send evalue bitscore slen".split(" ")
-            
-            
-            df["coverage"] = df.apply(lambda x: (x.send-x.sstart) / x.slen * 100, axis=1 )
-            logging.info(df)
-            return df
+        # output is parsed as blastp writes it, stderr goes to a file so that it can not block blastp
+        with tempfile.TemporaryFile("w+") as stderr:
+            with subprocess.Popen(" ".join(command), stdout=subprocess.PIPE, stderr=stderr, shell=True, text=True) as o:
+                rows = parseblast(o.stdout, best)
+            stderr.seek(0)
+            message = stderr.read().strip()
+            logging.info("blastp return code %i %s" % (o.returncode, message))
+        if o.returncode:
+            # alignments read so far are partial
+            raise OSError("blastp failed with return code %i : %s" % (o.returncode, message))
+
+        if best is not None and best.seen:
+            logging.info("%i blastp alignments, %i kept" % (best.seen, len(rows)))
+            return rows
+        elif rows:
+            logging.info("%i blastp alignments" % len(rows))
+            return rows
         else:
-            logging.warning("problem occured with blastp command %s " % res)  
+            logging.warning("problem occured with blastp command, return code %i" % o.returncode)  
     else:
         logging.warning("N-ter annotation fail ... ")  
         return None
 
 
 
+BLAST_COLUMNS = "qacc sacc pident length mismatch gapopen qstart qend sstart send evalue bitscore slen".split(" ")
+BLAST_TYPES = [str, str, float, int, int, int, int, int, int, int, float, float, int]
+
+
+def withcoverage(row:dict):
+    """add the subject coverage (%) of an alignment row
+
+    sstart and send are 1-based inclusive, coverage is (send - sstart) / slen as in
+    intervals.spancoverage.
+    """
+    row["coverage"] = intervals.spancoverage(row["sstart"], row["send"], row["slen"]) * 100
+    return row
+
+
+def parseblast(res, best=None):
+    """alignment rows of blastp -outfmt "10 std slen" output (str or lines), see BestHits for best"""
+    rows = []
+    for line in res.splitlines() if isinstance(res, str) else res:
+        if not line.strip():
+            continue
+        values = line.strip().split(",")
+        row = withcoverage({c : t(v) for c, t, v in zip(BLAST_COLUMNS, BLAST_TYPES, values)})
+        if best is not None:
+            best.add(row)
+        else:
+            rows.append(row)
+    return best.rows() if best is not None else rows
+
+
+class BestHits:
+    """k best alignments of each query, kept while a search runs
+
+    Alignments above evalue_threshold or below coverage_threshold are dropped as in
+    nearest_neighboor, then only the k alignments with the lowest evalues of each query are
+    kept (the first ones on ties), so that nearest_neighboor picks the same reference as
+    with every alignment.
+
+    Parameter
+    ---------
+    k : int
+    evalue_threshold, coverage_threshold : float
+        see nearest_neighboor, None to keep every alignment
+    """
+    def __init__(self, k:int=1, evalue_threshold:float=None, coverage_threshold:float=None):
+        self.k = max(1, k)
+        self.evalue_threshold = evalue_threshold
+        self.coverage_threshold = coverage_threshold
+        self.seen = 0
+        self._heaps = {}
+
+    def add(self, row:dict):
+        self.seen += 1
+        if self.evalue_threshold is not None and not row["evalue"] <= self.evalue_threshold:
+            return
+        if self.coverage_threshold is not None and not row["coverage"] > self.coverage_threshold:
+            return
+        heap = self._heaps.setdefault(row["qacc"], [])
+        # the worst kept alignment is on top : highest evalue, then latest
+        item = (-row["evalue"], -self.seen, row)
+        if len(heap) < self.k:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+    def rows(self):
+        """kept alignments, in search order"""
+        items = [item for heap in self._heaps.values() for item in heap]
+        return [row for _, _, row in sorted(items, key=lambda item: -item[1])]
+
+
+def alignmentstats(alignment):
+    """blast-like statistics of a pyhmmer alignment 
+    
+    Return
+    ------
+    pident, length, mismatch, gapopen
+    """
+    hmmseq = alignment.hmm_sequence
+    targetseq = alignment.target_sequence
+    length = len(targetseq)
+    identities = sum(c.isalpha() for c in alignment.identity_sequence)
+    gaps = 0
+    gapopen = 0
+    ingap = False
+    for h, t in zip(hmmseq, targetseq):
+        if h == "." or t == "-":
+            gaps += 1
+            if not ingap:
+                gapopen += 1
+            ingap = True
+        else:
+            ingap = False
+    pident = identities / length * 100 if length else 0
+    return pident, length, length - identities - gaps, gapopen
+
+
+def phmmer(sequences, subject, evalue = 1e-4, cpus = 4, index = None, candidates = 32, best = None):
+    """in-process alternative to blastp using pyhmmer.phmmer 
+
+    Each N-ter reference of subject is used as query against the sequences, 
+    so only len(subject) profiles are built, and Z is set to the number of references 
+    so that evalues are computed against the N-ter database as with blastp -subject.
+
+    With an index, each reference is only aligned to the sequences it is a candidate
+    of (the candidates references sharing the most k-mers with a sequence). Z is 
+    unchanged, so candidate alignments have the same evalues as without index.
+
+    Parameter
+    ---------
+    sequences : list or utils.SequenceIndex
+        pyhmmer.easel.DigitalSequences (i.e glyx3+ sequences)
+    subject : str or list
+        N-ter fasta file or list of pyhmmer.easel.DigitalSequences
+    evalue : float
+    cpus : int
+    index : kmerindex.KmerIndex
+        k-mer index of subject, None to align every reference to every sequence
+    candidates : int
+        references aligned to each sequence with an index
+    best : BestHits
+        keep only the best alignments of each sequence during the search, None to keep them all
+    Return
+    ------
+    rows : list
+        one dict per domain with the columns of blastp output (outfmt 10 std slen) and coverage, 
+        None if nothing was found.
+    """
+    refs = u.easelfasta(subject) if isinstance(subject, str) else list(subject)
+    targets = list(sequences)
+    reflen = {r.name : len(r) for r in refs}
+    if index is not None and index.references != len(refs):
+        raise ValueError("k-mer index of %i references for %i N-ter references" % (index.references, len(refs)))
+
+    if index is None:
+        results = pyhmmer.phmmer(refs, targets, cpus=cpus, E=evalue, Z=len(refs), domZ=len(refs))
+    else:
+        results = candidatesearch(refs, targets, index, candidates, evalue, cpus)
+    rows = []
+    for tophits in results:
+        for hit in tophits:
+            for dom in hit.domains:
+                if dom.i_evalue > evalue:
+                    continue
+                ali = dom.alignment
+                pident, length, mismatch, gapopen = alignmentstats(ali)
+                row = withcoverage(dict(zip(BLAST_COLUMNS, [
+                    u.tostr(hit.name),
+                    u.tostr(ali.hmm_name),
+                    pident, length, mismatch, gapopen,
+                    ali.target_from, ali.target_to, 
+                    ali.hmm_from, ali.hmm_to, 
+                    dom.i_evalue, dom.score, 
+                    reflen[ali.hmm_name],
+                ])))
+                if best is not None:
+                    best.add(row)
+                else:
+                    rows.append(row)
+    if best is not None:
+        rows = best.rows()
+        if best.seen:
+            logging.info("%i phmmer alignments, %i kept" % (best.seen, len(rows)))
+            return rows
+    if not rows:
+        logging.warning("no similar N-ter found with phmmer")
+        return None
+    return rows
+
+
+def candidatesearch(refs, targets, index, candidates:int = 32, evalue = 1e-4, cpus = 4):
+    """phmmer of each reference against the sequences it is a candidate of (see phmmer)
+
+    Return
+    ------
+    generator of pyhmmer.plan7.TopHits, in reference order (references without candidate
+    sequence are skipped)
+    """
+    groups = {}
+    for j, seq in enumerate(targets):
+        for i in index.candidates(seq, candidates):
+            groups.setdefault(i, []).append(j)
+    logging.info("%i N-ter references aligned to %i sequences (%i candidate pairs)" % (
+        len(groups), len(targets), sum(len(i) for i in groups.values())))
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    local = threading.local()
+
+    def search(i):
+        # one pipeline per thread, reused for every reference it searches
+        if not hasattr(local, "pipeline"):
+            local.pipeline = pyhmmer.plan7.Pipeline(alphabet, E=evalue, Z=len(refs), domZ=len(refs))
+            local.builder = pyhmmer.plan7.Builder(alphabet)
+        block = pyhmmer.easel.DigitalSequenceBlock(alphabet, [targets[j] for j in groups[i]])
+        tophits = local.pipeline.search_seq(refs[i], block, local.builder)
+        local.pipeline.clear()
+        return tophits
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, cpus)) as pool:
+        yield from pool.map(search, sorted(groups))
+
+
 def load_nter_mapping_file(f:str):    
     nter_db_dict={}
     assert os.path.exists(f)    
@@ -103,30 +323,33 @@ def load_nter_mapping_file(f:str):
 
 
  
-def nearest_neighboor( df:pd.DataFrame , db:str , coverage_threshold:float = 80 , evalue_threshold:float =3.6e-4 ):
-    kn = load_nter_mapping_file(db)
-    # df["domain"] = df["sacc"].map(kn)         
-    df["domain"] = df.apply(lambda x: kn[x.sacc]["nter"] if x.sacc in kn else None , axis=1)
-    df["organism"] = df.apply(lambda x: kn[x.sacc]["taxo"] if x.sacc in kn else None , axis=1)
-    df = df[(df.evalue <= evalue_threshold) & (df.coverage > coverage_threshold)]                     
-    df = df.sort_values(by="evalue",axis=0)
-    
-    df.drop_duplicates(subset="qacc",keep='first',inplace=True)
-    
+def nearest_neighboor( rows:list , db , coverage_threshold:float = 80 , evalue_threshold:float =3.6e-4 ):
+    """best N-ter reference of each query (see blastp / phmmer rows)
+
+    db is the nterdb mapping file or the mapping already loaded by load_nter_mapping_file.
+    Hits are sorted by evalue, ties keep the order of rows.
+    """
+    kn = db if isinstance(db, dict) else load_nter_mapping_file(db)
+    rows = [r for r in rows if r["evalue"] <= evalue_threshold and r["coverage"] > coverage_threshold]
+    rows.sort(key=lambda r: r["evalue"])
+
     nterhits = [] 
-    for i,j in df.iterrows():
+    seen = set()
+    for r in rows:
+        if r["qacc"] in seen:
+            continue
+        seen.add(r["qacc"])
+        ref = kn.get(r["sacc"], {})
         nterhits.append(
             u.Hit(
-                seqid = j.qacc,
-                domid = j.domain, 
-                start = j.qstart,
-                end = j.qend,
-                evalue = j.evalue,
-                coverage = j.coverage,
+                seqid = r["qacc"],
+                domid = ref.get("nter"), 
+                start = r["qstart"],
+                end = r["qend"],
+                evalue = r["evalue"],
+                coverage = r["coverage"],
                 desc = "nter",
-                src = j.organism,#j.sacc,
+                src = ref.get("taxo"),#j.sacc,
             ) 
         )
     return nterhits
-
-    
\ No newline at end of file
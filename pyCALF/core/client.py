@@ -0,0 +1,97 @@
+"""send a fasta to a pycalf server (see pycalf serve) and write its features and summary
+
+    pycalf client -i proteins.faa.gz --socket /tmp/pycalf.sock -o res
+    pycalf client -i proteins.faa --url http://localhost:8765 -o res
+
+Only the standard library is used, so the client starts in a fraction of a run's startup.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+FEATURE_COLUMNS = ["seqid","domid","start","end","evalue","coverage","desc","src"]
+SUMMARY_COLUMNS = ["accession","flag","nter","cter","is_trusted"]
+
+
+def readfasta(f:str):
+    """content of a plain or gzipped fasta file"""
+    with open(f, "rb") as stream:
+        data = stream.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return data
+
+
+def request_socket(path:str, fasta:bytes, title:str="-"):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps({"fasta" : fasta.decode(), "title" : title}).encode() + b"\n")
+        with sock.makefile("rb") as stream:
+            return json.loads(stream.readline())
+
+
+def request_http(url:str, fasta:bytes, title:str="-"):
+    url = url.rstrip("/") + "/annotate?" + urllib.parse.urlencode({"title" : title})
+    req = urllib.request.Request(url, data=fasta, method="POST", headers={"Content-Type" : "text/plain"})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        return json.loads(err.read())
+
+
+def annotate(fasta:bytes, socket_path:str=None, url:str=None, title:str="-"):
+    """features and summary rows of a fasta, from a pycalf server
+
+    Return
+    ------
+    dict
+        {"features" : rows, "summary" : rows}
+    """
+    if socket_path:
+        response = request_socket(socket_path, fasta, title)
+    elif url:
+        response = request_http(url, fasta, title)
+    else:
+        raise ValueError("a server socket or url is required")
+    if "error" in response:
+        raise OSError("pycalf server : %s" % response["error"])
+    return response
+
+
+def writerows(rows:list, columns:list, f:str, sep:str):
+    with open(f, "w", newline="") as stream:
+        writer = csv.DictWriter(stream, columns, delimiter=sep, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k : "" if v is None else v for k, v in row.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pycalf client",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-i', dest='input', required=True, help='fasta file (plain or gzipped)')
+    parser.add_argument('-o', dest='res_dir', required=True, help='output directory')
+    parser.add_argument('--socket', default=None, help='Unix socket of the server')
+    parser.add_argument('--url', default=None, help='url of the server (HTTP)')
+    parser.add_argument('--title', default=None, help='title of the hits, e.g genome accession, written in a title column of features.csv (default: no title column)')
+    args = parser.parse_args(argv)
+
+    response = annotate(readfasta(args.input), args.socket, args.url, args.title or "-")
+    os.makedirs(args.res_dir, exist_ok=True)
+    columns = FEATURE_COLUMNS + (["title"] if args.title else [])
+    writerows(response["features"], columns, os.path.join(args.res_dir, "features.csv"), "\t")
+    writerows(response["summary"], SUMMARY_COLUMNS, os.path.join(args.res_dir, "summary.csv"), ";")
+    logging.info("%i features, %i summary rows written to %s" % (
+        len(response["features"]), len(response["summary"]), args.res_dir))
@@ -0,0 +1,216 @@
+"""nucleotide CDS and genomic neighborhood of the calcyanins of a run
+
+    pycalf context -s res/summary.csv -g genomes/ -o res/context --flank 10000
+
+Accessions of the summary are mapped to their CDS in the gff of their genome (NCBI
+cds_from_genomic names through their product id, Prodigal names as is). Genomes are
+given as a directory of <genome>.gff / <genome>.fna files (see --gff-extension and
+--fna-extension), a yaml file genome -> {gff: ..., fna: ...} or, for a single genome,
+--gff and --fna. The feature DB of each gff and the .fai index of each genome fasta are
+built once and reused by later runs, and each genome is opened once for all its hits.
+
+Outputs : cds.fna (CDS of each hit), context.fna (CDS with --flank bp on each side, on
+the strand of the CDS) and neighbors.tsv (features overlapping the neighborhood).
+"""
+import argparse
+import logging
+import os
+
+import pandas as pd
+
+from . import parsegff
+from ..utils import faidx
+
+
+NEIGHBOR_COLUMNS = [
+    "accession","genome","seqid","feature","type","start","end","strand","position","product",
+]
+
+
+def parse_genomes(f:str, gffext:str="gff", fnaext:str="fna"):
+    """genome -> (gff, fna) from a directory or a yaml file (see module doc)"""
+    genomes = {}
+    if os.path.isdir(f):
+        gffext = "." + gffext.lstrip(".")
+        fnaext = "." + fnaext.lstrip(".")
+        for i in sorted(os.listdir(f)):
+            if i.endswith(gffext):
+                genome = i[:-len(gffext)]
+                genomes[genome] = (os.path.join(f, i), os.path.join(f, genome + fnaext))
+    elif f.endswith((".yaml", ".yml")):
+        import yaml
+        with open(f) as stream:
+            manifest = yaml.safe_load(stream)
+        if not isinstance(manifest, dict):
+            raise ValueError("yaml genomes should be a mapping genome -> {gff: ..., fna: ...} : %s" % f)
+        root = os.path.dirname(os.path.abspath(f))
+        for genome, files in manifest.items():
+            genomes[str(genome)] = (os.path.join(root, str(files["gff"])), os.path.join(root, str(files["fna"])))
+    else:
+        raise ValueError("genomes should be a directory or a yaml file : %s" % f)
+    for genome, (gff, fna) in genomes.items():
+        for i in (gff, fna):
+            if not os.path.isfile(i):
+                raise FileNotFoundError("File not found for %s : %s" % (genome, i))
+    return genomes
+
+
+def read_summary(f:str):
+    """summary table of a run (csv, csv.gz or parquet)"""
+    if f.endswith(".parquet"):
+        return pd.read_parquet(f)
+    return pd.read_csv(f, sep=";")
+
+
+def locate(db, accessions:list, feature_type:str="CDS"):
+    """feature of each accession, in a single pass over the features of the gff
+
+    Return
+    ------
+    dict
+        accession -> gffutils.Feature, accessions without feature are missing
+    """
+    wanted = {}
+    for accession in accessions:
+        wanted.setdefault(parsegff.protein_feature_id(accession), []).append(accession)
+    found = {}
+    for feature in db.features_of_type(feature_type):
+        fid = parsegff._feature_id(feature)
+        if fid in wanted:
+            for accession in wanted.pop(fid):
+                found[accession] = feature
+            if not wanted:
+                break
+    return found
+
+
+def product(feature):
+    for key in ("product", "Name", "ID"):
+        if key in feature.attributes:
+            return ";".join(feature.attributes[key])
+    return ""
+
+
+def genomecontext(genome:str, gff:str, fna:str, accessions:list, flank:int, feature_type:str="CDS", index_dir:str=None):
+    """CDS, neighborhood and neighbor features of the accessions of a genome
+
+    Return
+    ------
+    cds : list
+        (header, sequence)
+    regions : list
+        (header, sequence)
+    neighbors : list
+        rows of NEIGHBOR_COLUMNS
+    missing : list
+        accessions not found in the gff or on a sequence missing from the genome fasta
+    """
+    db = parsegff.load_gff(gff, index_dir)
+    fai = faidx.FaiIndex(fna, index_dir)
+    located = locate(db, accessions, feature_type)
+    missing = [i for i in accessions if i not in located or located[i].seqid not in fai]
+    hits = [(i, located[i]) for i in accessions if i in located and located[i].seqid in fai]
+    spans = [(max(1, f.start - flank), min(fai.length(f.seqid), f.end + flank)) for _, f in hits]
+    # every subsequence of the genome is read in one pass over the mapped fasta
+    sequences = fai.fetch(
+        [(f.seqid, f.start - 1, f.end) for _, f in hits] +
+        [(f.seqid, start - 1, end) for (_, f), (start, end) in zip(hits, spans)]
+    )
+    cds, regions, neighbors = [], [], []
+    for k, ((accession, f), (start, end)) in enumerate(zip(hits, spans)):
+        seq, region = sequences[k], sequences[len(hits) + k]
+        if f.strand == "-":
+            seq, region = faidx.revcomp(seq), faidx.revcomp(region)
+        if not parsegff.check_start_codon(seq) or not parsegff.check_stop_codon(seq):
+            logging.warning("%s : CDS without start or stop codon" % accession)
+        cds.append(("%s %s %s:%i-%i(%s)" % (accession, genome, f.seqid, f.start, f.end, f.strand), seq))
+        regions.append(("%s %s %s:%i-%i(%s)" % (accession, genome, f.seqid, start, end, f.strand), region))
+
+        around = sorted(
+            db.region(seqid=f.seqid, start=start, end=end, featuretype=feature_type),
+            key=lambda i: (i.start, i.end)
+        )
+        center = [parsegff._feature_id(i) for i in around].index(parsegff._feature_id(f))
+        for position, n in enumerate(around):
+            # neighbors are numbered from the calcyanin, along its strand
+            offset = position - center
+            neighbors.append([
+                accession, genome, n.seqid, parsegff._feature_id(n), n.featuretype,
+                n.start, n.end, n.strand, -offset if f.strand == "-" else offset, product(n),
+            ])
+    return cds, regions, neighbors, missing
+
+
+def writefasta(records, f:str):
+    with open(f, "w") as stream:
+        for header, seq in records:
+            stream.write(">%s\n%s\n" % (header, seq))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pycalf context",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-s', dest='summary', required=True,
+                        help='summary table of a run (summary.csv)')
+    parser.add_argument('-g', dest='genomes', default=None,
+                        help='directory of gff / genome fasta files or yaml file genome -> {gff: ..., fna: ...}')
+    parser.add_argument('--gff', default=None, help='gff of a single genome')
+    parser.add_argument('--fna', default=None, help='genome fasta of a single genome')
+    parser.add_argument('--gff-extension', dest='gff_extension', default="gff",
+                        help='gff files extension with -g directory (default: %(default)s)')
+    parser.add_argument('--fna-extension', dest='fna_extension', default="fna",
+                        help='genome fasta files extension with -g directory (default: %(default)s)')
+    parser.add_argument('-o', dest='res_dir', required=True, help='output directory')
+    parser.add_argument('--flank', type=int, default=10000,
+                        help='bp extracted on each side of the CDS (default: %(default)s)')
+    parser.add_argument('--feature-type', dest='feature_type', default="CDS",
+                        help='gff feature type of proteins and neighbors (default: %(default)s)')
+    parser.add_argument('--trusted-only', dest='trusted_only', action='store_true',
+                        help='only calcyanins with a known N-ter (is_trusted == checked)')
+    parser.add_argument('--index-dir', dest='index_dir', default=None,
+                        help='directory of feature DBs and .fai indexes (default: next to each file)')
+    args = parser.parse_args(argv)
+
+    summary = read_summary(args.summary)
+    if args.trusted_only:
+        summary = summary[summary.is_trusted == "checked"]
+    if args.genomes:
+        genomes = parse_genomes(args.genomes, args.gff_extension, args.fna_extension)
+    elif args.gff and args.fna:
+        genomes = None
+    else:
+        raise ValueError("-g or --gff and --fna are required")
+
+    bygenome = {}
+    for accession, title in zip(summary.accession, summary["title"] if "title" in summary else ["-"] * len(summary)):
+        bygenome.setdefault(str(title), []).append(str(accession))
+    if genomes is None:
+        # single genome run, every accession is looked for in --gff / --fna
+        genomes = {"-" : (args.gff, args.fna)}
+        bygenome = {"-" : [i for accessions in bygenome.values() for i in accessions]}
+
+    res_dir = os.path.abspath(args.res_dir)
+    os.makedirs(res_dir, exist_ok=True)
+    cds, regions, neighbors, missing = [], [], [], []
+    for genome, accessions in bygenome.items():
+        if genome not in genomes:
+            logging.warning("no gff / genome fasta for %s, %i hit(s) skipped" % (genome, len(accessions)))
+            missing += accessions
+            continue
+        gff, fna = genomes[genome]
+        c, r, n, m = genomecontext(genome, gff, fna, accessions, args.flank, args.feature_type, args.index_dir)
+        cds += c
+        regions += r
+        neighbors += n
+        missing += m
+    if missing:
+        logging.warning("%i accession(s) not found in gff files : %s" % (
+            len(missing), ",".join(missing[:10]) + ("..." if len(missing) > 10 else "")))
+
+    writefasta(cds, res_dir + "/cds.fna")
+    writefasta(regions, res_dir + "/context.fna")
+    pd.DataFrame(neighbors, columns=NEIGHBOR_COLUMNS).to_csv(res_dir + "/neighbors.tsv", sep="\t", index=False)
+    logging.info("%i CDS and neighborhoods written to %s" % (len(cds), res_dir))
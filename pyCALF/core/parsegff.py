@@ -1,15 +1,39 @@
+import logging
+import os
 import re
-import gffutils
 
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
 from Bio.Seq import Seq
 
+from ..utils import checkpoint
+from ..utils import faidx
 
-def load_gff(fn):
-    db = gffutils.create_db(fn, dbfn=fn+'.db', force=True, keep_order=True,
-        merge_strategy='merge', sort_attribute_values=True)
-    return gffutils.FeatureDB(fn+'.db', keep_order=True)
+
+def gffdbpath(fn, index_dir=None):
+    """feature DB of a gff file, named after the fingerprint (path, size, mtime) of the file"""
+    fp = checkpoint.inputfingerprint([fn])[:16]
+    return faidx.indexpath(fn, ".%s.db" % fp, index_dir)
+
+
+def load_gff(fn, index_dir=None):
+    """gffutils feature DB of a gff file
+
+    The DB is built once and reused while the gff file is unchanged (see gffdbpath).
+    """
+    try:
+        import gffutils
+    except ImportError:
+        raise ImportError("gff parsing requires gffutils")
+    dbfn = gffdbpath(fn, index_dir)
+    if not os.path.exists(dbfn):
+        logging.info("building feature DB of %s" % fn)
+        os.makedirs(os.path.dirname(os.path.abspath(dbfn)), exist_ok=True)
+        # built under a temporary name, an interrupted build is not reused
+        gffutils.create_db(fn, dbfn=dbfn + '.tmp', force=True, keep_order=True,
+            merge_strategy='merge', sort_attribute_values=True)
+        os.replace(dbfn + '.tmp', dbfn)
+    return gffutils.FeatureDB(dbfn, keep_order=True)
 
 def _feature_id(f):
     if re.search('Prodigal',f.source):
@@ -63,28 +87,35 @@ def check_stop_codon(str_seq):
 def fasta2dict(fn):
     return SeqIO.to_dict(SeqIO.parse(open(fn),format='fasta'))
 
-def extract_cds_fna(genomic_accession,start,stop,frame,fasta_fna_file):
-    fasta = fasta2dict(fasta_fna_file)
-    seq = fasta[genomic_accession]
-    seq = seq.seq
-    if frame == "+":
-        start = start-1
-        stop = stop
-    elif frame == "-":
-        start = start - 1
-        stop = stop
-    else:
-        raise ValueError  
-    subseq = Seq(seq[start:stop])
+def extract_cds_fna(genomic_accession,start,stop,frame,fasta_fna_file,index=None):
+    """nucleotide sequence of a feature (1-based, inclusive coordinates) 
+
+    The genome is read through its .fai index (see faidx.FaiIndex), pass index 
+    to reuse an index already loaded when several features are extracted.
+    """
+    if frame not in ("+","-"):
+        raise ValueError("Unknown strand : %s" % frame)
+    if index is None:
+        index = faidx.FaiIndex(fasta_fna_file)
+    subseq = index.subsequence(genomic_accession, start - 1, stop)
     if frame == "-":
-        subseq = subseq.reverse_complement()
+        subseq = faidx.revcomp(subseq)
+    subseq = Seq(subseq)
     if not check_start_codon(subseq):
-        print("WARNING NO START CODON DETECTED")
+        logging.warning("no start codon detected : %s:%i-%i(%s)" % (genomic_accession, start, stop, frame))
     if not check_stop_codon(subseq):
-        print("WARNING NO STOP CODON DETECTED")
+        logging.warning("no stop codon detected : %s:%i-%i(%s)" % (genomic_accession, start, stop, frame))
     return subseq
 
 def resolve_product_id(accession):
     protid = accession.split('_prot_')[-1].split("_")
     protid.pop(-1)
     return "_".join(protid)
+
+def protein_feature_id(accession):
+    """feature id (see _feature_id) of a protein accession : the product id of NCBI 
+    cds_from_genomic names (see resolve_product_id), the accession itself otherwise 
+    (e.g Prodigal <contig>_<n> names)"""
+    if "_prot_" in accession:
+        return resolve_product_id(accession)
+    return accession
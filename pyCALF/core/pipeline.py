@@ -0,0 +1,109 @@
+import logging
+import queue
+import threading
+
+
+class Pipeline:
+    """run downstream stages on batches of glyx3+ sequences while the input is still screened
+
+    Each stage (e.g N-ter annotation) has its own worker thread fed by a bounded queue,
+    so the GlyX3 search of the next block and the annotation of previous blocks run
+    concurrently (pyhmmer and blastp release the GIL) and the wall time approaches the
+    one of the slowest stage. A full queue blocks the producer, which bounds memory.
+    Results are handed back batch by batch in submission order (see ready), so outputs
+    do not depend on thread scheduling.
+
+    Stages must give the same results on a batch as on the whole set of sequences.
+    N-ter evalues only depend on the reference database, whereas glyzip i-evalues are
+    computed against the number of glyx3+ sequences of the whole input, which is only
+    known once the input is screened : glyzip is not a pipeline stage.
+
+    Parameter
+    ---------
+    stages : dict
+        name -> func(batch) -> list of hits
+    depth : int
+        maximum number of batches waiting for each stage
+    """
+    _DONE = object()
+
+    def __init__(self, stages:dict, depth:int=4):
+        self.stages = stages
+        self.queues = {name : queue.Queue(maxsize=depth) for name in stages}
+        self.results = {name : {} for name in stages}
+        self.errors = []
+        self.submitted = 0
+        self.delivered = 0
+        self.threads = [
+            threading.Thread(target=self._work, args=(name,), name="pycalf-%s" % name, daemon=True)
+            for name in stages
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self, name:str):
+        func = self.stages[name]
+        while True:
+            item = self.queues[name].get()
+            if item is self._DONE:
+                return
+            i, batch = item
+            if self.errors:
+                # drain the queue so that the producer is not blocked
+                continue
+            try:
+                self.results[name][i] = func(batch) if batch else []
+            except BaseException as err:
+                logging.error("%s failed on batch %i : %s" % (name, i, err))
+                self.errors.append(err)
+
+    def submit(self, batch):
+        """queue a batch of sequences for every stage (blocks while a stage is behind)
+
+        Empty batches are queued as well, so that batches are handed back in order.
+
+        Return
+        ------
+        i : int
+            batch index
+        """
+        if self.errors:
+            raise self.errors[0]
+        i = self.submitted
+        for q in self.queues.values():
+            q.put((i, batch))
+        self.submitted += 1
+        return i
+
+    def ready(self):
+        """yield (batch index, {name : hits}) of the batches done by every stage, in submission order"""
+        if self.errors:
+            raise self.errors[0]
+        while self.delivered < self.submitted and all(self.delivered in r for r in self.results.values()):
+            i = self.delivered
+            yield i, {name : results.pop(i) for name, results in self.results.items()}
+            self.delivered += 1
+
+    def close(self):
+        """wait for every stage to finish
+
+        Return
+        ------
+        list
+            (batch index, {name : hits}) of the batches not handed back by ready yet
+        """
+        for q in self.queues.values():
+            q.put(self._DONE)
+        for thread in self.threads:
+            thread.join()
+        return list(self.ready())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            # stop workers without waiting for pending batches
+            self.errors.append(exc[1])
+            for q in self.queues.values():
+                q.put(self._DONE)
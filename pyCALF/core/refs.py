@@ -0,0 +1,318 @@
+"""precompiled reference bundle : HMM profiles, N-ter references and N-ter mapping in one file
+
+    pycalf build-refs -o refs.pcr --label nterdb-2024.1
+    pycalf -i proteomes/ -o res --refs refs.pcr
+
+A bundle holds the HMM profiles in HMMER binary format, the digitized N-ter references
+(a sequence store, see utils.seqstore), their k-mer index (see utils.kmerindex) and the
+N-ter mapping (reference -> type, taxon).
+Each section is checksummed and the manifest records the label, the source files and the
+checksum of the whole bundle. Loading a bundle checks the checksums and that the GlyX3,
+Gly1, Gly2 and Gly3 profiles are present, then reads profiles and mapping without parsing
+text, and N-ter residues are memory-mapped, so workers on a node share one copy of the file.
+Layout (little endian) :
+
+    header   : MAGIC, offset and size of the manifest (8s + 2 x uint64)
+    sections : hmms, nter, kmers and mapping, 8-aligned
+    manifest : json
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import time
+
+import pyhmmer
+
+from . import annotnter as nter
+from ..utils import cache
+from ..utils import kmerindex
+from ..utils import seqstore
+from ..utils import utils as u
+
+
+MAGIC = b"PYCALFR1"
+HEADER = struct.Struct("<8sQQ")
+FORMAT = 1
+PROFILES = ["GlyX3","Gly1","Gly2","Gly3"]
+
+
+def isbundle(f:str):
+    """True if f is a reference bundle"""
+    if not f or not os.path.isfile(f):
+        return False
+    with open(f, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+
+def manifest(f:str):
+    """manifest of a bundle, without reading its sections"""
+    with open(f, 'rb') as stream:
+        magic, offset, size = HEADER.unpack(stream.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a pycalf reference bundle : %s" % f)
+        stream.seek(offset)
+        m = json.loads(stream.read(size))
+    if m.get("format") != FORMAT:
+        raise ValueError("Unsupported reference bundle format %s (expected %i) : %s" % (m.get("format"), FORMAT, f))
+    return m
+
+
+def _section(stream, sections:dict, name:str, data):
+    """append a section (bytes, or a function writing to the stream) and record its checksum"""
+    stream.write(b"\0" * (-stream.tell() % 8))
+    start = stream.tell()
+    if callable(data):
+        data(stream)
+    else:
+        stream.write(data)
+    end = stream.tell()
+    stream.seek(start)
+    sha = hashlib.sha256(stream.read(end - start)).hexdigest()
+    sections[name] = {"offset" : start, "size" : end - start, "sha256" : sha}
+
+
+def build(f:str, hmms:list, nterdb_fa:str, nterdb_tab:str, label:str=None):
+    """write a reference bundle
+
+    Parameter
+    ---------
+    f : str
+        bundle file
+    hmms : list
+        hmm files, profile names must be unique and include GlyX3, Gly1, Gly2 and Gly3
+    nterdb_fa : str
+        N-ter references (fasta)
+    nterdb_tab : str
+        N-ter mapping file (see annotnter.load_nter_mapping_file)
+    label : str
+        version of the references, e.g nterdb-2024.1 (default: bundle file name)
+
+    Return
+    ------
+    dict
+        manifest of the bundle
+    """
+    profiles = [hmm for i in hmms for hmm in u.easelhmms(i)]
+    names = [u.tostr(hmm.name) for hmm in profiles]
+    duplicated = sorted({i for i in names if names.count(i) > 1})
+    if duplicated:
+        raise ValueError("Duplicated HMM profiles : %s" % ",".join(duplicated))
+    missing = [i for i in PROFILES if i not in names]
+    if missing:
+        raise ValueError("%s not found in %s" % (",".join(missing), ",".join(hmms)))
+    refs = u.easelfasta(nterdb_fa)
+    mapping = nter.load_nter_mapping_file(nterdb_tab)
+    unmapped = [u.tostr(r.name) for r in refs if u.tostr(r.name) not in mapping]
+    if unmapped:
+        logging.warning("%i N-ter reference(s) without type in %s : %s" % (len(unmapped), nterdb_tab, ",".join(unmapped[:10])))
+
+    sections = {}
+    tmp = f + ".tmp"
+    with open(tmp, 'w+b') as stream:
+        stream.write(HEADER.pack(MAGIC, 0, 0))
+        binary = io.BytesIO()
+        for hmm in profiles:
+            hmm.write(binary, binary=True)
+        _section(stream, sections, "hmms", binary.getvalue())
+        _section(stream, sections, "nter", lambda s: seqstore.pack(s, [refs]))
+        _section(stream, sections, "kmers", lambda s: kmerindex.pack(s, refs))
+        _section(stream, sections, "mapping", "".join(
+            "%s\t%s\t%s\n" % (seqid, ref["nter"], ref["taxo"]) for seqid, ref in mapping.items()
+        ).encode())
+        m = {
+            "format" : FORMAT,
+            "label" : label or os.path.basename(f),
+            "created" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "profiles" : names,
+            "nter_references" : len(refs),
+            "nter_mapping" : len(mapping),
+            "sources" : {os.path.abspath(i) : cache.filedigest(i) for i in list(hmms) + [nterdb_fa, nterdb_tab]},
+            "sections" : sections,
+        }
+        m["checksum"] = hashlib.sha256(json.dumps(sections, sort_keys=True).encode()).hexdigest()
+        data = json.dumps(m, indent=1).encode()
+        stream.seek(0, os.SEEK_END)
+        offset = stream.tell()
+        stream.write(data)
+        stream.seek(0)
+        stream.write(HEADER.pack(MAGIC, offset, len(data)))
+    os.replace(tmp, f)
+    return m
+
+
+class RefBundle:
+    """read-only access to a reference bundle
+
+    Parameter
+    ---------
+    f : str
+        bundle written by build (pycalf build-refs)
+    verify : bool
+        check the checksum of every section (a corrupted or truncated bundle raises ValueError)
+    """
+    def __init__(self, f:str, verify:bool=True):
+        self.path = f
+        self.manifest = manifest(f)
+        self.checksum = self.manifest["checksum"]
+        self.sections = self.manifest["sections"]
+        size = os.path.getsize(f)
+        for name, section in self.sections.items():
+            if section["offset"] + section["size"] > size:
+                raise ValueError("Truncated reference bundle, %s section missing : %s" % (name, f))
+        if hashlib.sha256(json.dumps(self.sections, sort_keys=True).encode()).hexdigest() != self.checksum:
+            raise ValueError("Inconsistent reference bundle manifest : %s" % f)
+        if verify:
+            self.verify()
+        missing = [i for i in PROFILES if i not in self.manifest["profiles"]]
+        if missing:
+            raise ValueError("%s not found in reference bundle %s" % (",".join(missing), f))
+        logging.info("reference bundle %s : %s (%s)" % (f, self.manifest["label"], self.checksum[:12]))
+
+    def read(self, name:str):
+        section = self.sections[name]
+        with open(self.path, 'rb') as stream:
+            stream.seek(section["offset"])
+            return stream.read(section["size"])
+
+    def verify(self):
+        for name in self.sections:
+            if hashlib.sha256(self.read(name)).hexdigest() != self.sections[name]["sha256"]:
+                raise ValueError("Corrupted reference bundle, checksum mismatch of the %s section : %s" % (name, self.path))
+
+    def hmms(self):
+        """HMM profiles, in bundle order"""
+        with pyhmmer.plan7.HMMFile(io.BytesIO(self.read("hmms"))) as hmm_file:
+            return list(hmm_file)
+
+    def nterdb(self):
+        """N-ter references (digital sequences), residues are read from the memory-mapped bundle"""
+        store = seqstore.SequenceStore(self.path, offset=self.sections["nter"]["offset"])
+        return [store.sequence(i) for i in range(len(store))]
+
+    def kmerindex(self):
+        """k-mer index of the N-ter references (memory-mapped), None for bundles without index"""
+        if "kmers" not in self.sections:
+            return None
+        return kmerindex.KmerIndex(self.path, offset=self.sections["kmers"]["offset"])
+
+    def mapping(self):
+        """N-ter mapping, as loaded by annotnter.load_nter_mapping_file"""
+        kn = {}
+        for line in self.read("mapping").decode().splitlines():
+            seqid, nter_type, taxo = line.split("\t")
+            kn[seqid] = {"nter" : nter_type, "taxo" : taxo}
+        return kn
+
+
+def sources(args, stage:str=None):
+    """files and parameters identifying the references of a stage in cache / checkpoint fingerprints
+
+    A bundle is identified by its checksum, its content is not hashed again.
+
+    Parameter
+    ---------
+    args : argparse.Namespace
+        search options (see main.search_arguments)
+    stage : str
+        glyx3, glyzip, all (--single-pass) or nter, None for every reference of a run
+    Return
+    ------
+    files : list
+    params : dict
+    """
+    if args.refs:
+        return [], {"refs_checksum" : manifest(args.refs)["checksum"]}
+    files = {
+        "glyx3" : [args.glyx3_phmm],
+        "glyzip" : [args.gly1_phmm, args.gly2_phmm, args.gly3_phmm],
+        "all" : [args.hmms],
+        "nter" : [args.nterdb_fa, args.nterdb_tab],
+    }
+    if stage is None:
+        return files["all" if args.single_pass else "glyx3"] + ([] if args.single_pass else files["glyzip"]) + files["nter"], {}
+    return files[stage], {}
+
+
+class References:
+    """profiles, N-ter mapping and N-ter references of a search, loaded once
+
+    From a bundle with --refs, otherwise from --glyx3-hmm / --gly1-phmm ... (or --hmms
+    with --single-pass), --nterdb and --nter-mapping-file.
+
+    Parameter
+    ---------
+    args : argparse.Namespace
+        search options (see main.search_arguments)
+    """
+    def __init__(self, args):
+        self.bundle = RefBundle(args.refs) if args.refs else None
+        if self.bundle is not None:
+            logging.info("loading HMM profiles and N-ter references of %s" % args.refs)
+            models = {u.tostr(hmm.name) : u.Model(hmm) for hmm in self.bundle.hmms()}
+        elif args.single_pass:
+            logging.info("loading HMM profiles %s" % args.hmms)
+            models = {u.tostr(hmm.name) : u.Model(hmm) for hmm in u.easelhmms(args.hmms)}
+            missing = [i for i in PROFILES if i not in models]
+            if missing:
+                raise ValueError("%s not found in %s" % (",".join(missing), args.hmms))
+        else:
+            logging.info("loading GlyX3 and glyzip' specific HMM profiles")
+            models = {
+                name : u.Model(u.easelhmm(f)) for name, f in
+                zip(PROFILES, [args.glyx3_phmm, args.gly1_phmm, args.gly2_phmm, args.gly3_phmm])
+            }
+        self.ghmm = models[PROFILES[0]]
+        self.zhmms = [models[i] for i in PROFILES[1:]]
+        if self.bundle is not None:
+            self.mapping = self.bundle.mapping()
+            self.nterrefs = self.bundle.nterdb() if args.nter_backend == "phmmer" else None
+            self.nterdb = "%s (%s)" % (args.refs, self.bundle.manifest["label"])
+        else:
+            self.mapping = nter.load_nter_mapping_file(args.nterdb_tab)
+            self.nterrefs = u.easelfasta(args.nterdb_fa) if args.nter_backend == "phmmer" else None
+            self.nterdb = args.nterdb_fa
+        self._subject = None if self.bundle is not None else args.nterdb_fa
+        self.nterindex = None
+        if args.nter_index and self.nterrefs is None:
+            logging.warning("--nter-index ignored with --nter-backend %s" % args.nter_backend)
+        elif args.nter_index:
+            if self.bundle is not None:
+                self.nterindex = self.bundle.kmerindex()
+            if self.nterindex is None:
+                self.nterindex = kmerindex.load(args.refs or args.nterdb_fa, self.nterrefs)
+
+    def subject(self, directory:str):
+        """N-ter references fasta for blastp -subject, written to directory from a bundle"""
+        if self._subject is None:
+            self._subject = os.path.join(directory, "nterdb.fasta")
+            u.writefasta(self.bundle.nterdb(), self._subject)
+        return self._subject
+
+
+def main(argv=None):
+    from .. import main as cli
+    parser = argparse.ArgumentParser(
+        prog="pycalf build-refs",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-o', dest='output', required=True,
+                        help='reference bundle')
+    parser.add_argument('--hmms', nargs="+",
+                        default=[os.path.join(cli.DATASDIR, i + ".hmm") for i in PROFILES],
+                        help='hmm files, GlyX3, Gly1, Gly2 and Gly3 profiles are required (default: bundled profiles)')
+    parser.add_argument('--nterdb', dest='nterdb_fa', default=os.path.join(cli.DATASDIR, "nterdb.fasta"),
+                        help='N-ter references fasta file (default: %(default)s)')
+    parser.add_argument('--nter-mapping-file', dest='nterdb_tab', default=os.path.join(cli.DATASDIR, "nterdb.tsv"),
+                        help='N-ter mapping file (default: %(default)s)')
+    parser.add_argument('--label', default=None,
+                        help='version of the references recorded in the bundle (default: bundle file name)')
+    args = parser.parse_args(argv)
+
+    m = build(args.output, args.hmms, args.nterdb_fa, args.nterdb_tab, args.label)
+    logging.info("%i profiles (%s), %i N-ter references written to %s, checksum %s" % (
+        len(m["profiles"]), ",".join(m["profiles"]), m["nter_references"], args.output, m["checksum"]))
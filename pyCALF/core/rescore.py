@@ -0,0 +1,142 @@
+"""re-apply thresholds to the raw results of a run without searching again
+
+    pycalf -i proteins.faa.gz -o res --save-raw
+    pycalf rescore -r res/raw.npz -o res_strict --glyx3-coverage 0.8 --nter-evalue 1e-10
+
+Thresholds default to the ones of the run. Every domain reported by the searches is saved,
+so GlyX3 evalues / i-evalues and glyzip i-evalues can be set freely. Glyzip i-evalues are
+computed against the glyx3+ sequences of the re-scoring, as a search run with the same
+--glyx3-coverage would do. Results may differ from a search run with the new thresholds when :
+
+    --glyx3-coverage is lowered : glyzip (unless --single-pass) and N-ter were only searched
+        in sequences with a GlyX3 coverage above the one of the run, new glyx3+ sequences
+        have no glyzip / N-ter hit
+    --nter-evalue is raised : only N-ter alignments below the N-ter evalue of the run were saved
+    --glyx3-coverage is raised : glyzip hits were reported (--E, --domE) against the glyx3+
+        sequences of the run, hits just above the reporting thresholds of the run are missing
+"""
+import argparse
+import logging
+import os
+
+from . import annotcter as cter
+from . import annotnter as nter
+from . import refs
+from ..utils import rawhits
+from ..utils import writers
+
+
+def rescore(raw, res_dir:str, glyx3evalue:float, glyx3ievalue:float, coverage_threshold:float,
+            glyzipevalue:float, nter_coverage:float, nter_evalue:float, mapping, fmt:str="csv"):
+    """rebuild feature and summary tables from raw results
+
+    Parameter
+    ---------
+    raw : rawhits.RawHits
+    res_dir : str
+        output directory, same layout as a search run (without fastas)
+    glyx3evalue, glyx3ievalue, coverage_threshold, glyzipevalue : see annotcter
+    nter_coverage, nter_evalue, mapping : see annotnter.nearest_neighboor (mapping file or loaded mapping)
+    fmt : str
+        output format, see writers.FORMATS
+    Return
+    ------
+    summary : list
+        summary rows (see tables.summarizerows)
+    """
+    params = raw.params
+    targets = raw.targets()
+
+    glyx3hits = cter.parseglyx3(
+        raw.tophits("glyx3"),
+        raw.profile(params["glyx3_hmm"]),
+        targets,
+        glyx3evalue,
+        glyx3ievalue,
+        title=None
+    )
+    titles = {h.seqid : h.title for h in glyx3hits}
+    glyx3seqs = cter.filtersequences(targets, glyx3hits, coverage_threshold)
+    logging.info("%i glyx3 hits, %i glyx3+ sequences" % (len(glyx3hits), len(glyx3seqs)))
+
+    # i-evalues against glyx3+ sequences, as a glyzip search of glyx3seqs (see cter.findglyzips)
+    glyziphits = cter.parseglyzips(
+        raw.tophits("glyzip", Z = len(glyx3seqs)),
+        [raw.profile(i) for i in params["glyzip_hmms"]],
+        glyx3seqs,
+        glyzipevalue
+    )
+    for h in glyziphits:
+        h.title = titles.get(h.seqid, "-")
+
+    names = {s.name for s in glyx3seqs}
+    rows = [r for r in raw.nter() if r["qacc"] in names]
+    nterhits = []
+    if rows:
+        nterhits = nter.nearest_neighboor(
+            rows,
+            mapping,
+            coverage_threshold = nter_coverage,
+            evalue_threshold = nter_evalue,
+        )
+    for h in nterhits:
+        h.title = titles.get(h.seqid, "-")
+    logging.info("%i glyzip hits, %i N-ter hits" % (len(glyziphits), len(nterhits)))
+
+    writer = writers.ResultWriter(res_dir, fmt, params["genomes"] if params["batch"] else None)
+    writer.writeglyx3(glyx3hits)
+    summary = writer.writeannotations(glyx3hits, glyziphits, nterhits)
+    writer.close()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pycalf rescore",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-r', dest='raw', required=True,
+                        help='raw results of a run (raw.npz, see --save-raw)')
+    parser.add_argument('-o', dest='res_dir', required=True,
+                        help='output directory')
+    parser.add_argument('--glyx3-coverage', dest='glyx3_coverage', type=float, default=None)
+    parser.add_argument('--glyx3-evalue', dest='glyx3_evalue', type=float, default=None)
+    parser.add_argument('--glyx3-i-evalue', dest='glyx3_i_evalue', type=float, default=None)
+    parser.add_argument('--glyzip-i-evalue', dest='glyzip_i_evalue', type=float, default=None)
+    parser.add_argument('--nter-coverage', dest='nter_coverage', type=float, default=None)
+    parser.add_argument('--nter-evalue', dest='nter_evalue', type=float, default=None)
+    parser.add_argument('--nter-mapping-file', dest='nter_mapping_file', default=None,
+                        help='N-ter mapping file or reference bundle (default: the one of the run)')
+    parser.add_argument('--output-format', dest='output_format', choices=list(writers.FORMATS), default="csv")
+    args = parser.parse_args(argv)
+
+    raw = rawhits.RawHits.load(args.raw)
+    thresholds = {}
+    for i in ["glyx3_coverage","glyx3_evalue","glyx3_i_evalue","glyzip_i_evalue","nter_coverage","nter_evalue","nter_mapping_file"]:
+        thresholds[i] = raw.params[i] if getattr(args, i) is None else getattr(args, i)
+        logging.info("%s : %s" % (i, thresholds[i]))
+    if thresholds["glyx3_coverage"] < raw.params["glyx3_coverage"]:
+        logging.warning("%s searched only in sequences with a GlyX3 coverage above %s" % (
+            "N-ter was" if raw.params["single_pass"] else "glyzip and N-ter were", raw.params["glyx3_coverage"]))
+    if thresholds["nter_evalue"] > raw.params["nter_evalue"]:
+        logging.warning("N-ter alignments were searched with an evalue below %s" % raw.params["nter_evalue"])
+
+    mapping = thresholds["nter_mapping_file"]
+    if refs.isbundle(mapping):
+        mapping = refs.RefBundle(mapping).mapping()
+    res_dir = os.path.abspath(args.res_dir)
+    summary = rescore(
+        raw,
+        res_dir,
+        glyx3evalue = thresholds["glyx3_evalue"],
+        glyx3ievalue = thresholds["glyx3_i_evalue"],
+        coverage_threshold = thresholds["glyx3_coverage"],
+        glyzipevalue = thresholds["glyzip_i_evalue"],
+        nter_coverage = thresholds["nter_coverage"],
+        nter_evalue = thresholds["nter_evalue"],
+        mapping = mapping,
+        fmt = args.output_format,
+    )
+    logging.info("%i reliable calcyanin found." % sum(1 for row in summary if row[4] == "checked"))
+    logging.info("results written to %s" % res_dir)
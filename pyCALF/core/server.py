@@ -0,0 +1,318 @@
+"""long-lived calcyanin search with profiles and N-ter references kept in memory
+
+    pycalf serve --socket /tmp/pycalf.sock --jobs 4 --queue 16 --threads 2
+    pycalf client -i proteins.faa --socket /tmp/pycalf.sock -o res
+
+HMM profiles are loaded and optimized, and the N-ter mapping (and references, with
+--nter-backend phmmer) are read once at startup, so a job only costs its search.
+Jobs are accepted on a Unix socket (one json line {"fasta": ..., "title": ...} per
+connection, answered by one json line) and / or over HTTP (POST /annotate with the
+fasta as body and an optional ?title=, GET /health). --jobs jobs run at once with
+--threads threads each, up to --queue more wait for a slot and further requests are
+refused (HTTP 503) instead of piling up.
+
+Each job is searched as a standalone run of its fasta (evalues against the number of
+sequences of the job), answers are {"features": [...], "summary": [...]} rows.
+"""
+import argparse
+import concurrent.futures
+import http.server
+import io
+import json
+import logging
+import os
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+
+import pyhmmer
+
+from . import annotcter as cter
+from . import annotnter as nter
+from . import refs
+from ..utils import metrics
+from ..utils import tables
+from ..utils import utils as u
+
+
+class Busy(RuntimeError):
+    """every job slot and queue slot is taken"""
+
+
+class Annotator:
+    """profiles, N-ter references and thresholds shared by every job
+
+    Parameter
+    ---------
+    args : argparse.Namespace
+        search options (see main.search_arguments)
+    """
+    def __init__(self, args):
+        self.args = args
+        self.references = refs.References(args)
+        self.ghmm = self.references.ghmm
+        self.zhmms = self.references.zhmms
+        self.mapping = self.references.mapping
+        # N-ter references of a bundle are written once for blastp -subject
+        self._tmp = tempfile.TemporaryDirectory(prefix="pycalf-refs-")
+        self.cascade = {
+            k : getattr(args, k) for k in ("E","domE","F1","F2","F3")
+            if getattr(args, k) is not None
+        }
+        if args.domz is not None:
+            self.cascade["domZ"] = args.domz
+        self.alphabet = pyhmmer.easel.Alphabet.amino()
+        logging.info("profiles and N-ter references loaded")
+
+    def parse(self, fasta:bytes):
+        with pyhmmer.easel.SequenceFile(io.BytesIO(fasta), format="fasta", digital=True, alphabet=self.alphabet) as stream:
+            return list(stream)
+
+    def searchnter(self, sequences):
+        args = self.args
+        best = nter.BestHits(1, args.nter_evalue, args.nter_coverage)
+        if self.references.nterrefs is not None:
+            return nter.phmmer(
+                sequences, self.references.nterrefs, args.nter_evalue, cpus=args.threads,
+                index=self.references.nterindex, candidates=args.nter_candidates, best=best
+            )
+        subject = self.references.subject(self._tmp.name)
+        with tempfile.TemporaryDirectory(prefix="pycalf-") as tmp:
+            query = os.path.join(tmp, "query.fasta")
+            u.writefasta(sequences, query)
+            return nter.blastp(query, subject, args.nter_evalue, blastpexec=args.blastp, threads=args.threads, best=best)
+
+    def annotate(self, fasta:bytes, title:str="-"):
+        """search calcyanins in the sequences of a fasta
+
+        Return
+        ------
+        features : tables.HitTable
+        summary : list
+            summary rows (see tables.summarizerows)
+        """
+        # search metrics of the job, so that the long-lived process does not accumulate them
+        with metrics.collect() as m:
+            features, summary = self._annotate(fasta, title)
+        logging.debug("job %s : %i hmmsearch calls, %.2fs" % (title, len(m.searches), m.to_dict()["wall"]))
+        return features, summary
+
+    def _annotate(self, fasta:bytes, title:str):
+        args = self.args
+        sequences = self.parse(fasta)
+        if args.single_pass:
+            hits = cter.findall(
+                sequences, self.ghmm, self.zhmms,
+                glyx3evalue = args.gly3_evalue_threshold,
+                glyx3ievalue = args.gly3_i_evalue_threshold,
+                coverage_threshold = args.gly3_coverage_threshold,
+                cpus = args.threads, title = title,
+                **self.cascade
+            )
+        else:
+            hits = cter.findglyx3(
+                sequences, self.ghmm,
+                glyx3evalue = args.gly3_evalue_threshold,
+                glyx3ievalue = args.gly3_i_evalue_threshold,
+                cpus = args.threads, title = title,
+                **self.cascade
+            )
+        glyx3hits = [h for h in hits if h.desc == "cter"]
+        glyziphits = []
+        glyx3seqs = cter.filtersequences(sequences, glyx3hits, args.gly3_coverage_threshold)
+        nterhits = []
+        if glyx3seqs:
+            glyx3seqs = u.SequenceIndex(glyx3seqs)
+            if args.single_pass:
+                glyziphits = cter.resolveglyzips(
+                    [h for h in hits if h.desc == "glyzipdomain"], self.zhmms, glyx3seqs,
+                    glyzipevalue = args.glyzip_i_evalue,
+                )
+            else:
+                glyziphits = cter.findglyzips(
+                    glyx3seqs, self.zhmms,
+                    glyzipevalue = args.glyzip_i_evalue,
+                    cpus = args.threads,
+                    **self.cascade
+                )
+            rows = self.searchnter(glyx3seqs)
+            if rows:
+                nterhits = nter.nearest_neighboor(
+                    rows, self.mapping,
+                    coverage_threshold = args.nter_coverage,
+                    evalue_threshold = args.nter_evalue,
+                )
+        for h in glyziphits + nterhits:
+            h.title = title
+        features = u.HitTable(glyx3hits)
+        features.extend(glyziphits)
+        features.extend(nterhits)
+        return features, tables.summarizerows(features)
+
+
+class Service:
+    """bounded pool of annotation jobs
+
+    Parameter
+    ---------
+    annotator : Annotator
+    jobs : int
+        jobs running at once
+    queue : int
+        jobs waiting for a slot, further jobs are refused (Busy)
+    """
+    def __init__(self, annotator:Annotator, jobs:int=1, queue:int=8):
+        self.annotator = annotator
+        self.pool = concurrent.futures.ThreadPoolExecutor(max(1, jobs), thread_name_prefix="pycalf-job")
+        self.slots = threading.BoundedSemaphore(max(1, jobs) + max(0, queue))
+        self.jobs = max(1, jobs)
+        self.queue = max(0, queue)
+        self.pending = 0
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def run(self, fasta:bytes, title:str="-"):
+        """annotate a fasta in the pool
+
+        Return
+        ------
+        dict
+            features and summary rows
+        """
+        if not self.slots.acquire(blocking=False):
+            raise Busy("%i jobs running and %i queued, retry later" % (self.jobs, self.queue))
+        with self._lock:
+            self.pending += 1
+        try:
+            features, summary = self.pool.submit(self.annotator.annotate, fasta, title).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.done += 1
+            self.slots.release()
+        return {
+            # missing evalues / coverages (NaN) are null
+            "features" : [
+                {c : None if v != v else v for c, v in zip(tables.Hit.__slots__, row)}
+                for row in features.rows()
+            ],
+            "summary" : [dict(zip(tables.SUMMARY_COLUMNS, row)) for row in summary],
+        }
+
+    def health(self):
+        with self._lock:
+            return {"jobs" : self.jobs, "queue" : self.queue, "pending" : self.pending, "done" : self.done}
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def answer(service:Service, request:dict):
+    """json answer and HTTP status of a request"""
+    try:
+        fasta = request["fasta"]
+        return service.run(fasta.encode() if isinstance(fasta, str) else fasta, request.get("title") or "-"), 200
+    except Busy as err:
+        return {"error" : str(err)}, 503
+    except (KeyError, ValueError) as err:
+        return {"error" : "bad request : %s" % err}, 400
+    except Exception as err:
+        logging.exception("job failed")
+        return {"error" : str(err)}, 500
+
+
+class UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError as err:
+            response = {"error" : "bad request : %s" % err}
+        else:
+            response, _ = answer(self.server.service, request)
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    def reply(self, response:dict, status:int=200):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path == "/health":
+            self.reply(self.server.service.health())
+        else:
+            self.reply({"error" : "not found"}, 404)
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/annotate":
+            self.reply({"error" : "not found"}, 404)
+            return
+        title = urllib.parse.parse_qs(url.query).get("title", ["-"])[0]
+        fasta = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(*answer(self.server.service, {"fasta" : fasta, "title" : title}))
+
+    def log_message(self, format, *args):
+        logging.debug("http : " + format % args)
+
+
+def main(argv=None):
+    from .. import main as cli
+    parser = argparse.ArgumentParser(
+        prog="pycalf serve",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+        parents=[cli.search_arguments()],
+    )
+    parser.add_argument('--socket', default=None,
+                        help='Unix socket to listen on')
+    parser.add_argument('--http', default=None,
+                        help='HOST:PORT to listen on over HTTP')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='jobs running at once (default: %(default)s)')
+    parser.add_argument('--queue', type=int, default=16,
+                        help='jobs waiting for a slot before requests are refused (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not args.socket and not args.http:
+        parser.error("--socket and / or --http is required")
+
+    service = Service(Annotator(args), args.jobs, args.queue)
+    servers = []
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixServer(args.socket, UnixHandler)
+        servers.append(server)
+        logging.info("listening on %s" % args.socket)
+    if args.http:
+        host, port = args.http.rsplit(":", 1)
+        server = http.server.ThreadingHTTPServer((host, int(port)), HTTPHandler)
+        server.daemon_threads = True
+        servers.append(server)
+        logging.info("listening on http://%s:%s" % (host, port))
+    for server in servers:
+        server.service = service
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers[1:]]
+    for thread in threads:
+        thread.start()
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        logging.info("stopping")
+    finally:
+        for server in servers:
+            if server is not servers[0]:
+                server.shutdown()
+            server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -15,6 +15,9 @@
 
 
 import argparse
+import contextlib
+import functools
+import importlib
 import os
 import sys
 
@@ -22,11 +25,9 @@ import sys
 import multiprocessing
 import logging
 
-import pandas as pd
-
-from .core import annotcter as cter
-from .core import annotnter as nter
-from .utils import utils as u
+# only light modules are imported here, pyhmmer and the search modules are imported
+# by run and subcommands by main, so that --help or pycalf client start at once
+from .utils import writers
 
 DATASDIR = os.path.join(os.path.dirname(__file__), 'datas')
 
@@ -39,62 +40,59 @@ logging.basicConfig(
 )
 
 
-def get_args():
-    parser = argparse.ArgumentParser(
-        description="""
-        pyCALF\n
-                           _(__)_        V
-                          '-e e -'__,--.__)
-                           (o_o)        ) 
-                              \. /___.  |
-                              ||| _)/_)/
-                             //_(/_(/_(
+def domz(value:str):
+    """--domz : a number or auto (pyhmmer default)"""
+    return None if value == "auto" else int(value)
 
-                        
-        pyCALF stand for python CALcyanin Finder
-        The calcyanin protein will be search and annotated within your input file(s) following three steps:
-            1) the glycine triplication specific of calcyanin will be searched using HMM profile.
-            2) glycine zipper will be annotated individually using specific HMM models for sequences with a glycine triplication.
-            3) the N-ter extremity of sequences with a glyX3 will be annotated using blastp and known n-ter as subject database.
-        """,
-        formatter_class= argparse.RawTextHelpFormatter
-        )
-    parser.add_argument('-i', dest='translated_cds_input', required=True, #action="extend", nargs="+" , 
-                        help='yaml file, fasta file or directory containing cds fasta files')
-    parser.add_argument('-e', dest='file_extension', type=str, default="faa.gz" , 
-                        help='input files extension')            
-    parser.add_argument('-o', dest='res_dir', type=str, required=True,
-                        help='output directory')   
-              
-    parser.add_argument('--glyx3-hmm', dest='glyx3_phmm', type=str, default= DATASDIR + "/GlyX3.hmm" ,
-                        help='path to GlyX3 hmm profile (default: %(default)s)" ')                
-    parser.add_argument('--domz', dest='domz', type=int, default=10000,
-                        help='sequence space size (default: %(default)s)"')     
 
+def search_arguments():
+    """options of the calcyanin search (profiles, databases, thresholds), shared by pycalf and pycalf serve"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--refs', dest='refs', default=None,
+                        help='reference bundle (see pycalf build-refs), replaces the HMM profiles, --nterdb and --nter-mapping-file')
+    parser.add_argument('--glyx3-hmm', dest='glyx3_phmm', type=str, default= DATASDIR + "/GlyX3.hmm" ,
+                        help='path to GlyX3 hmm profile (default: %(default)s)" ')
+    parser.add_argument('--domz', dest='domz', type=domz, default=10000,
+                        help='sequence space size for domain i-evalues, auto to use the number of reported sequences (default: %(default)s)"')
+    parser.add_argument('--E', dest='E', type=float, default=None,
+                        help='hmmsearch reporting evalue threshold, unreported sequences are not annotated (default: 10)')
+    parser.add_argument('--domE', dest='domE', type=float, default=None,
+                        help='hmmsearch domain reporting i-evalue threshold (default: 10)')
+    parser.add_argument('--F1', dest='F1', type=float, default=None,
+                        help='hmmsearch MSV filter P-value threshold (default: 0.02)')
+    parser.add_argument('--F2', dest='F2', type=float, default=None,
+                        help='hmmsearch Viterbi filter P-value threshold (default: 1e-3)')
+    parser.add_argument('--F3', dest='F3', type=float, default=None,
+                        help='hmmsearch Forward filter P-value threshold (default: 1e-5)')
     parser.add_argument('--glyx3-coverage', dest='gly3_coverage_threshold', 
-                        type=int,default=0.62,
+                        type=float,default=0.62,
                         help="minimal coverage to be considered as a potential calcyanin (default: %(default)s)" )
     # parser.add_argument('--glyx3-qcovhsp', dest='gly3_qcovhps', type=int,default=0)
     parser.add_argument('--glyx3-evalue', dest='gly3_evalue_threshold', 
-                        type=int,default=1e-30,
+                        type=float,default=1e-30,
                         help="hit's evalue threshold (default: %(default)s)")
     parser.add_argument('--glyx3-i-evalue', dest='gly3_i_evalue_threshold', 
-                        type=int,default=1,
+                        type=float,default=1,
                         help="domain's i_evalue threshold (default: %(default)s)")
-
     parser.add_argument('--nterdb', dest='nterdb_fa', 
                         default = DATASDIR + "/nterdb.fasta", 
                         help='path to nterdb fasta file (default: %(default)s)')
     parser.add_argument('--nter-mapping-file', dest='nterdb_tab', 
                         default= DATASDIR + "/nterdb.tsv", 
                         help='path to nterdb mapping file (default: %(default)s)')
+    parser.add_argument('--nter-backend', dest='nter_backend', 
+                        choices=["blastp","phmmer"], default="blastp",
+                        help="N-ter similarity search : external blastp or in-process pyhmmer phmmer (default: %(default)s)")
+    parser.add_argument('--nter-index', dest='nter_index', action='store_true',
+                        help="with --nter-backend phmmer, only align each sequence to the N-ter references sharing the most k-mers with it (k-mer index built once next to the references)")
+    parser.add_argument('--nter-candidates', dest='nter_candidates', type=int, default=32,
+                        help="N-ter references aligned to each sequence with --nter-index (default: %(default)s)")
     parser.add_argument('--nter-coverage', dest='nter_coverage', 
-                        type=int,default=80,
+                        type=float,default=80,
                         help="nter minimal coverage (default: %(default)s)")
     parser.add_argument('--nter-evalue', dest='nter_evalue', 
-                        type=int,default=1e-07,
+                        type=float,default=1e-07,
                         help="nter evalue threshold (default: %(default)s)")
-
     parser.add_argument('--gly1-phmm', dest = 'gly1_phmm', 
                         default = DATASDIR + "/Gly1.hmm", 
                         help='path to GlyZip1 hmm profile (default: %(default)s)')
@@ -104,26 +102,111 @@ def get_args():
     parser.add_argument('--gly3-phmm', dest = 'gly3_phmm', 
                         default = DATASDIR + "/Gly3.hmm", 
                         help='path to GlyZip3 hmm profile (default: %(default)s)')
-
+    parser.add_argument('--single-pass', dest='single_pass', action='store_true',
+                        help="search GlyX3 and glyzip profiles of --hmms in a single pass over the input instead of two searches")
+    parser.add_argument('--hmms', dest='hmms', 
+                        default = DATASDIR + "/all.hmm", 
+                        help='hmm profiles used with --single-pass, must contain GlyX3, Gly1, Gly2 and Gly3 (default: %(default)s)')
     parser.add_argument('--glyzip-i-evalue', dest='glyzip_i_evalue', 
-                        type=int,default=3.6e-4,
+                        type=float,default=3.6e-4,
                         help = "glyzip i-evalue threshold (default: %(default)s)" )
     parser.add_argument('--glyzip-evalue', dest='glyzip_evalue', 
-                        type=int,default=1,
+                        type=float,default=1,
                         help="glyzip evalue threshold (default: %(default)s)")
-    
-    parser.add_argument('--log', default = None)
     parser.add_argument('--blastp', default = None)
-
     parser.add_argument('--threads', type=int, default = multiprocessing.cpu_count(),
                         help="(default: %(default)s)")
+    return parser
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="""
+        pyCALF\n
+                           _(__)_        V
+                          '-e e -'__,--.__)
+                           (o_o)        ) 
+                              \. /___.  |
+                              ||| _)/_)/
+                             //_(/_(/_(
+
+                        
+        pyCALF stand for python CALcyanin Finder
+        The calcyanin protein will be search and annotated within your input file(s) following three steps:
+            1) the glycine triplication specific of calcyanin will be searched using HMM profile.
+            2) glycine zipper will be annotated individually using specific HMM models for sequences with a glycine triplication.
+            3) the N-ter extremity of sequences with a glyX3 will be annotated using blastp and known n-ter as subject database.
+        """,
+        formatter_class= argparse.RawTextHelpFormatter,
+        parents=[search_arguments()],
+        )
+    parser.add_argument('-i', dest='translated_cds_input', required=True, #action="extend", nargs="+" , 
+                        help='yaml file, fasta file, sequence store (see pycalf pack) or directory containing cds fasta files')
+    parser.add_argument('-e', dest='file_extension', type=str, default="faa.gz" , 
+                        help='input files extension')
+    parser.add_argument('-o', dest='res_dir', type=str, required=True,
+                        help='output directory')
+    parser.add_argument('--z', dest='z', type=int, default=None,
+                        help='database size used for hit evalues (default: number of input sequences)')
+    parser.add_argument('--block-size', dest='block_size', type=int, default=None,
+                        help='stream the input by blocks of BLOCK_SIZE sequences, only glyx3+ sequences are kept in memory (default: load all sequences at once)')
+    parser.add_argument('--readahead', dest='readahead', type=int, default=2,
+                        help='number of input blocks decompressed and parsed in background while the current block is searched, 0 to disable (default: %(default)s)')
+    parser.add_argument('--mmap', dest='mmap', action='store_true',
+                        help='re-read glyx3+ sequences by offset once the input is screened instead of keeping them in memory, for plain fasta inputs (indexed in .pcfai files) and sequence stores')
+    parser.add_argument('--index-dir', dest='index_dir', default=None,
+                        help='directory of the .pcfai indexes of --mmap (default: next to the input files, or the temporary directory when they are read-only)')
+    parser.add_argument('--cache', dest='cache', default = None,
+                        help="sqlite file caching per-sequence hits between runs, only new or modified sequences are searched (default: no cache)")
+    parser.add_argument('--cache-max-size', dest='cache_max_size', type=int, default = 10000,
+                        help="cache size in MB above which least recently used entries are evicted (default: %(default)s)")
+    parser.add_argument('--save-raw', dest='save_raw', action='store_true',
+                        help="save unfiltered domain-level results to raw.npz in the output directory, see pycalf rescore")
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                        help="annotate N-ter of glyx3+ sequences of each block while the next blocks are screened (with --block-size)")
+    parser.add_argument('--output-format', dest='output_format', 
+                        choices=list(writers.FORMATS), default="csv",
+                        help="format of intermediate, feature and summary tables, written as the run goes (default: %(default)s)")
+    parser.add_argument('--resume', action='store_true',
+                        help="carry on from the last checkpoint of an interrupted run with the same inputs and parameters in the output directory")
+    parser.add_argument('--log', default = None)
+    parser.add_argument('--profile', action='store_true',
+                        help="run under cProfile, stats are written to profile.prof and profile.txt in the output directory")
+    parser.add_argument('--workers', type=int, default = 1,
+                        help="number of input shards searched concurrently, threads are shared between workers (default: %(default)s)")
+    parser.add_argument('--workers-backend', dest='workers_backend', 
+                        choices=["threads","processes"], default = "threads",
+                        help="run shards in threads or in a process pool (default: %(default)s)")
         
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     return args
 
 
+# pycalf <command> [options], anything else runs the calcyanin search
+# commands are modules with a main(argv), imported when the command is run
+COMMANDS = {
+    "pack" : ".utils.seqstore",
+    "index" : ".utils.seqstore",
+    "rescore" : ".core.rescore",
+    "context" : ".core.context",
+    "serve" : ".core.server",
+    "client" : ".core.client",
+    "build-refs" : ".core.refs",
+}
+
+
+# options that do not change results, a run can be resumed with different values
+RUNTIME_OPTIONS = (
+    "resume", "log", "profile", "blastp", "threads", "workers", "workers_backend",
+    "readahead", "cache", "cache_max_size",
+)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = importlib.import_module(COMMANDS[sys.argv[1]], __package__)
+        return command.main(sys.argv[2:])
     print(__doc__)
     args = get_args()
     
@@ -134,141 +217,448 @@ def main():
         fh.setFormatter(formatter)
         logging.getLogger('').addHandler(fh)
 
-    logging.info("blastp : " , args.blastp)        
-
     res_dir = os.path.abspath(args.res_dir)
 
 
     os.makedirs(res_dir + "/fastas" , exist_ok=True)
     os.makedirs(res_dir + "/intermediates" , exist_ok=True)
-    
-    logging.info("loading input sequences :  %s" % args.translated_cds_input)
 
-    sequences = u.easelfasta(args.translated_cds_input)
-    
-    logging.info("loading GlyX3 HMM profile")
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(run, args)
+        profiler.dump_stats(res_dir + "/profile.prof")
+        with open(res_dir + "/profile.txt", "w") as stream:
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(50)
+        logging.info("profile written to %s" % res_dir + "/profile.prof")
+    else:
+        run(args)
+
+
+def logcascade(m, name:str):
+    """log how many sequences each stage of the GlyX3 search eliminated"""
+    searched = m.counts.get(name + "_searched", 0)
+    hits = m.counts.get(name + "_past_filters", 0)
+    reported = m.counts.get(name + "_reported", 0)
+    glyx3hits = m.counts.get("glyx3_hits", 0)
+    positives = m.counts.get("glyx3_positive_sequences", 0)
+    logging.info("%i sequence with a glycine triplication found, %i glyx3+ sequences." % (glyx3hits, positives))
+    if not searched:
+        # everything came from the cache or was searched in worker processes
+        return
+    logging.info("GlyX3 cascade : %i sequences searched" % searched)
+    logging.info("  - %i eliminated by MSV / bias / Viterbi / Forward filters" % (searched - hits))
+    logging.info("  - %i eliminated by reporting thresholds (E / domE)" % (hits - reported))
+    logging.info("  - %i eliminated by coverage threshold" % (glyx3hits - positives))
+    logging.info("  (%i hits below the GlyX3 evalue threshold)" % m.counts.get("glyx3_below_evalue", 0))
+
+
+def run(args):
+    """run the three annotation steps, outputs are written to args.res_dir"""
+    from .core import annotcter as cter
+    from .core import annotnter as nter
+    from .core import pipeline
+    from .core import refs
+    from .utils import utils as u
+    from .utils import inputs
+    from .utils import cache as rcache
+    from .utils import parallel
+    from .utils import metrics
+    from .utils import rawhits
+    from .utils import checkpoint
+    res_dir = os.path.abspath(args.res_dir)
+    m = metrics.reset()
+    raw = rawhits.reset(args.save_raw)
     
-    ghmm = u.easelhmm(args.glyx3_phmm)    
-    logging.info("Search GlyX3 in sequence database ... ")
-    glyx3hits = cter.findglyx3(
-        sequences,
-        ghmm, 
-        glyx3evalue= args.gly3_evalue_threshold, 
-        glyx3ievalue = args.gly3_i_evalue_threshold, 
-        cpus = args.threads,
-        domZ = args.domz
+    genomes = inputs.parse_input(args.translated_cds_input, args.file_extension)
+    # a directory, a yaml manifest or a multi-genome store is screened as a batch of genomes
+    batch = os.path.isdir(args.translated_cds_input) or args.translated_cds_input.endswith((".yaml",".yml")) or len(genomes) > 1
+    logging.info("%i input file(s) : %s" % (len(genomes), args.translated_cds_input))
+
+    ckpt = None
+    if raw is not None or args.output_format == "parquet":
+        # raw results are kept in memory and parquet tables can not be appended to
+        if args.resume:
+            logging.warning("--resume ignored with %s" % ("--save-raw" if raw is not None else "parquet output"))
+    else:
+        params = {k : v for k, v in vars(args).items() if k not in RUNTIME_OPTIONS}
+        files, ids = refs.sources(args)
+        ckpt = checkpoint.Checkpoint(
+            res_dir,
+            checkpoint.fingerprint(list(genomes.values()), files, **params, **ids),
+            resume = args.resume
         )
-    logging.info("%i sequence with a glycine triplication found." % len(glyx3hits))
-    
-    summary_df = None
-    if glyx3hits:
-        logging.info("make intermediate file for triplication ..." )
-        u.maketable(glyx3hits).to_csv(
-            res_dir + "/intermediates/calglyx3.csv",
-            index=False,
-            header=True,
-            sep="\t"
-        )     
-        logging.info("filter input sequences and keep only glyx3+ sequences..." )
-        glyx3seqs = cter.filtersequences(
-            sequences,glyx3hits,
-            args.gly3_coverage_threshold
+        if ckpt.done("summary"):
+            logging.info("--resume : run already complete, nothing to do")
+            return
+
+    # profiles are optimized once and reused for every block
+    # N-ter mapping (and references with --nter-backend phmmer) are read once as well
+    with m.stage("load"):
+        references = refs.References(args)
+        ghmm = references.ghmm
+        zhmms = references.zhmms
+        logging.info("done.")
+
+        cache = None
+        if args.cache and raw is not None:
+            # cached sequences are not searched, so their domains could not be recorded
+            logging.warning("--cache ignored with --save-raw")
+        elif args.cache:
+            logging.info("using result cache %s" % args.cache)
+            cache = rcache.ResultCache(args.cache, max_size = args.cache_max_size * 1024**2)
+
+        z = args.z
+        if z is None and ckpt is not None:
+            z = ckpt.get("z")
+        if (args.block_size or cache) and z is None:
+            # evalues must be computed against the whole input, not each block
+            logging.info("counting input sequences :  %s" % args.translated_cds_input)
+            z = inputs.countsequences(genomes, args.threads)
+            logging.info("done : %i sequences" % z)
+            if ckpt is not None:
+                ckpt.commit(z = z)
+    # hmmsearch filter cascade and reporting thresholds, shared by every search
+    cascade = {
+        k : getattr(args, k) for k in ("E","domE","F1","F2","F3") 
+        if getattr(args, k) is not None
+    }
+    if args.domz is not None:
+        cascade["domZ"] = args.domz
+    search_options = dict(cascade)
+    if z:
+        search_options["Z"] = z
+    if cache:
+        files, ids = refs.sources(args, "glyx3")
+        glyx3fp = rcache.fingerprint(
+            files, **ids,
+            evalue = args.gly3_evalue_threshold,
+            ievalue = args.gly3_i_evalue_threshold,
+            **search_options
+        )
+        files, ids = refs.sources(args, "glyzip")
+        # glyzip evalues depend on the number of glyx3+ sequences, known once the input is screened
+        glyzipfp = functools.partial(
+            rcache.fingerprint,
+            files, **ids,
+            ievalue = args.glyzip_i_evalue,
+            **cascade
+        )
+        files, ids = refs.sources(args, "all")
+        allfp = rcache.fingerprint(
+            files, **ids,
+            evalue = args.gly3_evalue_threshold,
+            ievalue = args.gly3_i_evalue_threshold,
+            coverage = args.gly3_coverage_threshold,
+            **search_options
+        )
+        files, ids = refs.sources(args, "nter")
+        if references.nterindex is not None:
+            ids["candidates"] = args.nter_candidates
+        nterfp = rcache.fingerprint(
+            files, **ids,
+            evalue = args.nter_evalue,
+            coverage = args.nter_coverage,
+            backend = args.nter_backend,
+        )
+    else:
+        glyx3fp = glyzipfp = allfp = nterfp = None
+
+    backend = args.workers_backend
+    if raw is not None and backend == "processes":
+        # domains recorded in worker processes would be lost
+        logging.warning("--save-raw : shards are searched in threads")
+        backend = "threads"
+    executor = parallel.ShardExecutor(args.workers, backend)
+    # threads available for each shard search
+    cpus = max(1, args.threads // executor.workers)
+
+    if args.single_pass:
+        logging.info("Search GlyX3 and glyzip in sequence database %s ... " % args.translated_cds_input)
+        stage, stagefp = "all", allfp
+        search = lambda seqs: executor.run(
+            cter.findall,
+            seqs,
+            ghmm, 
+            zhmms,
+            glyx3evalue= args.gly3_evalue_threshold, 
+            glyx3ievalue = args.gly3_i_evalue_threshold, 
+            coverage_threshold = args.gly3_coverage_threshold,
+            cpus = cpus,
+            title = None if batch else "-",
+            **search_options
             )
-        logging.info("done : %i glyx3+ sequences"  % len(glyx3seqs))
-        if glyx3seqs:
-            logging.info("loading glyzip' specific HMM profiles ... " )
-            zhmms = [ u.easelhmm(i)  for i in [args.gly1_phmm , args.gly2_phmm , args.gly3_phmm] ]
-            logging.info("done.")
-            logging.info("search glyzip in glyx3+ sequences")
-            glyziphits = cter.findglyzips(
-                sequences = glyx3seqs,
-                hmms = zhmms,
-                glyzipevalue = args.glyzip_i_evalue, 
-                cpus = args.threads,
-                domZ = args.domz
-            ) 
-            logging.info("done.")
-            # save fasta and table
-            logging.info("save intermediates files ... ")
-            u.maketable(glyziphits).to_csv(
-                res_dir + "/intermediates/calglyzip.csv",
-                index=False,
-                header=True,
-                sep="\t"
+    else:
+        logging.info("Search GlyX3 in sequence database %s ... " % args.translated_cds_input)
+        stage, stagefp = "glyx3", glyx3fp
+        search = lambda seqs: executor.run(
+            cter.findglyx3,
+            seqs,
+            ghmm, 
+            glyx3evalue= args.gly3_evalue_threshold, 
+            glyx3ievalue = args.gly3_i_evalue_threshold, 
+            cpus = cpus,
+            title = None if batch else "-",
+            **search_options
             )
 
-            u.writefasta(
-                glyx3seqs, 
-                res_dir + "/fastas/glyx3seq.fasta"
-            )           
-            logging.info("done.")
-            # start n-ter annotation
-
-            logging.info("search similar N-ter in %s " % args.nterdb_fa )
-            df = nter.blastp(                
-                res_dir + "/fastas/glyx3seq.fasta",
-                args.nterdb_fa,
-                args.nter_evalue,
-                blastpexec=args.blastp
+    mmapped = args.mmap and all(inputs.compression(f) is None for f in genomes.values())
+    if args.mmap and not mmapped:
+        logging.warning("--mmap ignored, compressed input files can not be indexed")
+
+    def searchglyzips(seqs):
+        # i-evalues are computed against every glyx3+ sequence, including the cached ones
+        Z = len(seqs)
+        with m.stage("glyzip"):
+            return rcache.cached(
+                cache, "glyzip", glyzipfp(Z = Z) if cache else None, seqs,
+                lambda misses: executor.run(
+                    cter.findglyzips,
+                    misses,
+                    hmms = zhmms,
+                    glyzipevalue = args.glyzip_i_evalue, 
+                    cpus = cpus,
+                    Z = Z,
+                    **cascade
+                ) 
             )
-            logging.info("done.")
 
-            nterhits = []
-
-            if df is not None and not df.empty:                           
-                nterhits = nter.nearest_neighboor(
-                    df,
-                    DATASDIR + "/nterdb.tsv",
-                )                
-                logging.info("Similar nter found for %i sequences." % len(nterhits) )
-            del df
-            
-            logging.info("save intermediates files ... ")
-            u.maketable(nterhits).to_csv(
-                res_dir + "/intermediates/calnter.csv",
-                index=False,
-                header=True,
-                sep="\t"
+    def searchnter(seqs):
+        # only the best alignment of each sequence is kept, unless every alignment is recorded
+        best = nter.BestHits(1, args.nter_evalue, args.nter_coverage) if raw is None else None
+        if args.nter_backend == "phmmer":
+            rows = nter.phmmer(
+                seqs,
+                references.nterrefs,
+                args.nter_evalue,
+                cpus = args.threads,
+                index = references.nterindex,
+                candidates = args.nter_candidates,
+                best = best,
             )
-            logging.info("done.")
-            logging.info("make feature table ... ")
-            summary_df = u.maketable(glyx3hits + glyziphits +  nterhits)
-            summary_df.to_csv(
-                res_dir + "/features.csv",
-                index=False,
-                header=True,
-                sep="\t"
+        else:
+            logging.info("blastp : %s" % args.blastp)
+            query = res_dir + "/fastas/glyx3seq.fasta"
+            if cache or pipe is not None:
+                # only sequences missing from cache / of the current batch are searched
+                query = res_dir + "/fastas/nterquery.fasta"
+                u.writefasta(seqs, query)
+            rows = nter.blastp(                
+                query,
+                references.subject(res_dir + "/fastas"),
+                args.nter_evalue,
+                blastpexec=args.blastp,
+                threads=args.threads,
+                best=best,
             )
-            logging.info("done.")
-
-        logging.info("Summarizing calcyanin modular organization to %s" % res_dir + "/summary.csv" )
-        
-        reliable_cpt = 0
-        with open(res_dir + "/summary.csv" , "w") as stream: 
-            stream.write("accession;flag;nter;cter;is_trusted\n")
-            if summary_df is not None: 
-                for seqid , featuredf in summary_df.groupby("seqid"):
-
-                    cterom = ",".join(
-                        list(
-                            featuredf[featuredf.desc == "glyzip"].sort_values("start").domid
-                            )
+        if raw is not None:
+            raw.add_nter(rows)
+        if rows:
+            return nter.nearest_neighboor(
+                rows,
+                references.mapping,
+                coverage_threshold = args.nter_coverage,
+                evalue_threshold = args.nter_evalue,
+            )                
+        return []
+
+    def annotatenter(seqs):
+        with m.stage("nter"):
+            return rcache.cached(cache, "nter", nterfp, seqs, searchnter)
+
+    pipe = None
+    if args.pipeline:
+        if mmapped:
+            logging.warning("--pipeline ignored with --mmap")
+        else:
+            # glyzip i-evalues are computed against every glyx3+ sequence of the input,
+            # glyzip is searched once the input is screened
+            logging.info("N-ter of glyx3+ sequences are annotated while the input is screened")
+            pipe = pipeline.Pipeline({"nter" : annotatenter})
+
+    fasta = res_dir + "/fastas/glyx3seq.fasta"
+    resumed = ckpt is not None and ckpt.resumed
+    writer = writers.ResultWriter(
+        res_dir, args.output_format, list(genomes) if batch else None,
+        resume = ckpt.offsets if resumed else None
+    )
+
+    def annotate(glyx3hits, glyziphits, nterhits):
+        """tag glyzip / nter hits with their genome, write them with features and summary"""
+        titles = {u.tostr(h.seqid) : h.title for h in glyx3hits}
+        for h in glyziphits:
+            h.title = titles.get(u.tostr(h.seqid), "-")
+        for h in nterhits:
+            h.title = titles.get(u.tostr(h.seqid), "-")
+        m.count("glyzip_hits", len(glyziphits))
+        m.count("nter_hits", len(nterhits))
+        with m.stage("summarize"):
+            writer.writeannotations(glyx3hits, glyziphits, nterhits)
+
+    # glyx3 hits are kept to annotate glyx3+ sequences once the input is screened
+    glyx3hits = u.HitTable()
+    glyx3seqs = []
+    glyziphits = []
+    nterhits = []
+    submitted = set()
+    pending = {}
+    skip = 0
+    if resumed:
+        # outputs are cut back to the last checkpoint, completed blocks are not searched again
+        skip = ckpt.blocks
+        ckpt.restore(fasta)
+        if not mmapped and os.path.getsize(fasta):
+            glyx3seqs = u.easelfasta(fasta)
+        submitted.update(s.name for s in glyx3seqs)
+        hits, records = ckpt.readhits("screen")
+        glyx3hits.extend(h for h in hits if h.desc == "cter")
+        # glyzip domains with --single-pass (see cter.findall)
+        glyziphits = [h for h in hits if h.desc == "glyzipdomain"]
+        # N-ter hits of the blocks annotated by the pipeline
+        nterhits = [h for h in hits if h.desc == "nter"]
+        if mmapped:
+            glyx3seqs = [(g.encode(), n.encode()) for r in records for g, n in r["kept"]]
+        logging.info("%i input block(s) restored from checkpoint" % skip)
+    else:
+        open(fasta, "w").close()
+
+    def commit(blocks:int, marks:dict, hits=None, kept=()):
+        """record the outputs of the first blocks input blocks"""
+        if ckpt is None:
+            return
+        offsets = dict(marks)
+        if hits is not None:
+            offsets.update(ckpt.writehits("screen", hits, kept=[(u.tostr(g), u.tostr(n)) for g, n in kept]))
+        ckpt.commit(blocks=blocks, offsets=offsets)
+
+    screened = ckpt is not None and ckpt.done("screen")
+    # in batch mode sequences are named <genome>::<accession>, genomes may share accessions
+    blocks = [] if screened else inputs.easelgenomes(
+        genomes, args.block_size, 
+        threads = args.threads, 
+        readahead = args.readahead if args.block_size else 0,
+        qualify = batch,
+        )
+    with pipe if pipe is not None else contextlib.nullcontext():
+        for n, block in enumerate(m.timed(blocks, "load")):
+            if n < skip:
+                continue
+            m.count("input_sequences", len(block))
+            with m.stage("glyx3"):
+                blockhits = rcache.cached(
+                    cache, stage, stagefp, block, search,
+                    title = None if batch else "-",
                     )
-                    nterom = "".join(list(featuredf[featuredf.desc == "nter"].domid))
-                    
-                    flag = u.summarize(nterom,cterom)
-                    
-                    verif =  "checked" if flag == "Calcyanin with known N-ter" else "verification required"
-                    if verif == "checked":
-                        reliable_cpt +=1
-                    stream.write("{};{};{};{};{}\n".format(
-                        seqid, flag , nterom, cterom , verif )
+            blockglyx3hits = [h for h in blockhits if h.desc == "cter"]
+            blockglyziphits = [h for h in blockhits if h.desc == "glyzipdomain"]
+            writer.writeglyx3(blockglyx3hits)
+            m.count("glyx3_hits", len(blockglyx3hits))
+            m.count("glyx3_below_evalue", sum(1 for h in blockglyx3hits if h.evalue < args.gly3_evalue_threshold))
+            # keep only glyx3+ sequences, the rest of the block is dropped
+            with m.stage("filter"):
+                kept = cter.filtersequences(
+                    block,blockglyx3hits,
+                    args.gly3_coverage_threshold
                     )
-        
-        logging.info("done.")
-        logging.info("%i reliable calcyanin found." % reliable_cpt)
+            m.count("glyx3_positive_sequences", len(kept))
+            del block
+            if mmapped:
+                # sequences are re-read from the input files once the input is screened
+                keys = [(s.source, s.name) for s in kept]
+                glyx3hits.extend(blockglyx3hits)
+                glyziphits += blockglyziphits
+                glyx3seqs += keys
+                commit(n + 1, {writer.glyx3.path : writer.glyx3.tell()}, blockhits, keys)
+                continue
+            # duplicated accessions are annotated once, as with SequenceIndex
+            fresh = [s for s in kept if s.name not in submitted]
+            submitted.update(s.name for s in fresh)
+            u.writefasta(fresh, fasta, mode="a")
+            marks = {writer.glyx3.path : writer.glyx3.tell(), fasta : os.path.getsize(fasta)}
+            glyx3hits.extend(blockglyx3hits)
+            glyziphits += blockglyziphits
+            glyx3seqs += kept
+            if pipe is not None:
+                # a block is checkpointed once its N-ter are annotated
+                pending[pipe.submit(fresh)] = (n, marks, blockhits)
+                for i, results in pipe.ready():
+                    j, marks, hits = pending.pop(i)
+                    nterhits += results["nter"]
+                    commit(j + 1, marks, hits + results["nter"])
+                continue
+            commit(n + 1, marks, blockhits)
+        if pipe is not None:
+            for i, results in pipe.close():
+                j, marks, hits = pending.pop(i)
+                nterhits += results["nter"]
+                commit(j + 1, marks, hits + results["nter"])
+    if ckpt is not None:
+        ckpt.complete("screen")
+    logcascade(m, u.tostr(ghmm.name))
+
+    if mmapped and glyx3seqs:
+        with m.stage("load"):
+            glyx3seqs = inputs.fetchsequences(genomes, glyx3seqs, args.index_dir)
+        u.writefasta(glyx3seqs, fasta)
+    if glyx3seqs:
+        glyx3seqs = u.SequenceIndex(glyx3seqs)
+        if ckpt is not None and ckpt.done("glyzip"):
+            glyziphits, _ = ckpt.readhits("glyzip")
+        elif args.single_pass:
+            # i-evalues are computed against glyx3+ sequences, as with a glyzip search
+            glyziphits = cter.resolveglyzips(glyziphits, zhmms, glyx3seqs, args.glyzip_i_evalue)
+        else:
+            logging.info("search glyzip in %i glyx3+ sequences" % len(glyx3seqs))
+            glyziphits = searchglyzips(glyx3seqs)
+            logging.info("done.")
+            if ckpt is not None:
+                ckpt.complete("glyzip", ckpt.writehits("glyzip", glyziphits))
+        if pipe is not None:
+            pass # N-ter were annotated while the input was screened
+        elif ckpt is not None and ckpt.done("nter"):
+            nterhits, _ = ckpt.readhits("nter")
+        else:
+            logging.info("search similar N-ter in %s with %s" % (references.nterdb, args.nter_backend) )
+            nterhits = annotatenter(glyx3seqs)
+            logging.info("done.")
+            if ckpt is not None:
+                ckpt.complete("nter", ckpt.writehits("nter", nterhits))
+    annotate(glyx3hits, glyziphits, nterhits)
+    del glyx3hits, glyziphits, nterhits
+
+    writer.close()
+    if ckpt is not None:
+        ckpt.complete("summary")
+    m.count("reliable_calcyanins", writer.reliable)
+    if writer.summary.rows:
+        logging.info("%i reliable calcyanin found." % writer.reliable)
     else:
         logging.info("No calcyanin found ... ")
+    executor.close()
+    if raw is not None:
+        raw.save(
+            res_dir + "/raw.npz",
+            glyx3_hmm = u.tostr(ghmm.name),
+            glyzip_hmms = [u.tostr(i.name) for i in zhmms],
+            single_pass = args.single_pass,
+            glyx3_evalue = args.gly3_evalue_threshold,
+            glyx3_i_evalue = args.gly3_i_evalue_threshold,
+            glyx3_coverage = args.gly3_coverage_threshold,
+            glyzip_i_evalue = args.glyzip_i_evalue,
+            nter_coverage = args.nter_coverage,
+            nter_evalue = args.nter_evalue,
+            nter_mapping_file = args.refs or args.nterdb_tab,
+            batch = batch,
+            genomes = list(genomes),
+        )
+        logging.info("raw results written to %s" % res_dir + "/raw.npz")
+    if cache:
+        cache.report()
+        cache.close()
+    m.log()
+    m.write(res_dir + "/metrics.json")
+    logging.info("metrics written to %s" % res_dir + "/metrics.json")
     logging.info("end")
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from . import tables
+
+
+def filedigest(f:str):
+    """sha256 of a file content"""
+    h = hashlib.sha256()
+    with open(f, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(files:list=(), **params):
+    """fingerprint of the models / databases and parameters used by a stage"""
+    h = hashlib.sha256()
+    for f in files:
+        h.update(filedigest(f).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def seqkey(seq):
+    """hash of the residues of a pyhmmer.easel.DigitalSequence"""
+    return hashlib.sha1(bytes(seq.sequence)).hexdigest()
+
+
+class ResultCache:
+    """on-disk cache of per-sequence hits, keyed on residues hash and stage fingerprint.
+
+    Hits are stored for every searched sequence (an empty list for sequences without hit)
+    so that a rerun only searches new or modified sequences. When the database grows above
+    max_size bytes, the least recently used entries are evicted.
+    """
+    def __init__(self, path:str, max_size:int=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.stats = {}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "stage TEXT, fingerprint TEXT, key TEXT, hits TEXT, size INTEGER, atime REAL, "
+            "PRIMARY KEY (stage, fingerprint, key))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_atime ON results (atime)")
+        self.db.commit()
+
+    def get(self, stage:str, fp:str, sequences):
+        """split sequences between cached ones and the ones to search
+
+        Return
+        ------
+        found : dict
+            key -> list of hits as dict (without seqid and title)
+        misses : list
+            sequences not in cache
+        """
+        keys = {}
+        for seq in sequences:
+            keys.setdefault(seqkey(seq), []).append(seq)
+        found = {}
+        now = time.time()
+        allkeys = list(keys)
+        for i in range(0, len(allkeys), 500):
+            chunk = allkeys[i:i+500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.db.execute(
+                "SELECT key, hits FROM results WHERE stage=? AND fingerprint=? AND key IN (%s)" % marks,
+                [stage, fp] + chunk
+            ).fetchall()
+            for key, hits in rows:
+                found[key] = json.loads(hits)
+            self.db.execute(
+                "UPDATE results SET atime=? WHERE stage=? AND fingerprint=? AND key IN (%s)" % marks,
+                [now, stage, fp] + chunk
+            )
+        self.db.commit()
+        misses = [seq for key, seqs in keys.items() if key not in found for seq in seqs]
+        stats = self.stats.setdefault(stage, [0, 0])
+        stats[0] += len(found)
+        stats[1] += len(keys) - len(found)
+        return found, misses
+
+    def put(self, stage:str, fp:str, sequences, hits:list):
+        """store hits of the searched sequences, sequences without hit are stored as well"""
+        byname = {}
+        for h in hits:
+            d = h.to_dict()
+            d.pop("seqid", None)
+            d.pop("title", None)
+            byname.setdefault(tables.tostr(h.seqid), []).append(d)
+        now = time.time()
+        rows = []
+        for seq in sequences:
+            value = json.dumps(byname.get(tables.tostr(seq.name), []))
+            rows.append((stage, fp, seqkey(seq), value, len(value) + 100, now))
+        self.db.executemany("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?)", rows)
+        self.db.commit()
+        self.evict()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size),0) FROM results").fetchone()[0]
+
+    def evict(self):
+        """remove least recently used entries until the cache is below 90% of max_size"""
+        if not self.max_size:
+            return 0
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return 0
+        excess += self.max_size // 10
+        todelete = []
+        for rowid, size in self.db.execute("SELECT rowid, size FROM results ORDER BY atime"):
+            if excess <= 0:
+                break
+            todelete.append((rowid,))
+            excess -= size
+        self.db.executemany("DELETE FROM results WHERE rowid=?", todelete)
+        self.db.commit()
+        logging.info("cache : %i entries evicted" % len(todelete))
+        return len(todelete)
+
+    def report(self):
+        for stage, (hit, miss) in self.stats.items():
+            total = hit + miss
+            logging.info("cache %s : %i hits, %i misses (%.1f%% hit rate)" % (
+                stage, hit, miss, 100 * hit / total if total else 0))
+        logging.info("cache size : %.1f MB (%s)" % (self.size() / 1024**2, self.path))
+
+    def close(self):
+        self.db.close()
+
+
+def cached(cache, stage:str, fp:str, sequences, search, title:str="-"):
+    """run search only on sequences missing from cache
+
+    Parameter
+    ---------
+    cache : ResultCache or None
+        without cache, search is run on all sequences
+    stage : str
+    fp : str
+        stage fingerprint
+    sequences : iterable of pyhmmer.easel.DigitalSequence
+    search : callable
+        search(list of sequences) -> list of tables.Hit, hits of a sequence must not depend on 
+        the other searched sequences (e.g evalues are computed against a fixed Z, which is 
+        part of fp), since only sequences missing from cache are searched
+    title : str
+        title of restored hits, None to use the source of each sequence (see findglyx3)
+
+    Return
+    ------
+    list of tables.Hit, in sequences order when cache is used
+    """
+    if cache is None:
+        return search(sequences)
+    sequences = list(sequences)
+    found, misses = cache.get(stage, fp, sequences)
+    fresh = search(misses) if misses else []
+    cache.put(stage, fp, misses, fresh)
+
+    byname = {}
+    for h in fresh:
+        byname.setdefault(tables.tostr(h.seqid), []).append(h)
+    hits = []
+    for seq in sequences:
+        name = tables.tostr(seq.name)
+        if name in byname:
+            hits += byname.pop(name)
+            continue
+        for d in found.get(seqkey(seq), []):
+            hits.append(tables.Hit(
+                seqid = seq.name,
+                title = title if title is not None else seq.source.decode(),
+                **d
+            ))
+    return hits
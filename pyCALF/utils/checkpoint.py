@@ -0,0 +1,180 @@
+"""checkpoints of a run, see --resume
+
+The state of a run is kept in res_dir/checkpoint/state.json : the fingerprint of the
+inputs and parameters, the stages completed, the number of input blocks done and the
+size of every output file at that point. Hits that are needed by later stages are
+persisted next to it (one json line per block or per stage), so a resumed run truncates
+the outputs to the last checkpoint, reloads these hits and carries on with the next
+block or stage instead of starting over.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from . import cache
+from . import tables
+
+
+def inputfingerprint(files):
+    """fingerprint of input files from their path, size and modification time
+
+    Input files are not hashed, a catalog of several hundred GB would take longer
+    to read than most of the stages a checkpoint skips.
+    """
+    h = hashlib.sha256()
+    for f in sorted(set(files)):
+        st = os.stat(f)
+        h.update(json.dumps([os.path.abspath(f), st.st_size, st.st_mtime_ns]).encode())
+    return h.hexdigest()
+
+
+def fingerprint(inputs:list, files:list=(), **params):
+    """fingerprint of a run : input files, models / databases (content) and parameters"""
+    return cache.fingerprint(files, inputs=inputfingerprint(inputs), **params)
+
+
+def truncate(f:str, size:int):
+    """cut f back to size bytes (the file is created if missing)"""
+    with open(f, "ab") as stream:
+        stream.truncate(size)
+
+
+class Checkpoint:
+    """completion markers and output offsets of a run
+
+    Parameter
+    ---------
+    res_dir : str
+    fp : str
+        run fingerprint (see fingerprint)
+    resume : bool
+        restore the state of a previous run with the same fingerprint, otherwise
+        (or if the fingerprints differ) the previous state is discarded
+    """
+    VERSION = 1
+
+    def __init__(self, res_dir:str, fp:str, resume:bool=False):
+        self.dir = os.path.join(res_dir, "checkpoint")
+        self.path = os.path.join(self.dir, "state.json")
+        self.state = None
+        if resume and os.path.exists(self.path):
+            with open(self.path) as stream:
+                state = json.load(stream)
+            if state.get("fingerprint") == fp and state.get("version") == self.VERSION:
+                self.state = state
+            else:
+                logging.warning("--resume : inputs or parameters changed since the checkpoint, starting over")
+        elif resume:
+            logging.warning("--resume : no checkpoint found in %s, starting over" % res_dir)
+        self.resumed = self.state is not None
+        if not self.resumed:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.state = {
+                "version" : self.VERSION,
+                "fingerprint" : fp,
+                "stages" : [],
+                "blocks" : 0,
+                "offsets" : {},
+                "values" : {},
+            }
+        os.makedirs(self.dir, exist_ok=True)
+        if self.resumed:
+            logging.info("resuming : %s done, %i input block(s) done" % (
+                ",".join(self.state["stages"]) or "no stage", self.state["blocks"]))
+
+    @property
+    def blocks(self):
+        """number of input blocks done"""
+        return self.state["blocks"]
+
+    @property
+    def offsets(self):
+        """output file -> size at the last checkpoint"""
+        return self.state["offsets"]
+
+    def get(self, key:str, default=None):
+        """value saved with commit / complete (e.g database size)"""
+        return self.state["values"].get(key, default)
+
+    def done(self, stage:str):
+        return stage in self.state["stages"]
+
+    def save(self):
+        # written to a temporary file first, a run killed while saving keeps the previous state
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as stream:
+            json.dump(self.state, stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(tmp, self.path)
+
+    def commit(self, blocks:int=None, offsets:dict=None, **values):
+        """record that blocks input blocks are done and the size of the outputs at that point"""
+        if blocks is not None:
+            self.state["blocks"] = blocks
+        if offsets is not None:
+            self.state["offsets"].update(offsets)
+        self.state["values"].update(values)
+        self.save()
+
+    def complete(self, stage:str, offsets:dict=None, **values):
+        """mark a stage as done"""
+        if stage not in self.state["stages"]:
+            self.state["stages"].append(stage)
+        self.commit(offsets=offsets, **values)
+
+    def restore(self, f:str):
+        """truncate f to its size at the last checkpoint
+
+        Return
+        ------
+        size : int
+            0 if f was not checkpointed
+        """
+        size = self.offsets.get(f, 0)
+        truncate(f, size)
+        return size
+
+    def file(self, name:str):
+        return os.path.join(self.dir, name)
+
+    def writehits(self, name:str, hits, **extra):
+        """append one json line of hits (and extra values) to checkpoint/<name>.jsonl
+
+        Return
+        ------
+        dict
+            {file : size} to commit with the hits
+        """
+        f = self.file(name + ".jsonl")
+        record = dict(extra, hits=[h.to_dict() for h in hits])
+        # lines written after the last checkpoint (e.g by a killed run) are dropped
+        self.restore(f)
+        with open(f, "a") as stream:
+            # numpy scalars, if any, are converted to python numbers
+            stream.write(json.dumps(record, default=lambda v: v.item()) + "\n")
+        return {f : os.path.getsize(f)}
+
+    def readhits(self, name:str):
+        """lines written by writehits, up to the last checkpoint
+
+        Return
+        ------
+        hits : list of tables.Hit
+        records : list of dict
+            extra values of each line
+        """
+        f = self.file(name + ".jsonl")
+        if not os.path.exists(f):
+            return [], []
+        self.restore(f)
+        hits = []
+        records = []
+        with open(f) as stream:
+            for line in stream:
+                record = json.loads(line)
+                hits += [tables.Hit(**h) for h in record.pop("hits")]
+                records.append(record)
+        return hits, records
@@ -0,0 +1,145 @@
+"""random access to plain nucleotide fasta files through a samtools-style .fai index
+
+The index (name, length, offset of the first base, bases and bytes per line of each
+record) is written next to the fasta file, or in an index directory, and reused while
+the fasta file is not modified. If it can not be written there (e.g read-only genome
+directory), it is written to the temporary directory. An existing samtools .fai index is reused as well.
+A subsequence is read by offset from the memory-mapped file, so extracting a CDS costs
+its length instead of a parse of the whole genome.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+
+
+COMPLEMENT = bytes.maketrans(
+    b"ACGTUMRWSYKVHDBNacgtumrwsykvhdbn",
+    b"TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn",
+)
+
+
+def revcomp(seq:str):
+    """reverse complement of a nucleotide sequence (IUPAC codes are complemented)"""
+    return seq.encode().translate(COMPLEMENT)[::-1].decode()
+
+
+def indexpath(f:str, suffix:str, index_dir:str=None):
+    """index file of f : next to f, or in index_dir under a name unique to the path of f"""
+    if index_dir is None:
+        return f + suffix
+    key = hashlib.sha1(os.path.abspath(f).encode()).hexdigest()[:12]
+    return os.path.join(index_dir, "%s_%s%s" % (key, os.path.basename(f), suffix))
+
+
+class FaiIndex:
+    """.fai index of a plain fasta file
+
+    Parameter
+    ---------
+    f : str
+        fasta file, all lines of a record but the last must have the same length
+    index_dir : str
+        directory of the index, next to the fasta file by default
+    """
+    def __init__(self, f:str, index_dir:str=None):
+        self.fasta = f
+        self.records = {}
+        # an index written to the temporary directory by a previous run is reused as well
+        paths = [indexpath(f, ".fai", index_dir), indexpath(f, ".fai", tempfile.gettempdir())]
+        for self.path in paths:
+            if os.path.exists(self.path) and os.path.getmtime(self.path) >= os.path.getmtime(f):
+                self.load()
+                return
+        self.path = paths[0]
+        self.build()
+
+    def build(self):
+        logging.info("indexing %s" % self.fasta)
+        with open(self.fasta, 'rb') as stream:
+            if stream.read(2) in (b"\x1f\x8b", b"\x28\xb5"):
+                raise ValueError("Only plain fasta files can be indexed : %s" % self.fasta)
+            stream.seek(0)
+            name = None
+            pos = 0
+            for line in stream:
+                if line.startswith(b">"):
+                    name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ""
+                    if name in self.records:
+                        raise ValueError("Duplicated sequence name %s in %s" % (name, self.fasta))
+                    record = self.records[name] = [0, pos + len(line), 0, 0, False]
+                elif name is not None and line.strip():
+                    bases = len(line.rstrip(b"\r\n"))
+                    if record[4] or (record[2] and bases > record[2]):
+                        raise ValueError("Lines of different lengths in %s (%s), the fasta file can not be indexed" % (name, self.fasta))
+                    if not record[2]:
+                        record[2], record[3] = bases, len(line)
+                    elif bases < record[2]:
+                        # only the last line of a record can be shorter
+                        record[4] = True
+                    record[0] += bases
+                pos += len(line)
+        self.records = {name : tuple(record[:4]) for name, record in self.records.items()}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.write()
+        except OSError as err:
+            logging.warning("can not write %s (%s), the index is written to %s" % (self.path, err, tempfile.gettempdir()))
+            self.path = indexpath(self.fasta, ".fai", tempfile.gettempdir())
+            self.write()
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as stream:
+            for name, (length, offset, linebases, linewidth) in self.records.items():
+                stream.write("%s\t%i\t%i\t%i\t%i\n" % (name, length, offset, linebases, linewidth))
+        os.replace(tmp, self.path)
+
+    def load(self):
+        with open(self.path) as stream:
+            for line in stream:
+                name, length, offset, linebases, linewidth = line.rstrip("\n").split("\t")[:5]
+                self.records[name] = (int(length), int(offset), int(linebases), int(linewidth))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def length(self, name:str):
+        return self.records[name][0]
+
+    def _byte(self, name:str, pos:int):
+        length, offset, linebases, linewidth = self.records[name]
+        return offset + pos // linebases * linewidth + pos % linebases
+
+    def fetch(self, regions):
+        """subsequences of several regions, the fasta file is mapped once
+
+        Parameter
+        ---------
+        regions : iterable
+            (name, start, end) with 0-based, end-exclusive coordinates, clipped to the sequence
+        Return
+        ------
+        list of str, in regions order
+        """
+        sequences = []
+        with open(self.fasta, 'rb') as stream, mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for name, start, end in regions:
+                if name not in self.records:
+                    raise ValueError("Sequence not found : %s" % name)
+                start = max(0, start)
+                end = min(end, self.length(name))
+                if end <= start:
+                    sequences.append("")
+                    continue
+                chunk = mm[self._byte(name, start):self._byte(name, end - 1) + 1]
+                sequences.append(chunk.replace(b"\n", b"").replace(b"\r", b"").decode())
+        return sequences
+
+    def subsequence(self, name:str, start:int, end:int):
+        """subsequence [start, end) of name (0-based)"""
+        return self.fetch([(name, start, end)])[0]
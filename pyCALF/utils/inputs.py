@@ -0,0 +1,452 @@
+import gzip
+import io
+import logging
+import mmap
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+
+import pyhmmer.easel
+
+from . import faidx
+from . import utils
+from . import seqstore
+from . import tables
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def genomename(f:str, extension:str=None):
+    """genome identifier derived from a fasta file name (file name without extension)"""
+    name = os.path.basename(f)
+    if extension and name.endswith("." + extension.lstrip(".")):
+        return name[:-len(extension.lstrip(".")) - 1]
+    for suffix in (".gz", ".bgz", ".zst"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def parse_input(f:str, extension:str="faa.gz"):
+    """expand pycalf input into genomes
+
+    Parameter
+    ---------
+    f : str
+        yaml file, fasta file, sequence store or directory containing cds fasta files.
+        yaml file is either a mapping genome -> fasta file or a list of fasta files,
+        relative paths are resolved from the yaml file directory.
+        Every genome of a sequence store (see seqstore) maps to the store file.
+    extension : str
+        extension of fasta files when f is a directory
+
+    Return
+    ------
+    genomes : dict
+        genome -> fasta file, in input order
+    """
+    genomes = {}
+    if os.path.isdir(f):
+        for i in sorted(os.listdir(f)):
+            if i.endswith("." + extension.lstrip(".")):
+                genomes[genomename(i, extension)] = os.path.join(f, i)
+        if not genomes:
+            raise ValueError("No file with extension %s in %s" % (extension, f))
+    elif f.endswith((".yaml", ".yml")):
+        import yaml
+        with open(f) as stream:
+            manifest = yaml.safe_load(stream)
+        if isinstance(manifest, list):
+            manifest = {genomename(i, extension): i for i in manifest}
+        if not isinstance(manifest, dict):
+            raise ValueError("yaml input should be a list of fasta files or a mapping genome -> fasta file : %s" % f)
+        root = os.path.dirname(os.path.abspath(f))
+        for genome, fasta in manifest.items():
+            genomes[str(genome)] = os.path.join(root, str(fasta))
+    elif seqstore.isstore(f):
+        genomes = dict.fromkeys(seqstore.SequenceStore(f).genomes(), f)
+    else:
+        genomes[genomename(f, extension)] = f
+
+    for genome, fasta in genomes.items():
+        if not os.path.isfile(fasta):
+            raise FileNotFoundError("Input file not found for %s : %s" % (genome, fasta))
+    return genomes
+
+
+def compression(f:str):
+    """gzip (including bgzip), zstd or None, from the file magic number"""
+    with open(f, 'rb') as stream:
+        magic = stream.read(4)
+    if magic[:2] == GZIP_MAGIC:
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def _pump(source, sink):
+    """copy source to sink in a background thread (zlib / zstd release the GIL)
+
+    An error of the copy is stored in the error attribute of the returned thread.
+    """
+    def copy():
+        try:
+            with source, sink:
+                shutil.copyfileobj(source, sink, 1 << 20)
+        except BrokenPipeError:
+            # the consumer closed the stream early
+            pass
+        except Exception as err:
+            thread.error = err
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+
+class DecompressedStream(io.RawIOBase):
+    """read end of a decompression process or thread (see openinput)
+
+    The decompression is checked at the end of the stream and on close : a failed process
+    (non-zero exit code) or an error of the decompression thread raises OSError, so that a
+    corrupted or truncated input is not read as a shorter one.
+
+    Parameter
+    ---------
+    f : str
+        compressed file
+    stream : binary stream
+        decompressed data
+    process : subprocess.Popen
+        decompression process writing to stream
+    pump : threading.Thread
+        decompression thread writing to stream (see _pump)
+    """
+    def __init__(self, f:str, stream, process=None, pump=None):
+        self.f = f
+        self.stream = stream
+        self.process = process
+        self.pump = pump
+        self.eof = False
+        self.checked = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.stream.readinto(b)
+        if not n:
+            self.eof = True
+            self.check()
+        return n
+
+    def check(self):
+        """wait for the decompression, raise OSError if it failed"""
+        if self.checked:
+            return
+        self.checked = True
+        if self.process is not None:
+            code = self.process.wait()
+            # a stream closed before its end stops the process with SIGPIPE
+            if code and (self.eof or code != -signal.SIGPIPE):
+                raise OSError("Decompression of %s failed, %s exited with code %i" % (self.f, self.process.args[0], code))
+        if self.pump is not None:
+            self.pump.join()
+            if self.pump.error is not None:
+                raise OSError("Decompression of %s failed : %s" % (self.f, self.pump.error)) from self.pump.error
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+            self.check()
+        finally:
+            super().close()
+
+
+def openinput(f:str, threads:int=1):
+    """binary stream of a fasta file, decompressed in parallel with its consumer
+
+    gzip/bgzip and zstd files are decompressed by an external pigz / bgzip / zstd process
+    when available (multithreaded with threads), otherwise by a background thread.
+    Decompression errors are raised by the stream (see DecompressedStream).
+    Plain files are opened as is.
+    """
+    kind = compression(f)
+    if kind is None:
+        return open(f, 'rb')
+    command = None
+    if kind == "gzip":
+        if shutil.which("bgzip"):
+            # bgzip also decompresses plain gzip files
+            command = ["bgzip", "-dc", "-@", str(threads), f]
+        elif shutil.which("pigz"):
+            command = ["pigz", "-dc", "-p", str(threads), f]
+    elif kind == "zstd" and shutil.which("zstd"):
+        command = ["zstd", "-dcq", "-T%i" % threads, f]
+    if command:
+        logging.debug("decompressing %s : %s" % (f, " ".join(command)))
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1 << 20)
+        return io.BufferedReader(DecompressedStream(f, process.stdout, process=process), 1 << 20)
+
+    if kind == "gzip":
+        source = gzip.open(f, 'rb')
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise OSError("zstd compressed input requires the zstd command or the zstandard package : %s" % f)
+        source = zstandard.ZstdDecompressor().stream_reader(open(f, 'rb'))
+    r, w = os.pipe()
+    pump = _pump(source, os.fdopen(w, 'wb'))
+    return io.BufferedReader(DecompressedStream(f, os.fdopen(r, 'rb'), pump=pump), 1 << 20)
+
+
+def readblocks(f:str, blocksize:int=None, threads:int=1):
+    """iterate over blocks of digital sequences of a plain or compressed fasta file"""
+    if compression(f) is None:
+        yield from utils.easelblocks(f, blocksize)
+        return
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    with openinput(f, threads) as stream:
+        with pyhmmer.easel.SequenceFile(stream, format="fasta", digital=True, alphabet=alphabet) as seqs_file:
+            while True:
+                block = seqs_file.read_block(sequences=blocksize)
+                if not block:
+                    break
+                yield block
+
+
+def prefetch(iterable, depth:int=2):
+    """iterate over iterable from a background thread, up to depth items ahead
+
+    Used to read, decompress and digitize the next block while the current one is searched.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as err:
+            items.put(err)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def countsequences(genomes:dict, threads:int=1):
+    """count sequences over all genomes without parsing them"""
+    n = 0
+    # a sequence store is shared by its genomes
+    for f in dict.fromkeys(genomes.values()):
+        if seqstore.isstore(f):
+            n += len(seqstore.SequenceStore(f))
+            continue
+        with openinput(f, threads) as stream:
+            last = b"\n"
+            for chunk in iter(lambda: stream.read(1 << 22), b''):
+                n += chunk.count(b"\n>") + (last == b"\n" and chunk[:1] == b">")
+                last = chunk[-1:]
+    return n
+
+
+class FastaIndex:
+    """offset index of a plain fasta file, read through mmap
+
+    The index (name, offset, length of each record) is written next to the fasta file
+    (.pcfai), or in an index directory, and reused while the fasta file is not modified,
+    so that a subset of sequences (e.g glyx3+ ones) can be re-read by offset instead of
+    staying in memory. If the index can not be written there (e.g read-only input
+    directory), it is written to the temporary directory.
+
+    Parameter
+    ---------
+    f : str
+        plain fasta file
+    index_dir : str
+        directory of the index, next to the fasta file by default
+    """
+    def __init__(self, f:str, index_dir:str=None):
+        self.fasta = f
+        self.offsets = {}
+        # an index written to the temporary directory by a previous run is reused as well
+        paths = [faidx.indexpath(f, ".pcfai", index_dir), faidx.indexpath(f, ".pcfai", tempfile.gettempdir())]
+        for self.path in paths:
+            if os.path.exists(self.path) and os.path.getmtime(self.path) >= os.path.getmtime(f):
+                self.load()
+                return
+        self.path = paths[0]
+        self.build()
+
+    def build(self):
+        logging.info("indexing %s" % self.fasta)
+        if compression(self.fasta) is not None:
+            raise ValueError("Only plain fasta files can be indexed : %s" % self.fasta)
+        if os.path.getsize(self.fasta):
+            with open(self.fasta, 'rb') as stream, mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                starts = [0] if mm[:1] == b">" else []
+                pos = mm.find(b"\n>")
+                while pos >= 0:
+                    starts.append(pos + 1)
+                    pos = mm.find(b"\n>", pos + 1)
+                for i, start in enumerate(starts):
+                    end = starts[i + 1] if i + 1 < len(starts) else len(mm)
+                    eol = mm.find(b"\n", start, end)
+                    header = mm[start + 1:eol if eol >= 0 else end].split()
+                    if header:
+                        self.offsets[header[0]] = (start, end - start)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.write()
+        except OSError as err:
+            logging.warning("can not write %s (%s), the index is written to %s" % (self.path, err, tempfile.gettempdir()))
+            self.path = faidx.indexpath(self.fasta, ".pcfai", tempfile.gettempdir())
+            self.write()
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as stream:
+            for name, (offset, length) in self.offsets.items():
+                stream.write(b"%s\t%i\t%i\n" % (name, offset, length))
+        os.replace(tmp, self.path)
+
+    def load(self):
+        with open(self.path, 'rb') as stream:
+            for line in stream:
+                name, offset, length = line.rstrip(b"\n").split(b"\t")
+                self.offsets[name] = (int(offset), int(length))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def fetch(self, names):
+        """digital sequences of names, in names order"""
+        alphabet = pyhmmer.easel.Alphabet.amino()
+        sequences = []
+        with open(self.fasta, 'rb') as stream, mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for name in names:
+                offset, length = self.offsets[name]
+                record = mm[offset:offset + length].split(b"\n")
+                header = record[0][1:].split(None, 1)
+                sequences.append(pyhmmer.easel.TextSequence(
+                    name = header[0],
+                    description = header[1] if len(header) > 1 else b"",
+                    sequence = b"".join(record[1:]).strip().decode(),
+                ).digitize(alphabet))
+        return sequences
+
+
+def easelgenomes(genomes:dict, blocksize:int=None, threads:int=1, readahead:int=0, qualify:bool=False):
+    """iterate over blocks of digital sequences from several genomes
+
+    Sequences of consecutive genomes are gathered in the same block, so the whole
+    collection is searched in one pass. Each sequence is tagged with its genome
+    through its `source` attribute. Genomes often share accessions (e.g RefSeq WP_*),
+    with qualify sequences are renamed <genome>::<accession> (see tables.qualify) so
+    that hits of a genome are never attributed to another one.
+
+    Parameter
+    ---------
+    genomes : dict
+        genome -> fasta file or sequence store, genomes of a store are read at once
+    blocksize : int
+        maximum number of sequences per block, None to read everything at once
+    threads : int
+        decompression threads (see openinput)
+    readahead : int
+        number of blocks read in a background thread ahead of the consumer, 0 to read
+        blocks on demand
+    qualify : bool
+        prefix sequence names with their genome
+
+    Return
+    ------
+    generator of pyhmmer.easel.DigitalSequenceBlock
+    """
+    def blocks():
+        alphabet = pyhmmer.easel.Alphabet.amino()
+        buffer = []
+        stores = set()
+        for genome, fasta in genomes.items():
+            if fasta in stores:
+                continue
+            logging.debug("reading %s : %s" % (genome, fasta))
+            if seqstore.isstore(fasta):
+                # sequences are already tagged with their genome
+                stores.add(fasta)
+                source = None
+                sequences = seqstore.SequenceStore(fasta).blocks(blocksize)
+            else:
+                source = genome.encode()
+                sequences = readblocks(fasta, blocksize, threads)
+            for block in sequences:
+                for seq in block:
+                    if source is not None:
+                        seq.source = source
+                    if qualify:
+                        seq.name = tables.qualify(seq.source, seq.name)
+                    buffer.append(seq)
+                    if blocksize and len(buffer) == blocksize:
+                        yield pyhmmer.easel.DigitalSequenceBlock(alphabet, buffer)
+                        buffer = []
+        if buffer:
+            yield pyhmmer.easel.DigitalSequenceBlock(alphabet, buffer)
+
+    if readahead:
+        return prefetch(blocks(), readahead)
+    return blocks()
+
+
+def fetchsequences(genomes:dict, keys:list, index_dir:str=None):
+    """re-read sequences from plain fasta files (through their FastaIndex) or sequence stores
+
+    Parameter
+    ---------
+    genomes : dict
+        genome -> fasta file or sequence store
+    keys : list
+        (genome, sequence name) tuples, genome as bytes (see easelgenomes), names
+        qualified by their genome (see tables.qualify) are fetched under the same name
+    index_dir : str
+        directory of the FastaIndex files, next to the fasta files by default
+
+    Return
+    ------
+    list of digital sequences tagged with their genome, in keys order
+    """
+    byfile = {}
+    for genome, name in keys:
+        byfile.setdefault(genomes[genome.decode()], []).append((genome, name))
+    sequences = {}
+    for f, fkeys in byfile.items():
+        names = [tables.accession(name, genome).encode() for genome, name in fkeys]
+        if seqstore.isstore(f):
+            # a store holds several genomes, which may share accessions
+            fetched = seqstore.SequenceStore(f).fetch(names, [genome for genome, _ in fkeys])
+        else:
+            fetched = FastaIndex(f, index_dir).fetch(names)
+        for (genome, name), seq in zip(fkeys, fetched):
+            seq.source = genome
+            seq.name = name
+            sequences[(genome, name)] = seq
+    return [sequences[key] for key in keys]
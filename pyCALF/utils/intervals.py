@@ -0,0 +1,46 @@
+"""half-open interval union and coverage
+
+Coverage of a profile / sequence by a set of alignments is the length of the union of
+their [start, end) intervals, computed by merging the sorted intervals, i.e in
+O(intervals log intervals) without building one object per covered position.
+
+Callers pass HMMER and blastp coordinates as they are, i.e 1-based with an inclusive end
+(hmm_from / hmm_to, env_from / env_to, sstart / send). Read as [start, end), such a span
+counts end - start positions, one less than its inclusive length : this is how pycalf has
+always computed coverages, and coverage thresholds are tuned on it, so do not add 1 to
+the end.
+"""
+
+
+def merge(intervals):
+    """union of [start, end) intervals as sorted, disjoint intervals (empty ones are dropped)"""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def unionlength(intervals):
+    """number of positions covered by at least one [start, end) interval"""
+    return sum(end - start for start, end in merge(intervals))
+
+
+def coverage(intervals, length:int):
+    """fraction of length covered by the union of [start, end) intervals"""
+    return unionlength(intervals) / length
+
+
+def spancoverage(start, end, length):
+    """coverage of a single [start, end) span, works on scalars and on numpy / pandas columns
+
+    start and end are usually 1-based inclusive coordinates (see module docstring), the
+    coverage is then (end - start) / length, e.g 0.99 for an alignment over positions
+    1 to 100 of a 100 residues subject.
+    """
+    return (end - start) / length
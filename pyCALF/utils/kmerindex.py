@@ -0,0 +1,158 @@
+"""k-mer seed index of N-ter references
+
+The index maps every k-mer of standard residues to the references it occurs in. A query
+is only aligned to the references sharing the most k-mers with it (see candidates), so an
+N-ter search costs a few alignments per sequence whatever the size of the reference set.
+Layout (little endian) :
+
+    header   : MAGIC, k, number of references, number of k-mers, number of postings (8s + 4 x uint64)
+    keys     : sorted k-mer codes (int64)
+    offsets  : start of the postings of each k-mer, plus the end of the last one (int64)
+    postings : references of each k-mer, in reference order (int32)
+
+The index is written next to the references (or in an index directory), reused while
+they are not modified, and memory-mapped.
+"""
+import logging
+import os
+import struct
+import tempfile
+
+from . import faidx
+
+
+MAGIC = b"PYCALFK1"
+HEADER = struct.Struct("<8sQQQQ")
+K = 5
+# digital codes of the 20 standard residues of the amino alphabet, k-mers with other codes are skipped
+RESIDUES = 20
+
+
+def kmers(residues, k:int=K):
+    """distinct k-mer codes of a digital sequence (bytes or uint8 array)"""
+    import numpy as np
+    residues = np.frombuffer(bytes(residues), dtype=np.uint8)
+    if len(residues) < k:
+        return np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(residues, k)
+    windows = windows[(windows < RESIDUES).all(axis=1)].astype(np.int64)
+    return np.unique(windows @ (RESIDUES ** np.arange(k - 1, -1, -1, dtype=np.int64)))
+
+
+def pack(stream, references, k:int=K):
+    """write the index of references (digital sequences) at the current position of a binary stream
+
+    Return
+    ------
+    n : int
+        number of distinct k-mers
+    """
+    import numpy as np
+    codes = [kmers(ref.sequence, k) for ref in references]
+    ids = np.repeat(np.arange(len(codes), dtype=np.int32), [len(c) for c in codes])
+    codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.int64)
+    # stable, so that the postings of a k-mer stay in reference order
+    order = np.argsort(codes, kind="stable")
+    keys, starts = np.unique(codes[order], return_index=True)
+    offsets = np.append(starts, len(codes)).astype("<i8")
+    postings = ids[order].astype("<i4")
+    stream.write(HEADER.pack(MAGIC, k, len(references), len(keys), len(postings)))
+    stream.write(keys.astype("<i8").tobytes())
+    stream.write(offsets.tobytes())
+    stream.write(postings.tobytes())
+    return len(keys)
+
+
+def write(f:str, references, k:int=K):
+    tmp = f + ".tmp"
+    with open(tmp, 'wb') as stream:
+        n = pack(stream, references, k)
+    os.replace(tmp, f)
+    return n
+
+
+def _memmap(f:str, dtype:str, offset:int, count:int):
+    import numpy as np
+    if not count:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(f, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+class KmerIndex:
+    """read-only access to a k-mer index
+
+    Parameter
+    ---------
+    f : str
+        index file written by write (or a file embedding an index, see offset)
+    offset : int
+        position of the index in f
+    """
+    def __init__(self, f:str, offset:int=0):
+        self.path = f
+        with open(f, 'rb') as stream:
+            stream.seek(offset)
+            magic, self.k, self.references, nkeys, npostings = HEADER.unpack(stream.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a pycalf k-mer index : %s" % f)
+        start = offset + HEADER.size
+        self.keys = _memmap(f, "<i8", start, nkeys)
+        start += 8 * nkeys
+        self.offsets = _memmap(f, "<i8", start, nkeys + 1)
+        start += 8 * (nkeys + 1)
+        self.postings = _memmap(f, "<i4", start, npostings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, seq, n:int=32, min_seeds:int=1):
+        """references sharing the most k-mers with a digital sequence
+
+        Return
+        ------
+        list of int
+            at most n references with min_seeds shared k-mers or more, in reference order
+        """
+        import numpy as np
+        codes = kmers(seq.sequence, self.k)
+        if not len(codes) or not len(self.keys):
+            return []
+        pos = np.searchsorted(self.keys, codes)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == codes[found]
+        pos = pos[found]
+        if not len(pos):
+            return []
+        starts = self.offsets[pos]
+        lengths = self.offsets[pos + 1] - starts
+        # postings of every shared k-mer, gathered without a python loop
+        shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        refs = self.postings[np.arange(lengths.sum()) + shifts]
+        counts = np.bincount(refs, minlength=self.references)
+        eligible = np.flatnonzero(counts >= min_seeds)
+        if len(eligible) > n:
+            eligible = np.sort(eligible[np.argpartition(-counts[eligible], n - 1)[:n]])
+        return eligible.tolist()
+
+
+def load(f:str, references, k:int=K, index_dir:str=None):
+    """k-mer index of the references of f (fasta file or bundle), built once and reused
+
+    The index is rebuilt when f is newer than the index or when the number of references
+    differs. If the index can not be written next to f (or in index_dir), it is written
+    to the temporary directory.
+    """
+    path = faidx.indexpath(f, ".k%i.pcki" % k, index_dir)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(f):
+        index = KmerIndex(path)
+        if index.k == k and index.references == len(references):
+            return index
+    logging.info("indexing %i N-ter references (k=%i)" % (len(references), k))
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        write(path, references, k)
+    except OSError as err:
+        logging.warning("can not write %s (%s), the index is written to %s" % (path, err, tempfile.gettempdir()))
+        path = faidx.indexpath(f, ".k%i.pcki" % k, tempfile.gettempdir())
+        write(path, references, k)
+    return KmerIndex(path)
@@ -0,0 +1,128 @@
+import contextlib
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+
+
+def peak_rss():
+    """peak resident set size of the process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on linux
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+class Metrics:
+    """wall/CPU time, peak RSS and counters of the pipeline stages
+
+    Stages can be nested (e.g deoverlap within glyzip) and entered several times
+    (e.g once per input block), their times are accumulated.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self.searches = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name:str, wall:float, cpu:float=0):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"wall" : 0, "cpu" : 0, "calls" : 0})
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += 1
+            stage["peak_rss_mb"] = peak_rss()
+
+    def timed(self, iterable, name:str):
+        """iterate over iterable, time spent to produce items goes to stage name"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name:str, n:int=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def search(self, queries:list, sequences:int, residues:int, wall:float):
+        """record one hmmsearch call"""
+        s = {
+            "queries" : queries,
+            "sequences" : sequences,
+            "residues" : residues,
+            "wall" : wall,
+            "sequences_per_sec" : sequences / wall if wall else None,
+            "residues_per_sec" : residues / wall if wall else None,
+        }
+        with self._lock:
+            self.searches.append(s)
+        logging.debug("hmmsearch %s : %i sequences in %.2fs (%.3g residues/s)" % (
+            ",".join(queries), sequences, wall, s["residues_per_sec"] or 0))
+
+    def to_dict(self):
+        return {
+            "wall" : time.perf_counter() - self.started,
+            "peak_rss_mb" : peak_rss(),
+            "stages" : self.stages,
+            "counts" : self.counts,
+            "searches" : self.searches,
+        }
+
+    def write(self, f:str):
+        with open(f, "w") as stream:
+            json.dump(self.to_dict(), stream, indent=2)
+
+    def log(self):
+        for name, stage in self.stages.items():
+            logging.info("%s : %.2fs wall, %.2fs cpu, %.0f MB peak RSS" % (
+                name, stage["wall"], stage["cpu"], stage["peak_rss_mb"]))
+        for name, n in self.counts.items():
+            logging.info("%s : %i" % (name, n))
+
+
+METRICS = Metrics()
+# metrics of the job run by a thread, see collect
+_current = threading.local()
+
+
+def get():
+    """metrics of the current job (see collect), otherwise of the current run"""
+    m = getattr(_current, "metrics", None)
+    return METRICS if m is None else m
+
+
+@contextlib.contextmanager
+def collect(m:Metrics=None):
+    """record the metrics of the calling thread in m (a new Metrics by default) instead of the run ones
+
+    Used by pycalf serve so that each job has its own metrics, dropped with the job,
+    instead of growing the metrics of the process.
+    """
+    m = Metrics() if m is None else m
+    previous = getattr(_current, "metrics", None)
+    _current.metrics = m
+    try:
+        yield m
+    finally:
+        _current.metrics = previous
+
+
+def reset():
+    global METRICS
+    METRICS = Metrics()
+    return METRICS
@@ -0,0 +1,70 @@
+import concurrent.futures
+import logging
+
+
+def shards(sequences, n:int):
+    """split sequences in n contiguous shards of (almost) equal size"""
+    sequences = list(sequences)
+    size, extra = divmod(len(sequences), n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            chunks.append(sequences[start:end])
+        start = end
+    return chunks
+
+
+class ShardExecutor:
+    """run a search function on shards of the input and merge hits in shard order.
+
+    pyhmmer.hmmsearch parallelizes over queries, so a single profile (e.g GlyX3)
+    only uses one core whatever cpus is. Sharding the sequences and searching shards
+    concurrently uses all workers, with threads (pyhmmer releases the GIL) or processes.
+    Z is set to the size of the whole input so that evalues do not depend on sharding.
+
+    Parameter
+    ---------
+    workers : int
+        number of shards searched concurrently
+    backend : str
+        threads or processes
+    """
+    def __init__(self, workers:int=1, backend:str="threads"):
+        if backend not in ("threads", "processes"):
+            raise ValueError("Unknown parallel backend : %s" % backend)
+        self.workers = max(1, workers)
+        self.backend = backend
+        self._pool = None
+        if self.workers > 1:
+            if backend == "processes":
+                self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+            logging.info("%i %s workers" % (self.workers, backend))
+
+    def run(self, func, sequences, *args, **kwargs):
+        """func(shard, *args, **kwargs) -> list of hits, merged in shard order"""
+        if self._pool is None or len(sequences) < 2:
+            return func(sequences, *args, **kwargs)
+        kwargs.setdefault("Z", len(sequences))
+        futures = [
+            self._pool.submit(func, shard, *args, **kwargs)
+            for shard in shards(sequences, self.workers)
+        ]
+        hits = []
+        for future in futures:
+            hits += future.result()
+        return hits
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,228 @@
+"""unfiltered domain-level results of a run, saved once and re-scored with other thresholds
+
+Every domain reported by the GlyX3 and glyzip searches and every N-ter alignment is
+recorded before any threshold is applied, then saved to a numpy archive (raw.npz).
+`pycalf rescore` rebuilds light hit objects from the archive and runs the same
+parsing / filtering / deoverlap code as a search run (see core.rescore).
+
+Domain i-evalues are p-values times the number of searched targets : glyzip i-evalues
+depend on the number of glyx3+ sequences, so p-values are saved as well and glyzip
+i-evalues are computed again against the glyx3+ sequences of the re-scoring (see tophits).
+
+Recording is enabled with reset(True), search functions record through get() as
+they do for metrics.
+"""
+import json
+import threading
+
+from . import utils
+
+
+DOMAIN_COLUMNS = ("seqid", "hmm", "evalue", "i_evalue", "pvalue", "hmm_from", "hmm_to", "target_from", "target_to")
+NTER_COLUMNS = ("qacc", "sacc", "qstart", "qend", "evalue", "coverage")
+INTEGERS = ("hmm_from", "hmm_to", "target_from", "target_to", "qstart", "qend", "length")
+FLOATS = ("evalue", "i_evalue", "pvalue", "coverage")
+
+
+class Alignment:
+    __slots__ = ("hmm_name", "hmm_from", "hmm_to", "target_from", "target_to")
+
+    def __init__(self, hmm_name, hmm_from, hmm_to, target_from, target_to):
+        self.hmm_name = hmm_name
+        self.hmm_from = hmm_from
+        self.hmm_to = hmm_to
+        self.target_from = target_from
+        self.target_to = target_to
+
+
+class Domain:
+    __slots__ = ("i_evalue", "alignment")
+
+    def __init__(self, i_evalue, alignment):
+        self.i_evalue = i_evalue
+        self.alignment = alignment
+
+
+class TargetHit:
+    """same attributes as the pyhmmer.plan7.Hit used by annotcter"""
+    __slots__ = ("name", "evalue", "domains")
+
+    def __init__(self, name, evalue):
+        self.name = name
+        self.evalue = evalue
+        self.domains = []
+
+
+class Target:
+    """same attributes as the pyhmmer.easel.DigitalSequence used by annotcter"""
+    __slots__ = ("name", "source", "length")
+
+    def __init__(self, name, source, length):
+        self.name = name
+        self.source = source
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+class Profile:
+    """same attributes as the pyhmmer.plan7.HMM used by annotcter"""
+    __slots__ = ("name", "M")
+
+    def __init__(self, name, M):
+        self.name = name
+        self.M = M
+
+
+class RawHits:
+    """columnar record of glyx3 / glyzip domains, N-ter alignments and target sequences"""
+    def __init__(self):
+        self.tables = {
+            "glyx3" : {c : [] for c in DOMAIN_COLUMNS},
+            "glyzip" : {c : [] for c in DOMAIN_COLUMNS},
+            "nter" : {c : [] for c in NTER_COLUMNS},
+            "targets" : {"seqid" : [], "title" : [], "length" : []},
+        }
+        self.models = {}
+        self.params = {}
+        self._targets = set()
+        self._lock = threading.Lock()
+
+    def add_tophits(self, stage:str, tophits, hmms, sequences, title:str="-"):
+        """record every domain of the reported hits of hmmsearch tophits (one TopHits per hmm)
+
+        Parameter
+        ---------
+        stage : str
+            glyx3 or glyzip
+        tophits : list of pyhmmer.plan7.TopHits
+        hmms : list
+            queries, for their length
+        sequences : iterable of pyhmmer.easel.DigitalSequence
+            searched sequences, length and title of hit targets are recorded
+        title : str
+            None to use the source of each sequence
+        """
+        rows = {c : [] for c in DOMAIN_COLUMNS}
+        names = set()
+        for queryhits in tophits:
+            for hit in queryhits:
+                if not hit.reported:
+                    continue
+                seqid = utils.tostr(hit.name)
+                names.add(seqid)
+                for dom in hit.domains:
+                    ali = dom.alignment
+                    rows["seqid"].append(seqid)
+                    rows["hmm"].append(utils.tostr(ali.hmm_name))
+                    rows["evalue"].append(hit.evalue)
+                    rows["i_evalue"].append(dom.i_evalue)
+                    rows["pvalue"].append(dom.pvalue)
+                    rows["hmm_from"].append(ali.hmm_from)
+                    rows["hmm_to"].append(ali.hmm_to)
+                    rows["target_from"].append(ali.target_from)
+                    rows["target_to"].append(ali.target_to)
+        with self._lock:
+            for hmm in hmms:
+                self.models[utils.tostr(hmm.name)] = hmm.M
+            for c, values in rows.items():
+                self.tables[stage][c] += values
+            targets = self.tables["targets"]
+            for seq in sequences:
+                seqid = utils.tostr(seq.name)
+                if seqid in names and seqid not in self._targets:
+                    self._targets.add(seqid)
+                    targets["seqid"].append(seqid)
+                    targets["title"].append(seq.source.decode() if title is None else title)
+                    targets["length"].append(len(seq))
+
+    def add_nter(self, rows):
+        """record N-ter alignments (blastp / phmmer rows, see annotnter)"""
+        if not rows:
+            return
+        with self._lock:
+            for c in NTER_COLUMNS:
+                self.tables["nter"][c] += [r[c] for r in rows]
+
+    def save(self, f:str, **params):
+        """save to a numpy archive, params are the thresholds of the run"""
+        import numpy as np
+        arrays = {}
+        for table, columns in self.tables.items():
+            for c, values in columns.items():
+                if c in INTEGERS:
+                    dtype = np.int64
+                elif c in FLOATS:
+                    dtype = np.float64
+                else:
+                    dtype = str
+                arrays["%s__%s" % (table, c)] = np.array([str(utils.tostr(v)) for v in values] if dtype is str else values, dtype=dtype)
+        arrays["models"] = np.array(json.dumps(self.models))
+        arrays["params"] = np.array(json.dumps(dict(self.params, **params), default=str))
+        np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, f:str):
+        import numpy as np
+        raw = cls()
+        with np.load(f) as archive:
+            for key in archive.files:
+                if "__" not in key:
+                    continue
+                table, c = key.split("__", 1)
+                raw.tables[table][c] = archive[key].tolist()
+            raw.models = json.loads(archive["models"].item())
+            raw.params = json.loads(archive["params"].item())
+        return raw
+
+    def tophits(self, stage:str, Z:int=None):
+        """per-target hits rebuilt from recorded domains, in a one item list (see utils.targetview)
+
+        Parameter
+        ---------
+        stage : str
+            glyx3 or glyzip
+        Z : int
+            number of targets domain i-evalues are computed against (from their p-values),
+            None to keep the i-evalues of the search
+        """
+        table = self.tables[stage]
+        if Z is not None and len(table["pvalue"]) != len(table["seqid"]):
+            raise ValueError("raw results saved without domain p-values, i-evalues can not be computed again")
+        hits = {}
+        for i in range(len(table["seqid"])):
+            key = (table["seqid"][i], table["hmm"][i])
+            if key not in hits:
+                hits[key] = TargetHit(table["seqid"][i], table["evalue"][i])
+            hits[key].domains.append(Domain(
+                table["i_evalue"][i] if Z is None else table["pvalue"][i] * Z,
+                Alignment(table["hmm"][i], table["hmm_from"][i], table["hmm_to"][i], table["target_from"][i], table["target_to"][i])
+            ))
+        return [list(hits.values())]
+
+    def targets(self):
+        t = self.tables["targets"]
+        return [Target(name, title.encode(), length) for name, title, length in zip(t["seqid"], t["title"], t["length"])]
+
+    def profile(self, name:str):
+        return Profile(name, self.models[name])
+
+    def nter(self):
+        """N-ter alignment rows (see annotnter.nearest_neighboor)"""
+        columns = [self.tables["nter"][c] for c in NTER_COLUMNS]
+        return [dict(zip(NTER_COLUMNS, values)) for values in zip(*columns)]
+
+
+RAW = None
+
+
+def get():
+    """raw hits recorder of the current run, None when not recorded"""
+    return RAW
+
+
+def reset(enabled:bool=False):
+    global RAW
+    RAW = RawHits() if enabled else None
+    return RAW
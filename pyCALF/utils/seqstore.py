@@ -0,0 +1,193 @@
+"""pre-digitized sequence store
+
+    pycalf pack -i genomes/ -o genomes.pcs
+    pycalf -i genomes.pcs -o res
+
+A store holds the digital residues of every input sequence, so that repeated runs over the
+same proteomes skip fasta parsing and digitization. Layout (little endian) :
+
+    header   : MAGIC, number of sequences, residues size, table size (4 x uint64)
+    residues : digital residues of all sequences, concatenated (uint8)
+    offsets  : start of each sequence in residues, plus the end of the last one (int64, 8-aligned)
+    table    : one "genome<TAB>name<TAB>description" line per sequence (utf-8)
+
+Residues and table are memory-mapped, sequences are only copied when their block is read
+and table lines are only decoded for the sequences read.
+"""
+import argparse
+import logging
+import os
+import struct
+
+import pyhmmer.easel
+
+
+MAGIC = b"PYCALFS1"
+HEADER = struct.Struct("<8sQQQ")
+
+
+def isstore(f:str):
+    """True if f is a sequence store"""
+    if not os.path.isfile(f):
+        return False
+    with open(f, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+
+def _clean(field:bytes):
+    return field.replace(b"\t", b" ").replace(b"\n", b" ")
+
+
+def pack(stream, blocks):
+    """write digital sequences as a store at the current position of a binary stream
+
+    Offsets of the store are relative to its header, so a store can be embedded in
+    another file (see SequenceStore offset).
+
+    Return
+    ------
+    n : int
+        number of sequences written
+    """
+    import numpy as np
+    start = stream.tell()
+    offsets = [0]
+    table = []
+    stream.write(HEADER.pack(MAGIC, 0, 0, 0))
+    for block in blocks:
+        for seq in block:
+            residues = bytes(seq.sequence)
+            stream.write(residues)
+            offsets.append(offsets[-1] + len(residues))
+            table.append(b"\t".join([
+                _clean(seq.source or b"-"), _clean(seq.name), _clean(seq.description or b"")
+            ]))
+    stream.write(b"\0" * (-offsets[-1] % 8))
+    stream.write(np.asarray(offsets, dtype="<i8").tobytes())
+    table = b"\n".join(table)
+    stream.write(table)
+    end = stream.tell()
+    stream.seek(start)
+    stream.write(HEADER.pack(MAGIC, len(offsets) - 1, offsets[-1], len(table)))
+    stream.seek(end)
+    return len(offsets) - 1
+
+
+def write(f:str, blocks):
+    """write digital sequences to a store
+
+    Parameter
+    ---------
+    f : str
+        store file
+    blocks : iterable
+        blocks of digital sequences, the genome of each sequence is its source attribute
+
+    Return
+    ------
+    n : int
+        number of sequences written
+    """
+    tmp = f + ".tmp"
+    with open(tmp, 'wb') as stream:
+        n = pack(stream, blocks)
+    os.replace(tmp, f)
+    return n
+
+
+class SequenceStore:
+    """read-only access to a sequence store
+
+    Parameter
+    ---------
+    f : str
+        store file written by write (pycalf pack)
+    offset : int
+        position of the store in f, for stores embedded in another file (see pack)
+    """
+    def __init__(self, f:str, offset:int=0):
+        self.path = f
+        with open(f, 'rb') as stream:
+            stream.seek(offset)
+            magic, n, size, tablesize = HEADER.unpack(stream.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a pycalf sequence store : %s" % f)
+        import numpy as np
+        self.alphabet = pyhmmer.easel.Alphabet.amino()
+        self._mm = np.memmap(f, dtype=np.uint8, mode="r", offset=offset)
+        start = HEADER.size
+        self.residues = self._mm[start:start + size]
+        start += size + (-size % 8)
+        self.offsets = np.frombuffer(self._mm, dtype="<i8", count=n + 1, offset=start)
+        start += 8 * (n + 1)
+        self.n = n
+        self.table = self._mm[start:start + tablesize]
+        # start of each table line, plus the end of the last one (+1 for its missing newline)
+        self.lines = np.concatenate(([0], np.flatnonzero(self.table == ord("\n")) + 1, [tablesize + 1])) if n else None
+        self._index = None
+
+    def __len__(self):
+        return self.n
+
+    def row(self, i:int):
+        """(genome, name, description) of the i-th sequence"""
+        return bytes(self.table[self.lines[i]:self.lines[i + 1] - 1]).split(b"\t")
+
+    def genomes(self):
+        """genomes of the store, in store order"""
+        return [i.decode() for i in dict.fromkeys(self.row(i)[0] for i in range(len(self)))]
+
+    def sequence(self, i:int):
+        source, name, description = self.row(i)
+        seq = pyhmmer.easel.DigitalSequence(
+            self.alphabet,
+            name = name,
+            description = description,
+            sequence = bytearray(self.residues[self.offsets[i]:self.offsets[i + 1]]),
+        )
+        seq.source = source
+        return seq
+
+    def blocks(self, blocksize:int=None):
+        """iterate over blocks of digital sequences, sources are set to genomes"""
+        blocksize = blocksize or len(self) or 1
+        for start in range(0, len(self), blocksize):
+            yield pyhmmer.easel.DigitalSequenceBlock(
+                self.alphabet,
+                [self.sequence(i) for i in range(start, min(start + blocksize, len(self)))]
+            )
+
+    def fetch(self, names, sources=None):
+        """digital sequences of names (of genomes sources, if given), in names order"""
+        if self._index is None:
+            self._index = {}
+            for i in range(len(self)):
+                source, name, _ = self.row(i)
+                self._index.setdefault((source, name), i)
+                self._index.setdefault(name, i)
+        if sources is None:
+            return [self.sequence(self._index[name]) for name in names]
+        return [self.sequence(self._index[source, name]) for source, name in zip(sources, names)]
+
+
+def main(argv=None):
+    from . import inputs
+    parser = argparse.ArgumentParser(
+        prog="pycalf pack",
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument('-i', dest='input', required=True,
+                        help='yaml file, fasta file or directory containing cds fasta files')
+    parser.add_argument('-e', dest='file_extension', type=str, default="faa.gz",
+                        help='input files extension (default: %(default)s)')
+    parser.add_argument('-o', dest='output', required=True,
+                        help='sequence store')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                        help="decompression threads (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    genomes = inputs.parse_input(args.input, args.file_extension)
+    logging.info("packing %i input file(s) : %s" % (len(genomes), args.input))
+    n = write(args.output, inputs.easelgenomes(genomes, 100000, threads=args.threads, readahead=2))
+    logging.info("done : %i sequences written to %s" % (n, args.output))
@@ -0,0 +1,132 @@
+"""synthetic proteomes with planted calcyanin-like sequences
+
+    python -m pyCALF.utils.synthetic -n 10000 -o synthetic.faa.gz
+
+Planted sequences (calcyanin_*) are made of a N-ter variant from nterdb.fasta followed by
+a glycine region sampled from GlyX3.msa.fa or assembled from Gly1/2/3.msa.fa, with point
+mutations. Decoys are random sequences (decoy_*) and N-ter variants without glycine
+region (nterdecoy_*).
+"""
+import argparse
+import gzip
+import os
+import random
+
+DATASDIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'datas')
+
+AMINO = "ACDEFGHIKLMNPQRSTVWY"
+# approximate amino acid background frequencies (UniProtKB)
+FREQUENCIES = [8.25, 1.37, 5.45, 6.75, 3.86, 7.07, 2.27, 5.96, 5.84, 9.66,
+               2.42, 4.06, 4.70, 3.93, 5.53, 6.56, 5.34, 6.87, 1.08, 2.92]
+
+
+def readfasta(f:str):
+    """name -> ungapped upper case sequence of a (aligned) fasta file"""
+    sequences = {}
+    name = None
+    with open(f) as stream:
+        for line in stream:
+            line = line.strip()
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif name is not None:
+                sequences[name].append(line.replace("-", "").replace(".", "").upper())
+    return {k : "".join(v) for k, v in sequences.items()}
+
+
+def mutate(seq:str, rate:float, rng):
+    return "".join(
+        rng.choices(AMINO, FREQUENCIES)[0] if rng.random() < rate else c
+        for c in seq
+    )
+
+
+def randomseq(length:int, rng):
+    return "".join(rng.choices(AMINO, FREQUENCIES, k=length))
+
+
+class Generator:
+    """synthetic sequence generator
+
+    Parameter
+    ---------
+    datasdir : str
+        directory with GlyX3.msa.fa, Gly1/2/3.msa.fa and nterdb.fasta
+    mutation_rate : float
+        point mutation rate applied to sampled reference sequences
+    seed : int
+    """
+    def __init__(self, datasdir:str=DATASDIR, mutation_rate:float=0.05, seed:int=42):
+        self.rng = random.Random(seed)
+        self.mutation_rate = mutation_rate
+        self.glyx3 = list(readfasta(os.path.join(datasdir, "GlyX3.msa.fa")).values())
+        self.glyzips = [
+            list(readfasta(os.path.join(datasdir, "Gly%i.msa.fa" % i)).values())
+            for i in (1, 2, 3)
+        ]
+        self.nter = list(readfasta(os.path.join(datasdir, "nterdb.fasta")).values())
+
+    def calcyanin(self):
+        nter = mutate(self.rng.choice(self.nter), self.mutation_rate, self.rng)
+        if self.rng.random() < 0.5:
+            gly = self.rng.choice(self.glyx3)
+        else:
+            # Gly1-linker-Gly2-linker-Gly3
+            gly = (randomseq(self.rng.randint(3, 15), self.rng)).join(
+                self.rng.choice(i) for i in self.glyzips
+            )
+        return nter + randomseq(self.rng.randint(5, 30), self.rng) + mutate(gly, self.mutation_rate, self.rng)
+
+    def decoy(self):
+        return randomseq(max(30, int(self.rng.lognormvariate(5.6, 0.5))), self.rng)
+
+    def nterdecoy(self):
+        return mutate(self.rng.choice(self.nter), self.mutation_rate, self.rng) + self.decoy()
+
+    def sequences(self, n:int, planted:int=100, nterdecoys:int=100):
+        """yield (name, sequence), planted sequences are spread over the whole proteome"""
+        planted = min(planted, n)
+        nterdecoys = min(nterdecoys, n - planted)
+        kinds = ["calcyanin"] * planted + ["nterdecoy"] * nterdecoys
+        positions = dict(zip(self.rng.sample(range(n), len(kinds)), kinds))
+        counters = {"calcyanin" : 0, "nterdecoy" : 0, "decoy" : 0}
+        for i in range(n):
+            kind = positions.get(i, "decoy")
+            counters[kind] += 1
+            yield "%s_%i" % (kind, counters[kind]), getattr(self, kind)()
+
+
+def writeproteome(f:str, n:int, planted:int=100, nterdecoys:int=100, mutation_rate:float=0.05, seed:int=42):
+    """write a synthetic proteome (gzipped if f ends with .gz)
+
+    Return
+    ------
+    planted : list
+        names of planted calcyanin-like sequences
+    """
+    generator = Generator(mutation_rate=mutation_rate, seed=seed)
+    opener = gzip.open if f.endswith(".gz") else open
+    names = []
+    with opener(f, "wt") as stream:
+        for name, seq in generator.sequences(n, planted, nterdecoys):
+            if name.startswith("calcyanin_"):
+                names.append(name)
+            stream.write(">%s\n%s\n" % (name, seq))
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', dest='n', type=int, required=True, help="number of sequences")
+    parser.add_argument('-o', dest='output', required=True, help="output fasta file")
+    parser.add_argument('--planted', type=int, default=100, help="number of calcyanin-like sequences (default: %(default)s)")
+    parser.add_argument('--nter-decoys', dest='nterdecoys', type=int, default=100, help="number of N-ter only decoys (default: %(default)s)")
+    parser.add_argument('--mutation-rate', dest='mutation_rate', type=float, default=0.05, help="(default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=42, help="(default: %(default)s)")
+    args = parser.parse_args()
+    writeproteome(args.output, args.n, args.planted, args.nterdecoys, args.mutation_rate, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""hits and summary of the calcyanin search, without heavy dependencies
+
+Hits are kept in a columnar HitTable and summarized in pure python, so the search,
+filter, deoverlap and summarize steps write their tables without pandas (only
+HitTable.to_frame imports numpy / pandas).
+"""
+import array
+import re
+
+
+SUMMARY_COLUMNS = ["accession","flag","nter","cter","is_trusted","title"]
+# in batch mode, sequences are named <genome>::<accession> while they are searched (see qualify)
+GENOME_SEPARATOR = "::"
+
+
+class Hit:
+    """one feature (glyx3, glyzip or nter) of a sequence"""
+    __slots__ = ("seqid","domid","start","end","evalue","coverage","desc","src","title")
+
+    def __init__(self,
+        seqid="",
+        domid="",
+        start:int=0,
+        end:int=0,
+        evalue:float=0,
+        coverage:float=0,
+        desc:str=None,
+        src:str=None,
+        title:str=None,
+        ):
+        self.seqid = seqid
+        self.domid = domid
+        self.start = start
+        self.end = end
+        self.evalue = evalue
+        self.coverage = coverage
+        self.desc = desc
+        self.src = src
+        self.title = title
+
+    def to_dict(self):
+        d = {}
+        for i in self.__slots__:
+            j = getattr(self, i)
+            if isinstance(j, (bytes, bytearray)):
+                d[i] = j.decode('ascii')
+            else:
+                d[i] = j
+
+        return d
+
+
+class HitTable:
+    """columnar storage of hits
+
+    Positions and scores are stored in typed arrays and string columns share 
+    their repeated values (hmm names, desc, title), so a table of millions of hits 
+    uses a fraction of the memory of the Hit objects and converts to a DataFrame 
+    without building a dict per hit.
+    """
+    INTEGERS = ("start","end")
+    FLOATS = ("evalue","coverage")
+    STRINGS = ("seqid","domid","desc","src","title")
+
+    def __init__(self, hits=()):
+        self.columns = {}
+        for i in Hit.__slots__:
+            if i in self.INTEGERS:
+                self.columns[i] = array.array('q')
+            elif i in self.FLOATS:
+                self.columns[i] = array.array('d')
+            else:
+                self.columns[i] = []
+        self._strings = {}
+        self.extend(hits)
+
+    def _intern(self, value):
+        value = tostr(value)
+        return self._strings.setdefault(value, value)
+
+    def append(self, hit:Hit):
+        for i in self.INTEGERS:
+            self.columns[i].append(getattr(hit, i))
+        for i in self.FLOATS:
+            value = getattr(hit, i)
+            self.columns[i].append(float("nan") if value is None else value)
+        self.columns["seqid"].append(tostr(hit.seqid))
+        for i in self.STRINGS[1:]:
+            self.columns[i].append(self._intern(getattr(hit, i)))
+
+    def extend(self, hits):
+        if isinstance(hits, HitTable):
+            for i, column in hits.columns.items():
+                if i in self.STRINGS[1:]:
+                    column = [self._intern(v) for v in column]
+                self.columns[i].extend(column)
+        else:
+            for hit in hits:
+                self.append(hit)
+
+    def __len__(self):
+        return len(self.columns["seqid"])
+
+    def __getitem__(self, i):
+        return Hit(**{c : self.columns[c][i] for c in Hit.__slots__})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def rows(self):
+        """hits as tuples of Hit.__slots__ values, without building Hit objects"""
+        return zip(*(self.columns[c] for c in Hit.__slots__))
+
+    def to_frame(self):
+        import numpy as np
+        import pandas as pd
+        if not len(self):
+            return pd.DataFrame()
+        d = {}
+        for i in Hit.__slots__:
+            # copy so that the table can still grow (arrays are locked while a view exists)
+            if i in self.INTEGERS:
+                d[i] = np.frombuffer(self.columns[i], dtype=np.int64).copy()
+            elif i in self.FLOATS:
+                d[i] = np.frombuffer(self.columns[i], dtype=np.float64).copy()
+            else:
+                d[i] = self.columns[i]
+        return pd.DataFrame(d)
+
+
+def tostr(name):
+    """decode sequence or hmm names returned as bytes by pyhmmer"""
+    if isinstance(name, (bytes, bytearray)):
+        return name.decode('ascii')
+    return name
+
+
+def qualify(genome, name):
+    """name of a sequence unique across genomes : <genome>::<name> (bytes or str, as name)"""
+    if isinstance(name, (bytes, bytearray)):
+        return tostr(genome).encode() + GENOME_SEPARATOR.encode() + bytes(name)
+    return tostr(genome) + GENOME_SEPARATOR + name
+
+
+def accession(seqid, genome):
+    """accession of a sequence named by qualify, seqid is returned as is if it is not prefixed by genome"""
+    seqid = tostr(seqid)
+    prefix = "%s%s" % (tostr(genome), GENOME_SEPARATOR)
+    return seqid[len(prefix):] if genome is not None and seqid.startswith(prefix) else seqid
+
+
+KNOWN_NTER = ["CoBaHMA-type","Y-type","X-type","Z-type"]
+GLY123 = re.compile("Gly1,Gly2,Gly3")
+GLY13 = re.compile("Gly1,Gly3")
+GLYANY = re.compile("Gly(1|2|3)")
+
+
+def summarize(nter , cter):
+    if GLY123.search(cter):
+        if nter in KNOWN_NTER:
+            flag = "Calcyanin with known N-ter"
+        else:
+            flag = "Calcyanin with new N-ter"
+    elif GLY13.search(cter) and nter == "Y-type":
+        flag = "Calcyanin with known N-ter"
+    elif GLYANY.search(cter):
+        if nter in KNOWN_NTER:
+            flag = "Atypical Gly region with known N-ter"
+        else:
+            flag = "Atypical Gly region with new N-ter"
+    else:
+        flag="Ancestral gly containing protein"
+    return flag
+
+
+def summarizerows(hits):
+    """calcyanin modular organization of each sequence of a set of features
+
+    Parameter
+    ---------
+    hits : HitTable or iterable of Hit
+        features (glyx3, glyzip and nter hits)
+    Return
+    ------
+    summary : list
+        one row (SUMMARY_COLUMNS) per seqid, sorted by seqid. cter is the glyzip architecture
+        ordered by start, nter the N-ter type and title the first title of the sequence.
+        Flags are computed once per distinct (nter, cter) pair.
+    """
+    if isinstance(hits, HitTable):
+        hits = hits.rows()
+    else:
+        hits = ((h.seqid, h.domid, h.start, h.end, h.evalue, h.coverage, h.desc, h.src, h.title) for h in hits)
+    zips = {}
+    nters = {}
+    titles = {}
+    for seqid, domid, start, end, evalue, coverage, desc, src, title in hits:
+        seqid = tostr(seqid)
+        domid = "" if domid is None else str(tostr(domid))
+        if titles.get(seqid) is None:
+            titles[seqid] = tostr(title)
+        if desc == "glyzip":
+            zips.setdefault(seqid, []).append((start, domid))
+        elif desc == "nter":
+            nters.setdefault(seqid, []).append(domid)
+    flags = {}
+    summary = []
+    for seqid in sorted(titles):
+        cter = ",".join(domid for _, domid in sorted(zips.get(seqid, ()), key=lambda z: z[0]))
+        nter = "".join(nters.get(seqid, ()))
+        if (nter, cter) not in flags:
+            flags[nter, cter] = summarize(nter, cter)
+        flag = flags[nter, cter]
+        summary.append((
+            seqid, flag, nter, cter,
+            "checked" if flag == "Calcyanin with known N-ter" else "verification required",
+            "-" if titles[seqid] is None else titles[seqid],
+        ))
+    return summary
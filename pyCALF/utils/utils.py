@@ -1,45 +1,13 @@
-from multiprocessing.sharedctypes import Value
+import logging
 import os
-from numpy import select
-import pandas as pd
+import threading
+import time
 
 import pyhmmer.easel
 
-class Hit:
-    def __init__(self,
-        seqid="",
-        domid="",
-        start:int=0,
-        end:int=0,
-        evalue:float=0,
-        coverage:float=0,
-        **kwargs
-        ):
-        
-        
-        
-        self.seqid = seqid
-        self.domid = domid
-        self.start = start
-        self.end = end
-        self.evalue = evalue
-        self.coverage = coverage
-
-        if kwargs:
-            self.__dict__.update(**kwargs)
-            
-
-
-    def to_dict(self):
-        d = {}
-        for i,j in vars(self).items():
-            if isinstance(j, (bytes, bytearray)):
-                d[i] = j.decode('ascii')
-            else:
-                d[i] = j
-
-        return d
-
+from . import metrics
+from . import intervals
+from .tables import Hit, HitTable, tostr, summarize, summarizerows, SUMMARY_COLUMNS, KNOWN_NTER
 
 def easelhmm(f:str):
     with pyhmmer.plan7.HMMFile(f) as hmm_file:
@@ -47,6 +15,52 @@ def easelhmm(f:str):
     return hmm
 
 
+def easelhmms(f:str):
+    """all hmm profiles of a file (e.g datas/all.hmm)"""
+    with pyhmmer.plan7.HMMFile(f) as hmm_file:
+        return list(hmm_file)
+
+
+class Model:
+    """pyhmmer.plan7.HMM with its optimized profile, built once and reused by every search.
+
+    pyhmmsearch uses a copy of the optimized profile instead of rebuilding 
+    Profile / OptimizedProfile from the HMM at each call, the copy allows 
+    concurrent searches with the same model.
+
+    OptimizedProfile can not be pickled : a Model is pickled as its HMM and background
+    (e.g for the processes backend of parallel.ShardExecutor) and the optimized profile
+    is built again, on first use, in the process that unpickles it.
+    """
+    def __init__(self, hmm, background=None):
+        self.hmm = hmm
+        self.name = hmm.name
+        self.M = hmm.M
+        if background is None:
+            background = pyhmmer.plan7.Background(hmm.alphabet)
+        self.background = background
+        self._profile = None
+        self._lock = threading.Lock()
+
+    @property
+    def profile(self):
+        with self._lock:
+            if self._profile is None:
+                profile = pyhmmer.plan7.Profile(self.hmm.M, self.hmm.alphabet)
+                profile.configure(self.hmm, self.background)
+                self._profile = profile.to_optimized()
+        return self._profile
+
+    def optimized(self):
+        return self.profile.copy()
+
+    def __getstate__(self):
+        return {"hmm" : self.hmm, "background" : self.background}
+
+    def __setstate__(self, state):
+        self.__init__(state["hmm"], state["background"])
+
+
 def easelfasta(f:str,digital:bool=True):
     try:
         with pyhmmer.easel.SequenceFile(f, digital=digital) as seqs_file:
@@ -56,7 +70,91 @@ def easelfasta(f:str,digital:bool=True):
             return [ s.digitize(pyhmmer.easel.Alphabet.amino())  for s in list(seqs_file)]
 
 
+def easelblocks(f:str,blocksize:int=None):
+    """iterate over a fasta file by blocks of digital sequences
+
+    Parameter
+    ---------
+    f : str
+        fasta file (plain or gzipped)
+    blocksize : int
+        maximum number of sequences per block, None to read the whole file at once
+
+    Return
+    ------
+    generator of pyhmmer.easel.DigitalSequenceBlock
+    """
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    nread = 0
+    try:
+        with pyhmmer.easel.SequenceFile(f, digital=True, alphabet=alphabet) as seqs_file:
+            while True:
+                block = seqs_file.read_block(sequences=blocksize)
+                if not block:
+                    break
+                nread += len(block)
+                yield block
+    except ValueError:
+        # same fallback as easelfasta, skipping sequences already yielded
+        with pyhmmer.easel.SequenceFile(f, digital=False) as seqs_file:
+            skipped = 0
+            while True:
+                block = seqs_file.read_block(sequences=blocksize)
+                if not block:
+                    break
+                seqs = [s.digitize(alphabet) for s in block]
+                if skipped < nread:
+                    n = min(nread - skipped, len(seqs))
+                    seqs = seqs[n:]
+                    skipped += n
+                if seqs:
+                    yield pyhmmer.easel.DigitalSequenceBlock(alphabet, seqs)
+
+
+class SequenceIndex:
+    """name -> sequence index, built once and shared by the different stages.
+
+    Duplicated accessions are reported, the first sequence is kept 
+    (as getseqbyname does) unless unique is True in which case a ValueError is raised.
+    """
+    def __init__(self, sequences, unique:bool=False):
+        self.sequences = []
+        self.duplicates = []
+        self._index = {}
+        for seq in sequences:
+            if seq.name in self._index:
+                self.duplicates.append(seq.name)
+                continue
+            self._index[seq.name] = seq
+            self.sequences.append(seq)
+        if self.duplicates:
+            msg = "%i duplicated sequence accession(s) : %s" % (
+                len(self.duplicates), 
+                ",".join(tostr(i) for i in self.duplicates[:10]) + ("..." if len(self.duplicates) > 10 else "")
+            )
+            if unique:
+                raise ValueError(msg)
+            logging.warning(msg)
+
+    def __getitem__(self, name):
+        try:
+            return self._index[name]
+        except KeyError:
+            raise ValueError("Sequence not found : %s" % name)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self.sequences)
+
+    def __len__(self):
+        return len(self.sequences)
+
+
 def getseqbyname(name, sequences:list):
+    if isinstance(sequences, SequenceIndex):
+        return sequences[name]
     for i in sequences:
         if i.name == name:
             return i
@@ -65,14 +163,30 @@ def getseqbyname(name, sequences:list):
 
 def pyhmmsearch(sequences:list,hmms:list,cpus=4,**kwargs):
     assert isinstance(hmms,list)
-    assert isinstance(sequences,list)    
+    assert isinstance(sequences,(list, pyhmmer.easel.DigitalSequenceBlock))
     
     for hmm in hmms:
-        assert isinstance(hmm, pyhmmer.plan7.HMM)
+        assert isinstance(hmm, (pyhmmer.plan7.HMM, Model))
     for seq in sequences:
         assert isinstance(seq, pyhmmer.easel.DigitalSequence)
 
-    all_hits = list(pyhmmer.hmmsearch(hmms,sequences, cpus=4 , **kwargs))
+    queries = [hmm.optimized() if isinstance(hmm, Model) else hmm for hmm in hmms]
+    start = time.perf_counter()
+    all_hits = list(pyhmmer.hmmsearch(queries,sequences, cpus=cpus , **kwargs))
+    m = metrics.get()
+    for hmm, tophits in zip(hmms, all_hits):
+        # sequences eliminated by the filter cascade are not in tophits, 
+        # hits above the reporting thresholds (E, domE) are not annotated (see targetview)
+        name = tostr(hmm.name)
+        m.count(name + "_searched", len(sequences))
+        m.count(name + "_past_filters", len(tophits))
+        m.count(name + "_reported", sum(1 for hit in tophits if hit.reported))
+    m.search(
+        [tostr(hmm.name) for hmm in hmms],
+        len(sequences),
+        sum(len(seq) for seq in sequences),
+        time.perf_counter() - start
+    )
     return all_hits
 
 # def domBeloweEvalue(domains:pyhmmer.plan7.Hits , i_evalue:float = 1e-4):
@@ -85,11 +199,13 @@ def pyhmmsearch(sequences:list,hmms:list,cpus=4,**kwargs):
 
 def targetview(tophits):
     """
-        hits : list of query hmm tophits
+        hits : list of query hmm tophits, only reported hits are kept
     """
     targets = {}
     for queryhmmhits in tophits:
         for hit in queryhmmhits:
+            if not getattr(hit, "reported", True):
+                continue
             if hit.name not in targets:
                 targets[hit.name] = []
             targets[hit.name].append(hit)
@@ -103,16 +219,10 @@ def hitcoverage(
     """
         per query (hmm in case of hmmsearch) cumulative coverage.
     """    
-    poscovered = []
-    for domain in hit.domains:
-        poscovered += list(
-            range(
-                domain.alignment.hmm_from,
-                domain.alignment.hmm_to,
-            )
-        )
-    cov = len(list(set(poscovered)))/hmm_query_length
-    return cov
+    return intervals.coverage(
+        [(domain.alignment.hmm_from, domain.alignment.hmm_to) for domain in hit.domains],
+        hmm_query_length
+    )
 
 
 def filtertophit(tophits,evalue):
@@ -136,11 +246,11 @@ def _reload():
     importlib.reload(utils)
 
 
-def writefasta(sequences:list,file:str):
+def writefasta(sequences:list,file:str,mode:str='w'):
     f = os.path.abspath(file)
     if not os.path.isdir(os.path.dirname(f)):
         os.makedirs(os.path.dirname(f) , exist_ok = True)
-    with open(f,'w') as stream:
+    with open(f,mode) as stream:
         for seq in sequences:
             assert isinstance(seq,pyhmmer.easel.DigitalSequence)
             stream.write(">{} {}\n".format(seq.name.decode('ascii') , seq.description.decode('ascii') ))
@@ -149,25 +259,6 @@ def writefasta(sequences:list,file:str):
 
 
 def maketable(data:list):
-    d = [i.to_dict() for i in data]
-    df = pd.DataFrame(d)
-    return df
-
-        
-def summarize(nter , cter):
-    import re
-    if re.search("Gly1,Gly2,Gly3",cter):
-        if nter in ["CoBaHMA-type","Y-type","X-type","Z-type"]:
-            flag = "Calcyanin with known N-ter"
-        else:
-            flag = "Calcyanin with new N-ter"
-    elif re.search("Gly1,Gly3",cter) and nter == "Y-type":
-        flag = "Calcyanin with known N-ter"
-    elif re.search ("Gly(1|2|3)",cter):
-        if nter in ["CoBaHMA-type","Y-type","X-type","Z-type"]:
-            flag = "Atypical Gly region with known N-ter"
-        else:
-            flag = "Atypical Gly region with new N-ter"
-    else:
-        flag="Ancestral gly containing protein"
-    return flag
+    if not isinstance(data, HitTable):
+        data = HitTable(data)
+    return data.to_frame()
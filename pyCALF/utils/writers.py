@@ -0,0 +1,229 @@
+"""append-as-you-go output tables
+
+Tables are written chunk by chunk (e.g one chunk per input block) instead of once at the
+end of the run, so hits do not have to be kept in memory and the rows of the chunks
+already annotated are usable if a job is killed. Tables are csv (default), gzipped csv
+(one gzip member per chunk, a truncated file is readable up to the last chunk) or parquet
+(one row group per chunk, requires pyarrow, readable once the run is over).
+
+csv and gzipped csv tables can be reopened at a chunk boundary (see offset), which
+is how a resumed run (see checkpoint) carries on from its last checkpoint.
+"""
+import csv
+import gzip
+import io
+import logging
+import os
+
+from . import tables
+
+
+FORMATS = ("csv", "csv.gz", "parquet")
+HIT_COLUMNS = list(tables.Hit.__slots__)
+SUMMARY_COLUMNS = tables.SUMMARY_COLUMNS[:5]
+
+
+class TableWriter:
+    """table written by chunks of rows
+
+    Parameter
+    ---------
+    path : str
+        output file without extension, the extension of fmt is added
+    columns : list
+        columns written, in this order
+    fmt : str
+        csv, csv.gz or parquet
+    sep : str
+        csv delimiter
+    integers, floats : list
+        numeric columns (parquet schema), other columns are strings
+    offset : int
+        append to the existing table truncated to offset bytes instead of
+        writing a new one (csv and csv.gz only)
+    """
+    def __init__(self, path:str, columns:list, fmt:str="csv", sep:str="\t", integers=(), floats=(), offset:int=None):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format : %s" % fmt)
+        self.path = path + "." + fmt
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.sep = sep
+        self.rows = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if offset and fmt == "parquet":
+            raise ValueError("parquet tables can not be appended to")
+        if fmt == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("parquet output requires pyarrow")
+            types = {c : pyarrow.int64() if c in integers else pyarrow.float64() if c in floats else pyarrow.string() for c in self.columns}
+            self._schema = pyarrow.schema([(c, types[c]) for c in self.columns])
+            self._stream = pyarrow.parquet.ParquetWriter(self.path, self._schema)
+        elif offset:
+            with open(self.path, "ab") as stream:
+                stream.truncate(offset)
+        else:
+            open(self.path, "w").close()
+            self._append(self.sep.join(self.columns) + "\n")
+
+    def _append(self, text:str):
+        if self.fmt == "csv.gz":
+            with gzip.open(self.path, "at", newline="") as stream:
+                stream.write(text)
+        else:
+            with open(self.path, "a", newline="") as stream:
+                stream.write(text)
+
+    def write(self, rows):
+        """append rows, sequences of values in self.columns order (None and NaN are empty cells)"""
+        rows = [[None if v != v else v for v in row] for row in rows]
+        if not rows:
+            return
+        if self.fmt == "parquet":
+            import pyarrow
+            data = {c : [row[i] for row in rows] for i, c in enumerate(self.columns)}
+            self._stream.write_table(pyarrow.Table.from_pydict(data, schema=self._schema))
+        else:
+            # same cells as pd.DataFrame.to_csv : floats as repr, minimal quoting
+            buffer = io.StringIO()
+            csv.writer(buffer, delimiter=self.sep, lineterminator="\n").writerows(rows)
+            self._append(buffer.getvalue())
+        self.rows += len(rows)
+
+    def tell(self):
+        """size of the table in bytes (a chunk boundary)"""
+        return os.path.getsize(self.path)
+
+    def close(self):
+        if self.fmt == "parquet":
+            self._stream.close()
+
+
+def hittable(path:str, fmt:str="csv", offset:int=None, title:bool=True):
+    """TableWriter of hits (see tables.HitTable.rows), without the title column if not title"""
+    return TableWriter(
+        path, HIT_COLUMNS if title else [c for c in HIT_COLUMNS if c != "title"], fmt,
+        integers=tables.HitTable.INTEGERS,
+        floats=tables.HitTable.FLOATS,
+        offset=offset
+    )
+
+
+class ResultWriter:
+    """intermediate, feature and summary tables of a run, written chunk by chunk
+
+    res_dir/intermediates/calglyx3, calglyzip, calnter, res_dir/features and
+    res_dir/summary. Hit tables and the summary have a title (genome) column in batch
+    mode only, so single file runs keep the columns of the original tables. In batch mode
+    the summary of each genome is appended to res_dir/genomes/<genome>/summary as well,
+    in the same format.
+
+    Parameter
+    ---------
+    res_dir : str
+    fmt : str
+        csv, csv.gz or parquet
+    genomes : list
+        genomes of a batch, None otherwise
+    resume : dict
+        offsets of a previous run (see offsets) the tables are truncated to
+        and appended to, None to write new tables
+    """
+    def __init__(self, res_dir:str, fmt:str="csv", genomes:list=None, resume:dict=None):
+        self.res_dir = res_dir
+        self.fmt = fmt
+        self.genomes = genomes
+        resume = resume or {}
+        offset = lambda path: resume.get(path + "." + fmt)
+        batch = genomes is not None
+        self.glyx3 = hittable(res_dir + "/intermediates/calglyx3", fmt, offset(res_dir + "/intermediates/calglyx3"), batch)
+        self.glyzip = hittable(res_dir + "/intermediates/calglyzip", fmt, offset(res_dir + "/intermediates/calglyzip"), batch)
+        self.nter = hittable(res_dir + "/intermediates/calnter", fmt, offset(res_dir + "/intermediates/calnter"), batch)
+        self.features = hittable(res_dir + "/features", fmt, offset(res_dir + "/features"), batch)
+        self.summary = TableWriter(
+            res_dir + "/summary",
+            SUMMARY_COLUMNS + (["title"] if genomes is not None else []),
+            fmt, sep=";", offset=offset(res_dir + "/summary")
+        )
+        self.reliable = resume.get("reliable", 0)
+        self._genomes = {}
+        for genome in genomes or []:
+            f = self._genomefile(genome)
+            if resume.get(f + "." + fmt):
+                self._genomes[genome] = TableWriter(f, SUMMARY_COLUMNS, fmt, sep=";", offset=resume[f + "." + fmt])
+
+    def _hitrows(self, hits):
+        """rows of hits, without their title out of batch mode (title is the last column)
+
+        In batch mode, seqids qualified by their genome (see tables.qualify) are written
+        as accessions, the genome is in the title column.
+        """
+        rows = hits.rows() if isinstance(hits, tables.HitTable) else tables.HitTable(hits).rows()
+        if self.genomes is None:
+            return (row[:-1] for row in rows)
+        return ((tables.accession(row[0], row[-1]),) + row[1:] for row in rows)
+
+    def writeglyx3(self, hits):
+        self.glyx3.write(self._hitrows(hits))
+
+    def writeannotations(self, glyx3hits, glyziphits, nterhits):
+        """write glyzip and N-ter hits, features and summary of a set of sequences
+
+        Parameter
+        ---------
+        glyx3hits : list or tables.HitTable
+            glyx3 hits of the sequences (already written with writeglyx3)
+        glyziphits, nterhits : list
+        Return
+        ------
+        summary : list
+            summary rows of the sequences (see tables.summarizerows)
+        """
+        self.glyzip.write(self._hitrows(glyziphits))
+        self.nter.write(self._hitrows(nterhits))
+        features = tables.HitTable(glyx3hits)
+        features.extend(glyziphits)
+        features.extend(nterhits)
+        self.features.write(self._hitrows(features))
+        summary = tables.summarizerows(features)
+        if self.genomes is not None:
+            summary = [(tables.accession(row[0], row[5]),) + row[1:] for row in summary]
+        self.summary.write(summary if self.genomes is not None else [row[:5] for row in summary])
+        self.reliable += sum(1 for row in summary if row[4] == "checked")
+        if self.genomes is not None:
+            bygenome = {}
+            for row in summary:
+                bygenome.setdefault(row[5], []).append(row[:5])
+            for genome, rows in bygenome.items():
+                self._genometable(genome).write(rows)
+        return summary
+
+    def _alltables(self):
+        return [self.glyx3, self.glyzip, self.nter, self.features, self.summary] + list(self._genomes.values())
+
+    def offsets(self):
+        """size of every table and reliable calcyanin count, to resume from this point"""
+        offsets = {table.path : table.tell() for table in self._alltables()}
+        offsets["reliable"] = self.reliable
+        return offsets
+
+    def _genomefile(self, genome:str):
+        """summary of a genome, without extension"""
+        return self.res_dir + "/genomes/" + genome + "/summary"
+
+    def _genometable(self, genome:str):
+        if genome not in self._genomes:
+            self._genomes[genome] = TableWriter(self._genomefile(genome), SUMMARY_COLUMNS, self.fmt, sep=";")
+        return self._genomes[genome]
+
+    def close(self):
+        if self.genomes is not None:
+            # genomes without hit get a summary with a header only
+            for genome in self.genomes:
+                self._genometable(genome)
+        for table in self._alltables():
+            table.close()
+        logging.info("%i summary rows written to %s" % (self.summary.rows, self.summary.path))
@@ -0,0 +1,39 @@
+"""shared fixtures : synthetic proteomes and a runner of the pycalf command line"""
+import csv
+import sys
+
+import pytest
+
+from pyCALF.utils import synthetic
+
+
+@pytest.fixture(scope="session")
+def proteome(tmp_path_factory):
+    """plain fasta proteome with planted calcyanin-like sequences"""
+    f = tmp_path_factory.mktemp("inputs") / "proteome.faa"
+    synthetic.writeproteome(str(f), 600, planted=20, nterdecoys=10, seed=7)
+    return f
+
+
+@pytest.fixture
+def pycalf(monkeypatch):
+    """run pycalf with command line arguments (N-ter annotation with the phmmer backend)"""
+    pytest.importorskip("pyhmmer")
+    from pyCALF import main
+
+    def run(*argv):
+        argv = [str(i) for i in argv]
+        if argv and argv[0] not in main.COMMANDS:
+            argv += ["--nter-backend", "phmmer", "--threads", "1"]
+        monkeypatch.setattr(sys, "argv", ["pycalf"] + argv)
+        main.main()
+    return run
+
+
+@pytest.fixture
+def table():
+    """rows of a csv output table as dicts"""
+    def read(f, sep=";"):
+        with open(f, newline="") as stream:
+            return list(csv.DictReader(stream, delimiter=sep))
+    return read
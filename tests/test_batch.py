@@ -0,0 +1,28 @@
+"""batch mode : genomes sharing accessions are annotated separately"""
+import shutil
+
+import pytest
+
+
+@pytest.mark.parametrize("options", [[], ["--mmap"], ["--block-size", "150"]])
+def test_shared_accessions(tmp_path, proteome, pycalf, table, options):
+    genomes = tmp_path / "genomes"
+    genomes.mkdir()
+    for genome in ("g1", "g2"):
+        shutil.copy(proteome, genomes / (genome + ".faa"))
+    pycalf("-i", proteome, "-o", tmp_path / "single")
+    pycalf("-i", genomes, "-e", "faa", "-o", tmp_path / "batch", *options)
+
+    single = table(tmp_path / "single" / "summary.csv")
+    assert single
+    for genome in ("g1", "g2"):
+        assert table(tmp_path / "batch" / "genomes" / genome / "summary.csv") == single
+    summary = table(tmp_path / "batch" / "summary.csv")
+    assert sorted((row["title"], row["accession"]) for row in summary) == sorted(
+        (genome, row["accession"]) for genome in ("g1", "g2") for row in single
+    )
+    for name in ("intermediates/calglyx3.csv", "intermediates/calglyzip.csv", "features.csv"):
+        rows = table(tmp_path / "batch" / name, "\t")
+        assert len(rows) == 2 * len(table(tmp_path / "single" / name, "\t"))
+        # accessions are written without their genome prefix
+        assert all("::" not in row["seqid"] for row in rows)
@@ -0,0 +1,21 @@
+"""cached results are the same as fresh ones"""
+import pytest
+
+from pyCALF.utils import synthetic
+
+
+@pytest.mark.parametrize("options", [[], ["--single-pass"]])
+def test_partial_cache(tmp_path, proteome, pycalf, table, options):
+    # a part of the input is cached by a first run, the rest is searched by the second one
+    part = tmp_path / "part.faa"
+    synthetic.writeproteome(str(part), 300, planted=8, nterdecoys=5, seed=7)
+    with open(proteome) as stream, open(tmp_path / "all.faa", "w") as out:
+        out.write(stream.read() + open(part).read().replace(">", ">part_"))
+    cache = tmp_path / "cache.sqlite"
+    pycalf("-i", tmp_path / "all.faa", "-o", tmp_path / "ref", *options)
+    pycalf("-i", part, "-o", tmp_path / "part", "--cache", cache, *options)
+    pycalf("-i", tmp_path / "all.faa", "-o", tmp_path / "cached", "--cache", cache, *options)
+    for name in ("summary.csv", "intermediates/calglyx3.csv", "intermediates/calglyzip.csv"):
+        sep = ";" if name == "summary.csv" else "\t"
+        rows = lambda path: sorted(tuple(row.values()) for row in table(path, sep))
+        assert rows(tmp_path / "cached" / name) == rows(tmp_path / "ref" / name)
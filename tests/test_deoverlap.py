@@ -0,0 +1,68 @@
+"""glyzip deoverlap : sweep of bestsegments against the former per-residue scan"""
+import random
+
+import pytest
+
+pytest.importorskip("pyhmmer")
+from pyCALF.core import annotcter as cter
+
+
+HMM_LENGTHS = {"Gly1": 61, "Gly2": 60, "Gly3": 57}
+
+
+def per_residue_segments(region, hits):
+    """former deoverlap segmentation, one keep_lowest_evalue call per residue"""
+    l_dom = []
+    l_evalue = []
+    dc = []
+    for p in region:
+        dom, evalue = cter.keep_lowest_evalue(p, hits)
+        if not l_dom:
+            l_dom.append(dom)
+            l_evalue.append(evalue)
+            start = p
+        elif dom != l_dom[-1]:
+            dc.append([start, p - 1])
+            l_dom.append(dom)
+            l_evalue.append(evalue)
+            start = p
+    dc.append([start, p])
+    return l_dom, dc, l_evalue
+
+
+def random_hits(rng, length, ndomains):
+    """sorted (evalue, hmmname, ali_from, ali_to, hmm_len) hits, with tied evalues and hits past the region"""
+    hits = []
+    for _ in range(ndomains):
+        name = rng.choice(sorted(HMM_LENGTHS))
+        start = rng.randrange(0, length + 10)
+        end = start + rng.randrange(0, 120)
+        evalue = rng.choice([1e-5, 1e-10, 1e-20, rng.random() * 1e-4])
+        hits.append((evalue, name, start, end, HMM_LENGTHS[name]))
+    return sorted(hits)
+
+
+def cases(seed, n=300, length=600, domains=30):
+    rng = random.Random(seed)
+    for _ in range(n):
+        size = rng.randrange(1, length)
+        yield range(0, size), random_hits(rng, size, rng.randrange(0, domains))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_bestsegments(seed):
+    for region, hits in cases(seed):
+        assert cter.bestsegments(region, hits) == per_residue_segments(region, hits), hits
+
+
+@pytest.mark.parametrize("hits", [
+    [],
+    [(1e-10, "Gly1", 5, 5, 61)],
+    [(1e-10, "Gly1", 0, 50, 61), (1e-10, "Gly2", 0, 50, 60)],
+    [(1e-20, "Gly3", 10, 20, 57), (1e-10, "Gly1", 0, 50, 61)],
+    [(1e-10, "Gly1", 0, 10, 61), (1e-10, "Gly2", 10, 20, 60)],
+    [(1e-10, "Gly1", 40, 80, 61)],
+])
+def test_bestsegments_edge_cases(hits):
+    region = range(0, 50)
+    assert cter.bestsegments(region, hits) == per_residue_segments(region, hits)
@@ -0,0 +1,31 @@
+"""samtools-style .fai index of nucleotide fasta files"""
+import os
+import tempfile
+
+from pyCALF.utils import faidx
+
+
+def writefasta(f):
+    with open(f, "w") as stream:
+        stream.write(">a desc\nACGTACGTAC\nGTAC\n>b\nTTTTGGGG\nCC\n")
+
+
+def test_fetch(tmp_path):
+    writefasta(tmp_path / "g.fna")
+    index = faidx.FaiIndex(str(tmp_path / "g.fna"))
+    assert index.path == str(tmp_path / "g.fna.fai")
+    assert index.fetch([("a", 8, 12), ("b", 0, 100)]) == ["ACGT", "TTTTGGGGCC"]
+    assert faidx.revcomp("ACGTN") == "NACGT"
+
+
+def test_unwritable_index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    os.makedirs(tmp_path / "tmp")
+    writefasta(tmp_path / "g.fna")
+    # a file in place of the index directory, so that the index can not be written there
+    (tmp_path / "indexes").write_text("")
+    index = faidx.FaiIndex(str(tmp_path / "g.fna"), str(tmp_path / "indexes"))
+    assert os.path.dirname(index.path) == str(tmp_path / "tmp")
+    assert index.subsequence("b", 6, 10) == "GGCC"
+    # reused by the next run
+    assert faidx.FaiIndex(str(tmp_path / "g.fna"), str(tmp_path / "indexes")).path == index.path
@@ -0,0 +1,82 @@
+"""interval union and coverage against the former per-position sets"""
+import random
+
+import pytest
+
+from pyCALF.utils import intervals
+
+
+def per_position_coverage(length, spans):
+    """former hitcoverage, one list item per covered hmm position"""
+    poscovered = []
+    for start, end in spans:
+        poscovered += list(range(start, end))
+    return len(list(set(poscovered))) / length
+
+
+def random_spans(rng, length, ndomains):
+    """overlapping, nested, adjacent, empty and reversed spans"""
+    spans = []
+    for _ in range(ndomains):
+        start = rng.randrange(0, length)
+        kind = rng.random()
+        if kind < 0.1:
+            end = start                                 # empty
+        elif kind < 0.15:
+            end = max(0, start - rng.randrange(1, 10))  # reversed
+        elif kind < 0.3 and spans:
+            start = spans[-1][1]                        # adjacent
+            end = start + rng.randrange(1, 50)
+        else:
+            end = start + rng.randrange(1, length + 1)
+        spans.append((start, min(end, length + 1)))
+    return spans
+
+
+def cases(seed, n=2000, length=400, domains=20):
+    rng = random.Random(seed)
+    for _ in range(n):
+        size = rng.randrange(1, length)
+        yield size, random_spans(rng, size, rng.randrange(0, domains))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_merge(seed):
+    for length, spans in cases(seed):
+        merged = intervals.merge(spans)
+        # sorted, disjoint, not adjacent and not empty
+        assert all(start < end for start, end in merged), merged
+        assert all(a[1] < b[0] for a, b in zip(merged, merged[1:])), merged
+        # same positions as the input spans
+        positions = {p for start, end in spans for p in range(start, end)}
+        assert {p for start, end in merged for p in range(start, end)} == positions
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_coverage(seed):
+    for length, spans in cases(seed):
+        expected = per_position_coverage(length, spans)
+        assert intervals.unionlength(spans) == len({p for start, end in spans for p in range(start, end)})
+        assert intervals.coverage(spans, length) == expected, (length, spans)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_spancoverage(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        length = rng.randrange(1, 500)
+        start = rng.randrange(1, length + 1)
+        end = rng.randrange(start, length + 1)
+        # inclusive 1-based coordinates are counted as end - start (see intervals)
+        assert intervals.spancoverage(start, end, length) == per_position_coverage(length, [(start, end)])
+        assert intervals.spancoverage(start, end, length) == intervals.coverage([(start, end)], length)
+
+
+def test_spancoverage_inclusive_span():
+    assert intervals.spancoverage(1, 100, 100) == 0.99
+
+
+def test_spancoverage_columns():
+    np = pytest.importorskip("numpy")
+    starts, ends = np.array([1, 5, 10]), np.array([50, 5, 30])
+    assert np.allclose(intervals.spancoverage(starts, ends, 50), [0.98, 0, 0.4])
@@ -0,0 +1,24 @@
+"""sharded searches give the same results as a single search"""
+import pickle
+
+import pytest
+
+
+def test_model_pickle():
+    pytest.importorskip("pyhmmer")
+    from pyCALF.utils import synthetic, utils
+    model = utils.Model(utils.easelhmm(synthetic.DATASDIR + "/GlyX3.hmm"))
+    copy = pickle.loads(pickle.dumps(model))
+    assert copy.name == model.name and copy.M == model.M
+    assert copy.optimized().M == model.optimized().M
+
+
+@pytest.mark.parametrize("backend", ["threads", "processes"])
+def test_workers(tmp_path, proteome, pycalf, table, backend):
+    pycalf("-i", proteome, "-o", tmp_path / "ref")
+    pycalf("-i", proteome, "-o", tmp_path / "sharded", "--workers", "3", "--workers-backend", backend)
+    for name in ("summary.csv", "intermediates/calglyx3.csv", "intermediates/calglyzip.csv"):
+        sep = ";" if name == "summary.csv" else "\t"
+        # hits are in shard order, not in evalue order
+        rows = lambda path: sorted(tuple(row.values()) for row in table(path, sep))
+        assert rows(tmp_path / "sharded" / name) == rows(tmp_path / "ref" / name)
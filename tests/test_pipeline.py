@@ -0,0 +1,13 @@
+"""--pipeline gives the same results as a sequential run"""
+import pytest
+
+
+@pytest.mark.parametrize("options", [[], ["--single-pass"]])
+def test_pipeline(tmp_path, proteome, pycalf, table, options):
+    pycalf("-i", proteome, "-o", tmp_path / "ref", *options)
+    pycalf("-i", proteome, "-o", tmp_path / "pipe", "--block-size", "150", "--pipeline", *options)
+    for name in ("summary.csv", "intermediates/calglyx3.csv", "intermediates/calglyzip.csv", "features.csv"):
+        sep = ";" if name == "summary.csv" else "\t"
+        rows = lambda path: sorted(tuple(row.values()) for row in table(path, sep))
+        # glyzip i-evalues are computed against every glyx3+ sequence, not those of a block
+        assert rows(tmp_path / "pipe" / name) == rows(tmp_path / "ref" / name)
@@ -0,0 +1,20 @@
+"""pycalf rescore gives the same results as a search run with the same thresholds"""
+import pytest
+
+
+@pytest.mark.parametrize("options", [[], ["--single-pass"]])
+def test_rescore(tmp_path, proteome, pycalf, table, options):
+    pycalf("-i", proteome, "-o", tmp_path / "run", "--save-raw", *options)
+    pycalf("-i", proteome, "-o", tmp_path / "fresh", "--glyx3-coverage", "0.9", *options)
+    pycalf("rescore", "-r", tmp_path / "run" / "raw.npz", "-o", tmp_path / "rescored", "--glyx3-coverage", "0.9")
+    assert sorted(table(tmp_path / "rescored" / "summary.csv"), key=str) == sorted(
+        table(tmp_path / "fresh" / "summary.csv"), key=str)
+    rows = lambda path: sorted(table(path, "\t"), key=lambda row: (row["seqid"], int(row["start"])))
+    fresh = rows(tmp_path / "fresh" / "intermediates" / "calglyzip.csv")
+    rescored = rows(tmp_path / "rescored" / "intermediates" / "calglyzip.csv")
+    assert len(rescored) < len(rows(tmp_path / "run" / "intermediates" / "calglyzip.csv"))
+    assert [{k : v for k, v in row.items() if k != "evalue"} for row in rescored] == [
+        {k : v for k, v in row.items() if k != "evalue"} for row in fresh]
+    # glyzip i-evalues are computed against the glyx3+ sequences of the re-scoring
+    assert [float(row["evalue"]) for row in rescored] == pytest.approx(
+        [float(row["evalue"]) for row in fresh], rel=1e-6)
@@ -0,0 +1,43 @@
+"""pre-digitized sequence store"""
+import pytest
+
+pyhmmer = pytest.importorskip("pyhmmer")
+
+from pyCALF.utils import seqstore
+
+
+def sequences(genome, names):
+    alphabet = pyhmmer.easel.Alphabet.amino()
+    seqs = []
+    for i, name in enumerate(names):
+        seq = pyhmmer.easel.TextSequence(name=name, description=b"protein %i" % i if i else b"", sequence="MKV" + "A" * i).digitize(alphabet)
+        seq.source = genome
+        seqs.append(seq)
+    return seqs
+
+
+def test_store(tmp_path):
+    f = str(tmp_path / "genomes.pcs")
+    g1 = sequences(b"g1", [b"WP_1", b"WP_2", b"x"])
+    g2 = sequences(b"g2", [b"WP_2", b"y"])
+    assert seqstore.write(f, [g1, g2]) == 5
+    assert seqstore.isstore(f)
+    store = seqstore.SequenceStore(f)
+    assert len(store) == 5
+    assert store.genomes() == ["g1", "g2"]
+    read = [seq for block in store.blocks(2) for seq in block]
+    assert [(s.source, s.name, s.description, s.textize().sequence) for s in read] == [
+        (s.source, s.name, s.description, s.textize().sequence) for s in g1 + g2]
+    # genomes may share accessions
+    fetched = store.fetch([b"WP_2", b"WP_2", b"y"], [b"g2", b"g1", b"g2"])
+    assert [(s.source, s.textize().sequence) for s in fetched] == [(b"g2", "MKV"), (b"g1", "MKVA"), (b"g2", "MKVA")]
+    assert store.fetch([b"x"])[0].source == b"g1"
+
+
+def test_empty_store(tmp_path):
+    f = str(tmp_path / "empty.pcs")
+    assert seqstore.write(f, []) == 0
+    store = seqstore.SequenceStore(f)
+    assert len(store) == 0
+    assert store.genomes() == []
+    assert list(store.blocks()) == []
@@ -0,0 +1,19 @@
+"""--single-pass gives the same results as the glyX3 and glyzip searches"""
+import pytest
+
+
+@pytest.mark.parametrize("options", [[], ["--block-size", "150"], ["--workers", "3"]])
+def test_single_pass(tmp_path, proteome, pycalf, table, options):
+    pycalf("-i", proteome, "-o", tmp_path / "ref")
+    pycalf("-i", proteome, "-o", tmp_path / "single", "--single-pass", *options)
+    assert sorted(table(tmp_path / "single" / "summary.csv"), key=str) == sorted(
+        table(tmp_path / "ref" / "summary.csv"), key=str)
+    rows = lambda path: sorted(table(path, "\t"), key=lambda row: (row["seqid"], int(row["start"])))
+    ref = rows(tmp_path / "ref" / "intermediates" / "calglyzip.csv")
+    single = rows(tmp_path / "single" / "intermediates" / "calglyzip.csv")
+    assert ref
+    assert [{k : v for k, v in row.items() if k != "evalue"} for row in single] == [
+        {k : v for k, v in row.items() if k != "evalue"} for row in ref]
+    # glyzip i-evalues are computed against glyx3+ sequences, not against the whole input
+    assert [float(row["evalue"]) for row in single] == pytest.approx(
+        [float(row["evalue"]) for row in ref], rel=1e-6)
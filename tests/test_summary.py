@@ -0,0 +1,99 @@
+"""summary flags of summarizerows against the original per-row rules"""
+import itertools
+import random
+import re
+
+import pytest
+
+from pyCALF.utils import tables
+
+
+ARCHITECTURES = [
+    [],
+    ["Gly1"],
+    ["Gly2"],
+    ["Gly3"],
+    ["Gly1","Gly3"],
+    ["Gly3","Gly1"],
+    ["Gly1","Gly2"],
+    ["Gly1","Gly2","Gly3"],
+    ["Gly3","Gly2","Gly1"],
+    ["Gly2","Gly1","Gly2","Gly3"],
+    ["Gly1","Gly1","Gly3"],
+]
+NTERS = [None, "CoBaHMA-type", "Y-type", "X-type", "Z-type", "Unknown"]
+
+
+def original_summarize(nter, cter):
+    """flag rules of the original summary.csv, one re.search per row"""
+    if re.search("Gly1,Gly2,Gly3",cter):
+        if nter in ["CoBaHMA-type","Y-type","X-type","Z-type"]:
+            flag = "Calcyanin with known N-ter"
+        else:
+            flag = "Calcyanin with new N-ter"
+    elif re.search("Gly1,Gly3",cter) and nter == "Y-type":
+        flag = "Calcyanin with known N-ter"
+    elif re.search ("Gly(1|2|3)",cter):
+        if nter in ["CoBaHMA-type","Y-type","X-type","Z-type"]:
+            flag = "Atypical Gly region with known N-ter"
+        else:
+            flag = "Atypical Gly region with new N-ter"
+    else:
+        flag="Ancestral gly containing protein"
+    return flag
+
+
+def original_rows(hits):
+    """original summary rows : features grouped by seqid, glyzips ordered by start"""
+    rows = []
+    for seqid in sorted({h.seqid for h in hits}):
+        features = [h for h in hits if h.seqid == seqid]
+        cter = ",".join(h.domid for h in sorted((h for h in features if h.desc == "glyzip"), key=lambda h: h.start))
+        nter = "".join(h.domid for h in features if h.desc == "nter")
+        flag = original_summarize(nter, cter)
+        verif = "checked" if flag == "Calcyanin with known N-ter" else "verification required"
+        rows.append((seqid, flag, nter, cter, verif, features[0].title or "-"))
+    return rows
+
+
+def features(seed):
+    """glyx3, glyzip and nter hits of one sequence per (architecture, nter) pair, in random order"""
+    rng = random.Random(seed)
+    hits = []
+    for i, (architecture, nter) in enumerate(itertools.product(ARCHITECTURES, NTERS)):
+        seqid = "seq_%03i" % i
+        title = rng.choice([None, "genome_a", "genome_b"])
+        hits.append(tables.Hit(seqid, "GlyX3", 1, 400, 1e-50, 0.9, "glyx3", "hmmsearch", title))
+        start = 200
+        for domid in architecture:
+            end = start + rng.randint(20, 60)
+            hits.append(tables.Hit(seqid, domid, start, end, 1e-10, 0.8, "glyzip", "hmmsearch", title))
+            start = end + rng.randint(1, 10)
+        if nter is not None:
+            hits.append(tables.Hit(seqid, nter, 1, 150, 1e-30, 90.0, "nter", "blastp", title))
+    rng.shuffle(hits)
+    return hits
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_summary_flags(seed):
+    hits = features(seed)
+    expected = original_rows(hits)
+    assert len(expected) == len(ARCHITECTURES) * len(NTERS)
+    assert tables.summarizerows(hits) == expected
+    assert tables.summarizerows(tables.HitTable(hits)) == expected
+
+
+def test_summarize_rules():
+    for architecture, nter in itertools.product(ARCHITECTURES, NTERS):
+        cter, nter = ",".join(architecture), nter or ""
+        assert tables.summarize(nter, cter) == original_summarize(nter, cter)
+
+
+def test_trusted_flags():
+    rows = {row[0] : row for row in tables.summarizerows(features(0))}
+    known = [row for row in rows.values() if row[1] == "Calcyanin with known N-ter"]
+    assert known and all(row[4] == "checked" for row in known)
+    assert all(row[4] == "verification required" for row in rows.values() if row not in known)
+    # Gly1,Gly3 is only a known calcyanin with a Y-type N-ter
+    assert {(row[2], row[3]) for row in known if "Gly2" not in row[3]} == {("Y-type", "Gly1,Gly3"), ("Y-type", "Gly1,Gly1,Gly3")}